@@ -0,0 +1,37 @@
+"""Added query embedding cache table
+
+Revision ID: 8b1f4c2d9e10
+Revises: 3c3f9602aa37
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b1f4c2d9e10'
+down_revision: Union[str, Sequence[str], None] = '3c3f9602aa37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'query_embedding_cache',
+        sa.Column('cache_key', sa.String(length=64), nullable=False),
+        sa.Column('dense_model', sa.String(), nullable=False),
+        sa.Column('dim', sa.Integer(), nullable=False),
+        sa.Column('dense', sa.LargeBinary(), nullable=False),
+        sa.Column('sparse', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('cache_key')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('query_embedding_cache')
@@ -3,7 +3,7 @@ import os
 from dataclasses import dataclass
 from dotenv import load_dotenv
 from pinecone.grpc import PineconeGRPC as Pinecone
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from langchain_openai import ChatOpenAI
 
 load_dotenv()  # Loads .env automatically
@@ -12,20 +12,65 @@ load_dotenv()  # Loads .env automatically
 class RAGConfig:
     url: str
     pdfname: str
+    pdf_sha256: str  # expected sha256 of the downloaded PDF (None: trust the first download)
     chunk_size: int
     chunk_overlap: int
+    streaming_ingestion: bool  # stream pages through load/preprocess/chunk/embed instead of full lists
+    page_batch_size: int  # pages chunked together in streaming mode
+    skip_pages: int  # front-matter pages skipped without parsing
+    parse_workers: int  # processes parsing/preprocessing the PDF (1 = single process)
+    pages_per_task: int  # pages per parsing task sent to a worker process
     pinecone_vector_client: Pinecone
     index_name: str
     name_space: str
+    grpc_pool_size: int  # long-lived gRPC handles (one channel each) per Pinecone index
+    grpc_pool_threads: int  # threads per handle for async gRPC calls
+    grpc_timeout: float  # per-call gRPC timeout (s)
+    grpc_keepalive_time_ms: int  # interval between keepalive pings on idle channels
+    grpc_keepalive_timeout_ms: int  # wait for a keepalive ack before the channel is considered dead
     openai_client: OpenAI
+    async_openai_client: AsyncOpenAI  # used by the non-blocking request path
     dense_model: str
     dim: int
     batch_size: int
-    sleep_time: float
+    ingest_workers: int  # concurrent embed+upsert batches during ingestion
+    requests_per_second: float  # initial embedding request rate, adapts to rate-limit responses
+    max_retries: int  # retries per failed embedding/upsert call
+    embedding_store_dir: str  # local content-addressed store of chunk embeddings
+    revalidate_interval: float  # seconds between background vector store readiness checks
+    vector_backend: str  # "pinecone" or "local" (in-process hybrid index)
+    local_index_dir: str  # root directory of local vector indexes
     top_ret_doc: int
     alpha: float
+    dense_timeout: float  # per-call timeout (s) for the dense query embedding
+    sparse_timeout: float  # per-call timeout (s) for the sparse query embedding
+    batch_max_queries: int  # max queries per /rag/retrieve/batch request
+    sparse_encoder: str  # "pinecone" (hosted sparse model) or "local" (in-process BM25)
+    sparse_encoder_path: str  # fitted local sparse encoder statistics
+    merge_chunks: bool  # merge overlapping retrieved chunks and drop near-duplicates
+    duplicate_threshold: float  # min shingle containment for a chunk to count as a near-duplicate
+    mmr_enabled: bool  # diversify the retrieved chunks with maximal marginal relevance
+    mmr_lambda: float  # MMR trade-off: 1 = relevance only, 0 = diversity only
+    mmr_fetch_factor: int  # candidates fetched per returned chunk when diversifying
     model_name: str  # Name of the LLM model (from YAML)
     model_temperature: float  # Temperature for the LLM model (from YAML)
+    max_prompt_tokens: int  # token budget of the whole prompt (system prompt + chunks + conversation)
+    max_history_tokens: int  # part of the budget earlier turns may use (oldest dropped first)
+    blocking_workers: int  # size of the thread pool for blocking I/O on the request path
+    fanout_workers: int  # size of the thread pool fanning out independent calls from sync code
+    batch_search_workers: int  # size of the thread pool running batch retrieval index searches
+    query_cache_size: int  # max entries in the in-memory query embedding cache
+    query_cache_ttl: float  # seconds an in-memory query embedding stays valid
+    query_cache_persistent: bool  # also keep query embeddings in the database
+    query_batch_enabled: bool  # micro-batch concurrent query embedding cache misses
+    query_batch_max_wait_ms: float  # how long the first query of a batch waits for others
+    query_batch_max_size: int  # distinct queries per batch (sent early when full)
+    max_sessions: int  # conversations kept in memory (least recently used evicted first)
+    session_ttl: float  # seconds of inactivity before a conversation is evicted from memory
+    session_history_messages: int  # max chat_history messages replayed when rehydrating a session
+    answer_cache_enabled: bool  # reuse answers to semantically equivalent first questions
+    answer_cache_threshold: float  # min cosine similarity between query embeddings for a hit
+    answer_cache_size: int  # max cached answers (LRU eviction)
 
     @staticmethod
     def from_yaml(path: str) -> "RAGConfig":
@@ -41,20 +86,65 @@ class RAGConfig:
         return RAGConfig(
             url=cfg["knowledge_base"]["url"],
             pdfname=cfg["knowledge_base"]["pdfname"],
+            pdf_sha256=cfg["knowledge_base"]["pdf_sha256"],
             chunk_size=cfg["knowledge_base"]["chunk_size"],
             chunk_overlap=cfg["knowledge_base"]["chunk_overlap"],
+            streaming_ingestion=cfg["knowledge_base"]["streaming"],
+            page_batch_size=cfg["knowledge_base"]["page_batch_size"],
+            skip_pages=cfg["knowledge_base"]["skip_pages"],
+            parse_workers=cfg["knowledge_base"]["parse_workers"],
+            pages_per_task=cfg["knowledge_base"]["pages_per_task"],
             pinecone_vector_client=Pinecone(api_key=pinecone_api_key),
             index_name=cfg["pinecone"]["index_name"],
             name_space=cfg["pinecone"]["name_space"],
+            grpc_pool_size=cfg["pinecone"]["grpc_pool_size"],
+            grpc_pool_threads=cfg["pinecone"]["grpc_pool_threads"],
+            grpc_timeout=cfg["pinecone"]["grpc_timeout"],
+            grpc_keepalive_time_ms=cfg["pinecone"]["grpc_keepalive_time_ms"],
+            grpc_keepalive_timeout_ms=cfg["pinecone"]["grpc_keepalive_timeout_ms"],
             openai_client=OpenAI(api_key=openai_api_key),
+            async_openai_client=AsyncOpenAI(api_key=openai_api_key),
             dense_model=cfg["retriever"]["dense_model"],
             dim=cfg["retriever"]["dim"],
             batch_size=cfg["vector_store"]["batch_size"],
-            sleep_time=cfg["vector_store"]["sleep_time"],
+            ingest_workers=cfg["vector_store"]["workers"],
+            requests_per_second=cfg["vector_store"]["requests_per_second"],
+            max_retries=cfg["vector_store"]["max_retries"],
+            embedding_store_dir=cfg["vector_store"]["embedding_store_dir"],
+            revalidate_interval=cfg["vector_store"]["revalidate_interval"],
+            vector_backend=cfg["vector_store"]["backend"],
+            local_index_dir=cfg["vector_store"]["local_index_dir"],
             top_ret_doc=cfg["retriever"]["top_ret_doc"],
             alpha=cfg["retriever"]["alpha"],
+            dense_timeout=cfg["retriever"]["dense_timeout"],
+            sparse_timeout=cfg["retriever"]["sparse_timeout"],
+            batch_max_queries=cfg["retriever"]["batch_max_queries"],
+            sparse_encoder=cfg["retriever"]["sparse_encoder"],
+            sparse_encoder_path=cfg["retriever"]["sparse_encoder_path"],
+            merge_chunks=cfg["retriever"]["merge_chunks"],
+            duplicate_threshold=cfg["retriever"]["duplicate_threshold"],
+            mmr_enabled=cfg["retriever"]["mmr"],
+            mmr_lambda=cfg["retriever"]["mmr_lambda"],
+            mmr_fetch_factor=cfg["retriever"]["mmr_fetch_factor"],
             model_name=cfg["openai"]["model"],
-            model_temperature=cfg["openai"]["temperature"]
+            model_temperature=cfg["openai"]["temperature"],
+            max_prompt_tokens=cfg["openai"]["max_prompt_tokens"],
+            max_history_tokens=cfg["openai"]["max_history_tokens"],
+            blocking_workers=cfg["concurrency"]["blocking_workers"],
+            fanout_workers=cfg["concurrency"]["fanout_workers"],
+            batch_search_workers=cfg["concurrency"]["batch_search_workers"],
+            query_cache_size=cfg["query_cache"]["max_size"],
+            query_cache_ttl=cfg["query_cache"]["ttl_seconds"],
+            query_cache_persistent=cfg["query_cache"]["persistent"],
+            query_batch_enabled=cfg["query_cache"]["micro_batching"],
+            query_batch_max_wait_ms=cfg["query_cache"]["batch_max_wait_ms"],
+            query_batch_max_size=cfg["query_cache"]["batch_max_size"],
+            max_sessions=cfg["sessions"]["max_sessions"],
+            session_ttl=cfg["sessions"]["ttl_seconds"],
+            session_history_messages=cfg["sessions"]["history_messages"],
+            answer_cache_enabled=cfg["answer_cache"]["enabled"],
+            answer_cache_threshold=cfg["answer_cache"]["similarity_threshold"],
+            answer_cache_size=cfg["answer_cache"]["max_entries"]
         )
 
     def get_llm(self) -> ChatOpenAI:
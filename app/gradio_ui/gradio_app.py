@@ -1,4 +1,5 @@
 import requests
+import json
 from typing import List, Tuple
 import gradio as gr
 import os
@@ -7,43 +8,63 @@ import os
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8888")
 
 
-def chat_with_rag(message: str, history= None) -> str:
+def chat_with_rag(message: str, history= None, request: gr.Request = None):
     """
-    Send message to RAG API and get response.
+    Send message to the streaming RAG API and yield the response as it arrives.
     
     Args:
         message: User message
         history: Chat history
+        request: Gradio request, its session hash is the conversation's memory session
        
         
-    Returns:
-        string of (response)
+    Yields:
+        string of (partial response so far)
     """
+    answer = ""
     try:
         response = requests.post(
-            f"{API_BASE_URL}/rag/chat",
+            f"{API_BASE_URL}/rag/chat/stream",
             json={
-                "message": message
-                
+                "message": message,
+                "session_id": request.session_hash if request else None
             },
-            timeout=30
+            stream=True,
+            timeout=(10, 120)  # (connect, time between streamed tokens)
         )
         response.raise_for_status()
-        data = response.json()
-        return data.get("answer", "No response")
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            #Server-Sent Events: "event: <name>" then "data: <json>", blank line ends an event
+            if not line:
+                event = "message"
+            elif line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):])
+                if event == "error":
+                    yield f"Error: {data.get('detail', 'Unknown error')}"
+                    return
+                if event == "done":
+                    yield data.get("answer", answer) or "No response"
+                    return
+                answer += data.get("token", "")
+                yield answer
+        if not answer:
+            yield "No response"
     except requests.exceptions.Timeout:
-        return "Request timed out. Please try again."
+        yield answer + "\n\nRequest timed out. Please try again."
     except requests.exceptions.ConnectionError:
-        return "Cannot connect to API. Please ensure the server is running."
+        yield "Cannot connect to API. Please ensure the server is running."
     except requests.exceptions.HTTPError as e:
         error_detail = "Unknown error"
         try:
             error_detail = response.json().get("detail", str(e))
         except:
             pass
-        return f"Error: {error_detail}"
+        yield f"Error: {error_detail}"
     except Exception as e:
-        return f"Unexpected error: {str(e)}"
+        yield f"Unexpected error: {str(e)}"
     
 
 #gradio chat interface
@@ -0,0 +1,16 @@
+from app.database import Base
+from sqlalchemy import Column, Integer, String, Text, LargeBinary, DateTime, func
+
+class QueryEmbeddingModel(Base):
+    __tablename__ = "query_embedding_cache"
+
+    # sha256 of normalized query text + dense model + dimension
+    cache_key = Column(String(64), primary_key=True)
+
+    dense_model = Column(String, nullable=False)
+    dim = Column(Integer, nullable=False)
+
+    dense = Column(LargeBinary, nullable=False)   # float32 bytes
+    sparse = Column(Text, nullable=False)         # json {"sparse_indices": [...], "sparse_values": [...]}
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,26 +1,64 @@
 from app.utils.loggers import get_logger
 from fastapi import APIRouter, HTTPException, Depends
-from app.schemas.rag_schema import ChatRequest, ChatResponse, ChatHistorySchema
+from fastapi.responses import StreamingResponse
+from app.schemas.rag_schema import ChatRequest, ChatResponse, ChatHistorySchema, BatchRetrieveRequest, BatchRetrieveResponse
 from app.models.chathistory_model import ChatHistoryModel
 from app.services.vector_db.ensure_vector import create_vectors
-from app.services.rag_chain import rag_assistant, build_prompt_with_context, save_chat
-from app.utils.exceptions import AppBaseException
+from app.services.vector_db.readiness import VectorStoreReadiness
+from app.services.rag_chain import (arag_assistant, rag_assistant_stream, save_chat, asave_chat, NO_ANSWER_MESSAGE,
+                                    answer_flight, aanswer_flight, checkpointer, last_context_usage)
+from app.services.session_memory import load_session_history
+from app.services.agent_registry import agent_registry
+from app.services.retriever.build_retriever import retrieve_chunks_batch, retrieval_flight, aretrieval_flight
+from app.services.retriever.hybrid_retriever import HybridRetriever
+from app.services.vector_db.backends.factory import create_vector_backend
+from app.services.embedding_generation.sparse_encoder import get_sparse_encoder
+from app.utils.concurrency import run_blocking
+from app.services.embedding_generation.query_cache import query_embedding_cache
+from app.services.embedding_generation.query_batcher import query_embedding_batcher
+from app.services.answer_cache import answer_cache
+from app.utils.exceptions import AppBaseException, VectorStoreNotReadyError
 from app.config.config import RAGConfig
 from sqlalchemy.orm import Session
 from app.dependencies import get_db
+from app.database import SessionLocal
+from app.utils.sse import format_sse
 import sys
 import uuid
 
-#thread_id for shorterm memory
-session_id = str(uuid.uuid4()) 
-
 
 config_filepath = "app/config/config.yaml"
 sys_config = RAGConfig.from_yaml(config_filepath)
 
+#in-memory vector store readiness (resolved at startup, revalidated in background)
+vector_readiness = VectorStoreReadiness(sys_config, sys_config.revalidate_interval)
+
 logger = get_logger(__name__)
 
 
+def resolve_session(req: ChatRequest) -> str:
+    '''thread_id for shorterm memory: the client's session, or a new one (returned as memory_thread_id)'''
+    return req.session_id or str(uuid.uuid4())
+
+
+_batch_retriever = None
+
+
+def get_batch_retriever() -> HybridRetriever:
+    '''One retriever shared by all batch retrieval requests'''
+    global _batch_retriever
+    if _batch_retriever is None:
+        _batch_retriever = HybridRetriever(sys_config.pinecone_vector_client,
+                                           sys_config.index_name,
+                                           sys_config.name_space,
+                                           backend=create_vector_backend(sys_config))
+    return _batch_retriever
+
+
+async def aload_history(session_id: str, db: Session):
+    return await run_blocking(load_session_history, session_id, checkpointer, db, sys_config.session_history_messages)
+
+
 
 
 router = APIRouter(prefix="/rag", tags=["rag"])
@@ -30,8 +68,9 @@ router = APIRouter(prefix="/rag", tags=["rag"])
 @router.post("/vectorstore")
 async def ingest_docs():
     try:
-        #chunk and embed docs into vectordb
-        create_vectors(sys_config)
+        #chunk and embed docs into vectordb (off the event loop, serialized with background refreshes)
+        await run_blocking(create_vectors, sys_config)
+        await run_blocking(vector_readiness.mark_ready)
         return {"status": "Embeddings created and upserted to vector store"}
     except AppBaseException as abe:
         logger.exception("Vector ingestion error")
@@ -45,20 +84,31 @@ async def ingest_docs():
 @router.post("/chat", response_model= ChatResponse)
 async def chat(req: ChatRequest, db: Session=  Depends(get_db)):
     try:
-        #Embed vectors in vectordb(if not already embedded)
-        create_vectors(sys_config)  
+        #vector store state is resolved at startup, only check the cached flag here
+        if not vector_readiness.is_ready():
+            raise VectorStoreNotReadyError()
+        session_id = resolve_session(req)
+        #sessions evicted from memory (or served by another worker) are replayed from chat_history
+        history = await aload_history(session_id, db)
         #add user message
-        save_chat(sessionid= session_id, msg= req.message, role= "User", db=db)
-       #chat with rag agent
-        answer = rag_assistant(
+        await asave_chat(sessionid= session_id, msg= req.message, role= "User", db=db)
+        #chat with rag agent (async path: embeddings, search and LLM never block the event loop)
+        agent = agent_registry.get_agent(sys_config)
+        answer = await arag_assistant(
             req.message,
-            [build_prompt_with_context(sys_config)],
-            model=sys_config.get_llm(),
-            session_id=session_id
+            agent,
+            session_id=session_id,
+            history=history
         )
         #add AI answer
-        save_chat(sessionid= session_id, msg= answer, role= "AI Assistant", db=db)
-        return {"answer": answer, "memory_thread_id": session_id}
+        row_id = await asave_chat(sessionid= session_id, msg= answer, role= "AI Assistant", db=db)
+        checkpointer.mark_synced(session_id, row_id)
+        return {"answer": answer, "memory_thread_id": session_id,
+                "context_usage": last_context_usage(agent, session_id)}
+
+    except VectorStoreNotReadyError as vnre:
+        logger.warning("Chat requested before vector store is ready")
+        raise HTTPException(status_code=503, detail=str(vnre))
 
     except AppBaseException as abe:
         logger.exception("Domain error in chat")
@@ -68,7 +118,102 @@ async def chat(req: ChatRequest, db: Session=  Depends(get_db)):
         logger.exception("Unexpected error in chat")
         raise HTTPException(status_code=500, detail="Internal error")
 
+@router.post("/chat/stream")
+async def chat_stream(req: ChatRequest, db: Session=  Depends(get_db)):
+    '''Stream the answer as Server-Sent Events: `token` payloads, then a final `done` event'''
+    if not vector_readiness.is_ready():
+        raise HTTPException(status_code=503, detail=str(VectorStoreNotReadyError()))
+    session_id = resolve_session(req)
+    try:
+        history = await aload_history(session_id, db)
+        #add user message
+        await asave_chat(sessionid= session_id, msg= req.message, role= "User", db=db)
+        agent = agent_registry.get_agent(sys_config)
+    except AppBaseException as abe:
+        logger.exception("Domain error in chat stream")
+        raise HTTPException(status_code=400, detail=str(abe))
+    except Exception:
+        logger.exception("Unexpected error in chat stream")
+        raise HTTPException(status_code=500, detail="Internal error")
+
+    def event_stream():
+        answer_parts = []
+        try:
+            for token in rag_assistant_stream(req.message, agent, session_id=session_id, history=history):
+                answer_parts.append(token)
+                yield format_sse({"token": token})
+
+            answer = "".join(answer_parts).strip() or NO_ANSWER_MESSAGE
+            #the request db session is closed once the response starts, use a fresh one
+            stream_db = SessionLocal()
+            try:
+                row_id = save_chat(sessionid= session_id, msg= answer, role= "AI Assistant", db=stream_db)
+            finally:
+                stream_db.close()
+            checkpointer.mark_synced(session_id, row_id)
+            yield format_sse({"answer": answer, "memory_thread_id": session_id,
+                              "context_usage": last_context_usage(agent, session_id)}, event="done")
+
+        except AppBaseException as abe:
+            logger.exception("Domain error in chat stream")
+            yield format_sse({"detail": str(abe)}, event="error")
+        except Exception:
+            logger.exception("Unexpected error in chat stream")
+            yield format_sse({"detail": "Internal error"}, event="error")
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.post("/retrieve/batch", response_model= BatchRetrieveResponse)
+async def retrieve_batch(req: BatchRetrieveRequest):
+    '''Retrieve chunks for many queries at once: embeddings are batched and index queries run concurrently'''
+    if len(req.queries) > sys_config.batch_max_queries:
+        raise HTTPException(status_code=413,
+                            detail=f"At most {sys_config.batch_max_queries} queries per request")
+    if not vector_readiness.is_ready():
+        raise HTTPException(status_code=503, detail=str(VectorStoreNotReadyError()))
+    try:
+        results = await run_blocking(
+            retrieve_chunks_batch,
+            pinecone_vector_client=sys_config.pinecone_vector_client,
+            index_name=sys_config.index_name,
+            name_space=sys_config.name_space,
+            openai_client=sys_config.openai_client,
+            dense_model=sys_config.dense_model,
+            dim=sys_config.dim,
+            queries=req.queries,
+            top_ret_doc=req.top_k or sys_config.top_ret_doc,
+            alpha=sys_config.alpha,
+            dense_timeout=sys_config.dense_timeout,
+            sparse_timeout=sys_config.sparse_timeout,
+            hybrid_retriever=get_batch_retriever(),
+            sparse_encoder=get_sparse_encoder(sys_config),
+        )
+        return {"results": [{"query": query, "chunks": [vars(chunk) for chunk in chunks]}
+                            for query, chunks in zip(req.queries, results)]}
+
+    except AppBaseException as abe:
+        logger.exception("Domain error in batch retrieval")
+        raise HTTPException(status_code=400, detail=str(abe))
+
+    except Exception:
+        logger.exception("Unexpected error in batch retrieval")
+        raise HTTPException(status_code=500, detail="Internal error")
+
+
 @router.get('/chathistory', response_model= list[ChatHistorySchema])
 async def get_chathistory(db: Session= Depends(get_db)):
     all_chats= db.query(ChatHistoryModel).all()
     return all_chats
+
+
+@router.get('/cache/stats')
+async def get_cache_stats():
+    return {"query_embeddings": query_embedding_cache.stats(),
+            "query_embedding_batches": query_embedding_batcher.stats(),
+            "sessions": checkpointer.stats(),
+            "answers": answer_cache.stats(),
+            "single_flight": {
+                "retrieval": {"sync": retrieval_flight.stats(), "async": aretrieval_flight.stats()},
+                "answers": {"sync": answer_flight.stats(), "async": aanswer_flight.stats()},
+            }}
@@ -1,14 +1,41 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 
 
 class ChatRequest(BaseModel):
     message: str
+    session_id: str | None = None  # memory_thread_id of an earlier answer; a new session if absent
     
     
 class ChatResponse(BaseModel):
     answer: str
     memory_thread_id: str
+    context_usage: dict | None = None  # prompt tokens (system, context, history) and chunks/turns kept
+
+
+BATCH_MAX_TOP_K = 100  # chunks per query a batch retrieval may ask for
+
+
+class BatchRetrieveRequest(BaseModel):
+    queries: list[str]
+    top_k: int | None = Field(default=None, ge=1, le=BATCH_MAX_TOP_K)  # defaults to retriever.top_ret_doc
+
+
+class RetrievedChunkSchema(BaseModel):
+    id: str
+    text: str
+    score: float
+    page: int | None = None
+    source: str | None = None
+
+
+class QueryRetrievalResult(BaseModel):
+    query: str
+    chunks: list[RetrievedChunkSchema]
+
+
+class BatchRetrieveResponse(BaseModel):
+    results: list[QueryRetrievalResult]
 
 
 
@@ -0,0 +1,90 @@
+import os
+import threading
+from app.services.rag_chain import build_agent, SYSTEM_PROMPT_PATH
+from app.services.answer_cache import answer_cache
+from app.utils.fingerprint import compute_agent_fingerprint
+from app.config.config import RAGConfig
+from app.utils.loggers import get_logger
+from app.utils.exceptions import RagChainError
+
+logger = get_logger(__name__)
+
+
+class AgentRegistry:
+    """Process-level cache of the compiled RAG agent.
+
+    The agent graph, LLM client and prompt middleware are built once per
+    agent fingerprint and reused across requests. A change in the relevant
+    config values or in the system prompt file triggers a rebuild.
+
+    With a config path configured, the YAML file is stat'ed per request and
+    reloaded when its mtime or size changes, so editing the agent's settings
+    (model, retrieval, prompt budgets) takes effect without a restart. Other
+    settings (ingestion, caches, pools) are read at startup only.
+    """
+
+    def __init__(self, prompt_path: str = SYSTEM_PROMPT_PATH):
+        self.prompt_path = prompt_path
+        self._fingerprint = None
+        self._agent = None
+        self._lock = threading.Lock()
+        self.config_path = None
+        self._config_stat = None
+        self._config = None
+
+
+    def configure(self, config_path: str):
+        '''Watch config_path; the config passed to get_agent is taken to be its current content'''
+        with self._lock:
+            self.config_path = config_path
+            self._config_stat = self._stat_config()
+            self._config = None
+
+
+    def _stat_config(self):
+        stat = os.stat(self.config_path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+
+    def _current_config(self, config: RAGConfig) -> RAGConfig:
+        '''The given config, or the config file reloaded once it changed on disk'''
+        if self.config_path is None:
+            return config
+        config_stat = self._stat_config()
+        if config_stat != self._config_stat:
+            with self._lock:
+                if config_stat != self._config_stat:
+                    #recorded even if loading fails: a broken file is not re-parsed per request
+                    self._config_stat = config_stat
+                    try:
+                        self._config = RAGConfig.from_yaml(self.config_path)
+                        logger.info(f"Reloaded {self.config_path}")
+                    except Exception as e:
+                        logger.error(f"Error reloading {self.config_path}, keeping the previous config: {e}")
+        return self._config or config
+
+
+    def get_agent(self, config: RAGConfig):
+        '''Return the cached agent, rebuilding it only if its fingerprint changed'''
+        try:
+            config = self._current_config(config)
+            fingerprint = compute_agent_fingerprint(config, self.prompt_path)
+        except OSError as ose:
+            logger.error(f"Error computing agent fingerprint: {ose}")
+            raise RagChainError(f"Error computing agent fingerprint: {ose}")
+
+        if fingerprint == self._fingerprint:
+            return self._agent
+
+        with self._lock:
+            #another request may have rebuilt it while we waited
+            if fingerprint != self._fingerprint:
+                logger.info("Agent fingerprint changed. Compiling RAG agent...")
+                self._agent = build_agent(config, self.prompt_path)
+                self._fingerprint = fingerprint
+                #a new model or system prompt would answer differently
+                answer_cache.set_fingerprint("agent", fingerprint)
+        return self._agent
+
+
+agent_registry = AgentRegistry()
@@ -0,0 +1,131 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+
+class SemanticAnswerCache:
+    """Answers to previous questions, matched by query embedding similarity.
+
+    A cached answer is reused when a new query's embedding is within
+    `similarity_threshold` (cosine) of a cached query and retrieval returned
+    the same chunk IDs, i.e. the LLM would see the same context. Query vectors
+    live in one preallocated float32 matrix (bounded memory, LRU eviction), so
+    a lookup is a single matrix-vector product. All entries are dropped when a
+    fingerprint they depend on (vector store, agent) changes.
+    """
+
+    def __init__(self, max_entries: int = 2000, similarity_threshold: float = 0.95, enabled: bool = True):
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.configure(max_entries, similarity_threshold, enabled)
+
+
+    def configure(self, max_entries: int, similarity_threshold: float, enabled: bool):
+        with self._lock:
+            self.max_entries = max_entries
+            self.similarity_threshold = similarity_threshold
+            self.enabled = enabled
+            self._clear()
+
+
+    def _clear(self):
+        self._matrix = None     # (max_entries, dim) unit-norm query embeddings, allocated on first put
+        self._valid = np.zeros(self.max_entries, dtype=bool)
+        self._entries = {}      # slot -> (chunk_ids, answer)
+        self._lru = OrderedDict()
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+
+    def set_fingerprint(self, name: str, fingerprint):
+        '''Record the current fingerprint of a dependency; a change drops every cached answer'''
+        with self._lock:
+            if self._fingerprints.get(name) == fingerprint:
+                return
+            self._fingerprints[name] = fingerprint
+            if self._entries:
+                logger.info(f"{name} fingerprint changed, invalidating {len(self._entries)} cached answers")
+                self.invalidations += 1
+            self._clear()
+
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32).ravel()
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+    def _find(self, query_vector, chunk_ids):
+        if self._matrix is None or self._matrix.shape[1] != len(query_vector) or not self._entries:
+            return None
+        similarities = self._matrix @ query_vector
+        similarities[~self._valid] = -np.inf
+        candidates = np.flatnonzero(similarities >= self.similarity_threshold)
+        for slot in candidates[np.argsort(-similarities[candidates])]:
+            if self._entries[slot][0] == chunk_ids:
+                return int(slot)
+        return None
+
+
+    def lookup(self, embedding, chunk_ids):
+        '''Return the cached answer for a similar query with the same retrieved chunks, or None'''
+        if not self.enabled:
+            return None
+        query_vector = self._unit(embedding)
+        with self._lock:
+            slot = self._find(query_vector, tuple(chunk_ids))
+            if slot is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._lru.move_to_end(slot)
+            return self._entries[slot][1]
+
+
+    def put(self, embedding, chunk_ids, answer: str):
+        if not self.enabled or not answer or self.max_entries <= 0:
+            return
+        query_vector = self._unit(embedding)
+        chunk_ids = tuple(chunk_ids)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != len(query_vector):
+                self._clear()
+                self._matrix = np.zeros((self.max_entries, len(query_vector)), dtype=np.float32)
+            slot = self._find(query_vector, chunk_ids)
+            if slot is None:
+                if self._free:
+                    slot = self._free.pop()
+                else:
+                    slot, _ = self._lru.popitem(last=False)
+                    self.evictions += 1
+            self._matrix[slot] = query_vector
+            self._valid[slot] = True
+            self._entries[slot] = (chunk_ids, answer)
+            self._lru[slot] = None
+            self._lru.move_to_end(slot)
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "similarity_threshold": self.similarity_threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+answer_cache = SemanticAnswerCache()
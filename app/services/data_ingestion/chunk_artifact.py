@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Iterable, Iterator
+import numpy as np
+from langchain_core.documents import Document
+from app.services.data_ingestion.data_processor import PREPROCESS_VERSION
+from app.config.config import RAGConfig
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+ARTIFACT_DIR = "data/chunk_artifacts"
+
+
+def chunk_artifact_dir(config: RAGConfig, pdf_path: str):
+    '''Artifact directory for the current PDF and preprocessing/chunking parameters,
+    or None if the PDF is not on disk yet'''
+    if not os.path.exists(pdf_path):
+        return None
+    pdf_stat = os.stat(pdf_path)
+    key_payload = {
+        "pdf": os.path.basename(pdf_path),
+        "pdf_size": pdf_stat.st_size,
+        "pdf_mtime": pdf_stat.st_mtime_ns,
+        "preprocess_version": PREPROCESS_VERSION,
+        "skip_pages": config.skip_pages,
+        "chunk_size": config.chunk_size,
+        "chunk_overlap": config.chunk_overlap,
+    }
+    key = hashlib.sha256(json.dumps(key_payload, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(ARTIFACT_DIR, key)
+
+
+class ChunkArtifact:
+    """Columnar on-disk copy of the processed chunks, read memory-mapped.
+
+    Columns (one file each):
+        text.bin      utf-8 chunk texts, concatenated
+        offsets.i64   n + 1 byte offsets into text.bin
+        page.i32      source page of each chunk
+    plus meta.json (source, chunk count, content hash of all chunk texts).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        n = self.meta["n_chunks"]
+        self.offsets = np.memmap(os.path.join(path, "offsets.i64"), dtype=np.int64, mode="r", shape=(n + 1,))
+        self.pages = np.memmap(os.path.join(path, "page.i32"), dtype=np.int32, mode="r", shape=(n,)) \
+            if n else np.empty(0, dtype=np.int32)
+        self.text = np.memmap(os.path.join(path, "text.bin"), dtype=np.uint8, mode="r") \
+            if self.offsets[-1] else np.empty(0, dtype=np.uint8)
+
+    @property
+    def content_hash(self) -> str:
+        return self.meta["content_hash"]
+
+    def __len__(self):
+        return self.meta["n_chunks"]
+
+    def __iter__(self) -> Iterator[Document]:
+        source = self.meta["source"]
+        for i in range(len(self)):
+            text = self.text[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+            yield Document(metadata={"page": int(self.pages[i]), "source": source}, page_content=text)
+
+
+def load_chunk_artifact(path):
+    '''Open a complete artifact, or return None if there is none at path'''
+    if path is None or not os.path.exists(os.path.join(path, "meta.json")):
+        return None
+    try:
+        artifact = ChunkArtifact(path)
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable chunk artifact {path}: {e}")
+        return None
+    logger.info(f"Using chunk artifact {path} ({len(artifact)} chunks)")
+    return artifact
+
+
+def write_through_artifact(chunks: Iterable[Document], path: str) -> Iterator[Document]:
+    '''Yield chunks unchanged while appending them to a new artifact at path.
+
+    Columns are streamed to a temporary directory that is renamed into place
+    only once the input is exhausted, so a partial run never leaves a
+    half-written artifact behind.
+    '''
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    content_sha = hashlib.sha256()
+    offsets, pages = [0], []
+    source = None
+    try:
+        with open(os.path.join(tmp_path, "text.bin"), "wb") as text_file:
+            for chunk in chunks:
+                data = chunk.page_content.encode("utf-8")
+                text_file.write(data)
+                content_sha.update(data)
+                content_sha.update(b"\x00")
+                offsets.append(offsets[-1] + len(data))
+                pages.append(chunk.metadata.get("page") or 0)
+                source = source or chunk.metadata.get("source")
+                yield chunk
+
+        np.asarray(offsets, dtype=np.int64).tofile(os.path.join(tmp_path, "offsets.i64"))
+        np.asarray(pages, dtype=np.int32).tofile(os.path.join(tmp_path, "page.i32"))
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump({"source": source, "n_chunks": len(pages), "content_hash": content_sha.hexdigest()}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+        logger.info(f"Wrote chunk artifact {path} ({len(pages)} chunks)")
+    except BaseException:
+        #upstream failure or the consumer stopped early: the artifact is incomplete, discard it
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
@@ -1,6 +1,7 @@
 import re
+from itertools import islice
 from langchain_core.documents import Document
-from typing import List
+from typing import Iterable, Iterator, List
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from app.utils.loggers import get_logger
 from app.utils.exceptions import DataProcessingError
@@ -13,13 +14,9 @@ def clean_chunk_prefix(text: str) -> str:
     return re.sub(r'^[.:]\s*', '', text)
 
 
-#chunk documents into smaller pieces
-def chunk_documents(docs, chunk_size: int, chunk_overlap: int) -> List[Document]:
-    """Chunk documents into smaller pieces"""
-
-    try:    
-        #recursiveCharacterTextSplitter with medical-specific separators
-        text_splitter = RecursiveCharacterTextSplitter(
+def build_text_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    #recursiveCharacterTextSplitter with medical-specific separators
+    return RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,         # Ideal for clinical explanations
         chunk_overlap=chunk_overlap,      # Preserves continuity
         separators=["\n\n",             # Section boundaries 
@@ -30,19 +27,51 @@ def chunk_documents(docs, chunk_size: int, chunk_overlap: int) -> List[Document]
                     " "
                 ]
                 )
-        
-        all_chunks = []
-        
+
+
+def clean_chunks(chunks) -> Iterator[Document]:
+    for chunk in chunks:
+        src= chunk.metadata.get('source')
+        pg= chunk.metadata.get('page')
+        yield Document(metadata={"page": pg, "source": src},
+                       page_content= clean_chunk_prefix(chunk.page_content))
+
+
+#chunk documents into smaller pieces
+def chunk_documents(docs, chunk_size: int, chunk_overlap: int) -> List[Document]:
+    """Chunk documents into smaller pieces"""
+
+    try:    
+        text_splitter = build_text_splitter(chunk_size, chunk_overlap)
         chunks = text_splitter.split_documents(docs)
-        for chunk in chunks:
-                src= chunk.metadata.get('source')
-                pg= chunk.metadata.get('page')
-                temp_doc= Document(metadata={"page": pg, "source": src},
-                        page_content= clean_chunk_prefix(chunk.page_content))
-                all_chunks.append(temp_doc)
+        all_chunks = list(clean_chunks(chunks))
         logger.info(f"Chunked documents into {len(all_chunks)} pieces")
     except Exception as e:
         logger.error(f"Data processing error in chunk_documents: {e}")
         raise DataProcessingError(f"Failed to chunk documents due to data processing error: {e}")
     logger.info(f"{len(all_chunks)} Text chunks obtained")
-    return all_chunks
\ No newline at end of file
+    return all_chunks
+
+
+def iter_chunk_documents(docs: Iterable[Document], chunk_size: int, chunk_overlap: int,
+                         page_batch_size: int = 16) -> Iterator[Document]:
+    """Lazily chunk a stream of pages, `page_batch_size` pages at a time.
+
+    The splitter works per document, so this yields the same chunks as
+    chunk_documents while only holding one batch of pages in memory.
+    """
+    text_splitter = build_text_splitter(chunk_size, chunk_overlap)
+    doc_iter = iter(docs)
+    n_chunks = 0
+    try:
+        while True:
+            page_batch = list(islice(doc_iter, page_batch_size))
+            if not page_batch:
+                break
+            for chunk in clean_chunks(text_splitter.split_documents(page_batch)):
+                n_chunks += 1
+                yield chunk
+    except Exception as e:
+        logger.error(f"Data processing error in iter_chunk_documents: {e}")
+        raise DataProcessingError(f"Failed to chunk documents due to data processing error: {e}")
+    logger.info(f"{n_chunks} Text chunks obtained")
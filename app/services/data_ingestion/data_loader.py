@@ -1,10 +1,15 @@
 import os
+import hashlib
+import time
 import requests
+import pymupdf
+from tqdm import tqdm
+from app.utils.state_loader import load_state, save_state
 from app.utils.loggers import get_logger
 from langchain_core.documents import Document
-from typing import List
+from typing import Iterator, List
 from langchain_community.document_loaders import PyMuPDFLoader
-from app.utils.exceptions import NetworkError, PDFLoadError
+from app.utils.exceptions import NetworkError, PDFLoadError, DownloadIntegrityError
 
 
 
@@ -12,22 +17,151 @@ logger = get_logger(__name__)
 
 DATA_DIR = "data"
 
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+DOWNLOAD_TIMEOUT = (10, 60)  # (connect, read between chunks) in seconds
+
+
+def file_sha256(path) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK_BYTES), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _content_range(response):
+    '''(first byte, total size) from a Content-Range header ("bytes 100-199/200" or "bytes */200")'''
+    value = response.headers.get("Content-Range", "")
+    try:
+        unit_range, total = value.split(" ", 1)[1].split("/")
+        first = None if unit_range == "*" else int(unit_range.split("-")[0])
+        return first, int(total) if total != "*" else None
+    except (IndexError, ValueError):
+        return None, None
+
+
+def _validator(response):
+    '''Strong ETag or Last-Modified of a response, usable as If-Range value'''
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return response.headers.get("Last-Modified")
+
+
+def _reset_part(part_path):
+    for path in (part_path, f"{part_path}.validator"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _download_part(url, part_path):
+    '''Stream url into part_path, resuming from its current size with an HTTP Range request.
+
+    A resume is only attempted with the validator (ETag/Last-Modified) of the
+    response the part file was started from, sent as If-Range: if the remote
+    file changed, the server answers with the whole new file instead of
+    appending its bytes to stale ones. The final size is checked against the
+    size announced by the server.
+    '''
+    validator_path = f"{part_path}.validator"
+    resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    validator = None
+    if resume_from and os.path.exists(validator_path):
+        with open(validator_path, "r") as f:
+            validator = f.read().strip() or None
+    if resume_from and validator is None:
+        #cannot tell whether the remote file is still the same one
+        logger.info("No validator for the partial download, restarting it")
+        _reset_part(part_path)
+        resume_from = 0
+    headers = {"Range": f"bytes={resume_from}-", "If-Range": validator} if resume_from else {}
+
+    with requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        if response.status_code == 416:
+            #range not satisfiable: complete only if the part file has exactly the remote size
+            _, total = _content_range(response)
+            if total == resume_from:
+                return
+            logger.info(f"Partial download does not match the remote file ({resume_from} vs {total} bytes), restarting")
+            _reset_part(part_path)
+            raise requests.exceptions.ConnectionError("Range not satisfiable, restarting download")
+        response.raise_for_status()
+
+        if resume_from and response.status_code == 206:
+            first, total = _content_range(response)
+            if first != resume_from:
+                _reset_part(part_path)
+                raise requests.exceptions.ConnectionError(f"Server resumed at byte {first} instead of {resume_from}")
+            logger.info(f"Resuming download at byte {resume_from}")
+        else:
+            if resume_from:
+                #Range ignored or the file changed (If-Range mismatch): start over
+                logger.info("Server sent the whole file, restarting download")
+            resume_from = 0
+            length = response.headers.get("Content-Length")
+            total = int(length) if length is not None else None
+            new_validator = _validator(response)
+            with open(validator_path, "w") as f:
+                f.write(new_validator or "")
+
+        with open(part_path, "ab" if resume_from else "wb") as file, \
+                tqdm(total=total, initial=resume_from, unit="B", unit_scale=True, desc=os.path.basename(part_path)) as progress:
+            for block in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                file.write(block)
+                progress.update(len(block))
+            file.flush()
+            os.fsync(file.fileno())
+
+    size = os.path.getsize(part_path)
+    if total is not None and size < total:
+        #connection closed early: the retry resumes from here
+        raise requests.exceptions.ConnectionError(f"Incomplete download: {size} of {total} bytes")
+    if total is not None and size > total:
+        _reset_part(part_path)
+        raise DownloadIntegrityError(f"Downloaded {size} bytes, the server announced {total}")
+
+
 #download data if not present
-def download_data(url, pdfname):
-    '''Download PDF from URL'''
+def download_data(url, pdfname, data_dir=DATA_DIR, max_retries=3, expected_sha256=None):
+    '''Download PDF from URL.
+
+    The file is streamed to `<pdf>.part` in chunks (never buffered in memory),
+    resumed with HTTP Range requests after failures, and atomically renamed
+    once complete. Its sha256 is checked against `expected_sha256` (if given)
+    and recorded in the pipeline state.
+    '''
     
     #create data directory if not exists
-    os.makedirs(DATA_DIR, exist_ok=True)
+    os.makedirs(data_dir, exist_ok=True)
     
      #download file
-    pdf_path = f"{DATA_DIR}/{pdfname}"
+    pdf_path = f"{data_dir}/{pdfname}"
+    part_path = f"{pdf_path}.part"
 
     try:
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        with open(pdf_path, "wb") as file:
-            file.write(response.content)
-        logger.info(f"Success! {pdf_path} downloaded.")
+        for attempt in range(max_retries + 1):
+            try:
+                _download_part(url, part_path)
+                break
+            except requests.exceptions.RequestException as e:
+                if attempt == max_retries:
+                    raise
+                logger.warning(f"Download interrupted ({e}), retrying ({attempt + 1}/{max_retries})")
+                time.sleep(2 ** attempt)
+
+        #hash the assembled file (it may come from several resumed requests)
+        checksum = file_sha256(part_path)
+        if expected_sha256 and checksum != expected_sha256:
+            _reset_part(part_path)
+            raise DownloadIntegrityError(f"Checksum mismatch for {pdfname}: expected {expected_sha256}, got {checksum}")
+        os.replace(part_path, pdf_path)
+        _reset_part(part_path)
+
+        state = load_state()
+        state["pdf"] = {"name": pdfname, "sha256": checksum, "size": os.path.getsize(pdf_path)}
+        save_state(state)
+        _verified.add((_file_identity(pdf_path), checksum))
+        logger.info(f"Success! {pdf_path} downloaded (sha256 {checksum}).")
     except requests.exceptions.RequestException as e:
         logger.error(f"Download failed: {e}")
         raise NetworkError(
@@ -38,13 +172,76 @@ def download_data(url, pdfname):
 
 
 
+#((path, size, mtime), sha256) of files already checked in this process: each file version is hashed once
+_verified = set()
+
+
+def _file_identity(path):
+    stat = os.stat(path)
+    return (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def verify_pdf(pdf_path, pdfname, expected_sha256=None) -> bool:
+    '''Check an existing PDF against expected_sha256, or else the sha256 recorded when it was downloaded'''
+    if expected_sha256 is None:
+        recorded = load_state().get("pdf") or {}
+        if recorded.get("name") != pdfname:
+            #not downloaded by this pipeline (e.g. copied in): nothing to compare with
+            return True
+        expected_sha256 = recorded.get("sha256")
+    identity = _file_identity(pdf_path)
+    if (identity, expected_sha256) in _verified:
+        return True
+    checksum = file_sha256(pdf_path)
+    if checksum != expected_sha256:
+        logger.warning(f"{pdf_path} has sha256 {checksum}, expected {expected_sha256}")
+        return False
+    _verified.add((identity, checksum))
+    return True
+
+
+
+def ensure_pdf(url, pdfname, expected_sha256=None, data_dir=DATA_DIR) -> str:
+    """Return the local PDF path, downloading the file first if it is missing or fails verification"""
+    pdf_path = f"{data_dir}/{pdfname}"
+    if os.path.exists(pdf_path) and not verify_pdf(pdf_path, pdfname, expected_sha256):
+        logger.info(f"Re-downloading {pdf_path}")
+        os.remove(pdf_path)
+    #if pdf not present, download it
+    if not os.path.exists(pdf_path):
+        download_data(url, pdfname, data_dir=data_dir, expected_sha256=expected_sha256)
+    return pdf_path
+
+
+
+def iter_pdf_pages(url, pdfname, skip_pages: int = 0) -> Iterator[Document]:
+    """Lazily load PDF pages one at a time, from page `skip_pages` on.
+
+    Pages before `skip_pages` (front matter) are never parsed. Text and
+    metadata match the parallel loader: pymupdf's page text, page number and source.
+    """
+
+    pdf_path = ensure_pdf(url, pdfname)
+
+    logger.info(f"Streaming PDF pages from {pdf_path}")
+    n_pages = 0
+    try:
+        with pymupdf.open(pdf_path) as pdf:
+            for page_no in range(skip_pages, pdf.page_count):
+                n_pages += 1
+                yield Document(metadata={"page": page_no, "source": pdf_path},
+                               page_content=pdf[page_no].get_text())
+    except Exception as e:
+        logger.error(f"PDF loading error: {e}")
+        raise PDFLoadError(f"Failed to load PDF due to PDF loading error: {e}")
+    logger.info(f"Streamed {n_pages} pages")
+
+
+
 def load_pdf(url, pdfname) -> List[Document]:
     """Load PDF document"""
     
-    pdf_path = f"{DATA_DIR}/{pdfname}"
-    #if pdf not present, download it
-    if not os.path.exists(pdf_path):
-        download_data(url, pdfname)
+    pdf_path = ensure_pdf(url, pdfname)
 
     logger.info(f"Loading PDF from {pdf_path}")
 
@@ -1,6 +1,6 @@
 import re
 from langchain_core.documents import Document
-from typing import List
+from typing import Iterable, Iterator, List
 from app.utils.loggers import get_logger
 from app.utils.exceptions import DocumentFilterError
 
@@ -20,48 +20,57 @@ MEDICAL_SECTION_HEADINGS = ["Definition", "Purpose","Risks",
 
 
 
+#bump when medical_preprocess changes, so persisted chunk artifacts are rebuilt
+PREPROCESS_VERSION = 1
+
+#pages of front matter (title, contents, ...) at the start of the encyclopedia
+FRONT_MATTER_PAGES = 30
+
+#patterns are compiled once at import (also once per worker process in parallel ingestion)
+HYPHENATED_BREAK = re.compile(r'(\w)-\n(\w)')
+PAGE_HEADER = re.compile(r"G A L E E N C Y C L O P E D I A O F M E D I C I N E|\n\d+\n")
+TRAILING_PAGE_NUMBER = re.compile(r'\n\s*(\d+)\s*\Z', flags=re.MULTILINE)
+CONTROL_CHARS = re.compile(r'[\x00-\x08\x02\x0b\x0c\x0e-\x1f]')
+INNER_NEWLINE = re.compile(r'(?<!\n)\n(?!\n)')
+SECTION_PATTERN = re.compile(
+        r'(?<!\n)\b(' + "|".join(
+        h.replace(" ", r"\s+") for h in MEDICAL_SECTION_HEADINGS
+        ) + r')\b\s*:?'
+)
+EXTRA_NEWLINES = re.compile(r'\n{3,}')
+EXTRA_WHITESPACE = re.compile(r'\s{2,}')
+
+
 def medical_preprocess(text: str) -> str:
     # Fix hyphenated line breaks
-    text = re.sub(r'(\w)-\n(\w)', r'\1\2', text)
+    text = HYPHENATED_BREAK.sub(r'\1\2', text)
 
-    text= re.sub(
-        r"G A L E E N C Y C L O P E D I A O F M E D I C I N E|\n\d+\n",
-        "",
-        text
-    )
+    text = PAGE_HEADER.sub("", text)
     # Remove a number only if it appears at the end of a page
-    text = re.sub(r'\n\s*(\d+)\s*\Z', '\n', text, flags=re.MULTILINE)
+    text = TRAILING_PAGE_NUMBER.sub('\n', text)
     # Remove special characters that might be artifacts
-    text = re.sub(r'[\x00-\x08\x02\x0b\x0c\x0e-\x1f]', '\n', text)
+    text = CONTROL_CHARS.sub('\n', text)
 
 
     # Fix newlines inside sentences
-    text = re.sub(r'(?<!\n)\n(?!\n)', ' ', text)
+    text = INNER_NEWLINE.sub(' ', text)
 
     # Force hard break BEFORE known medical section headings
-    SECTION_PATTERN = re.compile(
-        r'(?<!\n)\b(' + "|".join(
-        h.replace(" ", r"\s+") for h in MEDICAL_SECTION_HEADINGS
-        ) + r')\b\s*:?'
-)
-    text = re.sub(
-        SECTION_PATTERN,
-        r"\n\n\1: ",
-        text
-    )
+    text = SECTION_PATTERN.sub(r"\n\n\1: ", text)
 
     # Normalize whitespace
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    text = re.sub(r'\s{2,}', ' ', text)
+    text = EXTRA_NEWLINES.sub('\n\n', text)
+    text = EXTRA_WHITESPACE.sub(' ', text)
 
     return text.strip()
 
 
-def medical_filter_docs(docs) -> List[Document]:
-    med_filter_doc= []
+def iter_medical_filter_docs(docs: Iterable[Document], skip_pages: int = FRONT_MATTER_PAGES) -> Iterator[Document]:
+    """Lazily filter and preprocess a stream of pages"""
+    n_docs = 0
     try: 
         for i, doc in enumerate(docs):
-            if i>29 and doc.page_content.strip():  # Ensure non-empty and useful content
+            if i >= skip_pages and doc.page_content.strip():  # Ensure non-empty and useful content
                 src= doc.metadata.get('source')
                 pg= doc.metadata.get('page')
                 #create new Document with preprocessed content and filtered metadata
@@ -69,10 +78,13 @@ def medical_filter_docs(docs) -> List[Document]:
                         page_content= medical_preprocess(doc.page_content)
                         
                     )
-                med_filter_doc.append(temp_doc)
+                n_docs += 1
+                yield temp_doc
     except Exception  as dfe:
         logger.error(f"Document filtering error in medical_filter_docs: {dfe}")
         raise DocumentFilterError(f"Failed to filter documents due to document filtering error: {dfe}")
-    logger.info(f"Filtered and preprocessed to {len(med_filter_doc)} medical documents")
-    return med_filter_doc
+    logger.info(f"Filtered and preprocessed to {n_docs} medical documents")
+
 
+def medical_filter_docs(docs, skip_pages: int = FRONT_MATTER_PAGES) -> List[Document]:
+    return list(iter_medical_filter_docs(docs, skip_pages))
@@ -0,0 +1,74 @@
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+import pymupdf
+from langchain_core.documents import Document
+from app.services.data_ingestion.data_loader import ensure_pdf
+from app.services.data_ingestion.data_processor import medical_preprocess, FRONT_MATTER_PAGES
+from app.utils.loggers import get_logger
+from app.utils.exceptions import PDFLoadError
+
+logger = get_logger(__name__)
+
+
+def count_pdf_pages(pdf_path: str) -> int:
+    with pymupdf.open(pdf_path) as pdf:
+        return pdf.page_count
+
+
+def parse_page_range(pdf_path: str, start: int, end: int):
+    '''Worker: extract and preprocess pages [start, end), returning (page, text) for non-empty pages.
+
+    Runs in a separate process; the regex pipeline of medical_preprocess is
+    compiled once when the worker imports data_processor.
+    '''
+    results = []
+    with pymupdf.open(pdf_path) as pdf:
+        for page_no in range(start, end):
+            text = pdf[page_no].get_text()
+            if text.strip():
+                results.append((page_no, medical_preprocess(text)))
+    return results
+
+
+def iter_parallel_processed_pages(url, pdfname, workers: int = None, pages_per_task: int = 64,
+                                  skip_pages: int = FRONT_MATTER_PAGES) -> Iterator[Document]:
+    """Parse and preprocess the PDF across a process pool, yielding pages in page order.
+
+    Equivalent to iter_medical_filter_docs(iter_pdf_pages(...)), but the page
+    ranges are parsed in parallel and front-matter pages are never parsed.
+    At most 2 x workers page ranges are in flight at once.
+    """
+    pdf_path = ensure_pdf(url, pdfname)
+    workers = workers or os.cpu_count() or 1
+    try:
+        n_pages = count_pdf_pages(pdf_path)
+        ranges = [(start, min(start + pages_per_task, n_pages))
+                  for start in range(skip_pages, n_pages, pages_per_task)]
+        logger.info(f"Parsing {n_pages - skip_pages} pages of {pdf_path} with {workers} processes")
+
+        n_docs = 0
+        #spawn, not fork: the server process already runs threads and gRPC channels,
+        #which forked children would inherit in an inconsistent state
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            pending = deque()
+            range_iter = iter(ranges)
+            for start, end in range_iter:
+                pending.append(pool.submit(parse_page_range, pdf_path, start, end))
+                if len(pending) >= 2 * workers:
+                    break
+            while pending:
+                #results are consumed in submission order, which is page order
+                page_results = pending.popleft().result()
+                next_range = next(range_iter, None)
+                if next_range is not None:
+                    pending.append(pool.submit(parse_page_range, pdf_path, *next_range))
+                for page_no, text in page_results:
+                    n_docs += 1
+                    yield Document(metadata={"page": page_no, "source": pdf_path}, page_content=text)
+    except Exception as e:
+        logger.error(f"Parallel PDF parsing error: {e}")
+        raise PDFLoadError(f"Failed to parse PDF in parallel: {e}")
+    logger.info(f"Parsed and preprocessed {n_docs} medical documents")
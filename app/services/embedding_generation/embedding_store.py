@@ -0,0 +1,176 @@
+import hashlib
+import os
+import threading
+import numpy as np
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+SPARSE_MODEL = "pinecone-sparse-english-v0"
+
+
+def _sparse_end(ptr) -> int:
+    '''Length of the sparse arrays: end of the last row's slice'''
+    start, length = ptr[-1]
+    return int(start + max(length, 0))
+
+
+class DocEmbeddingStore:
+    """Content-addressed, append-only store of document chunk embeddings.
+
+    Rows are keyed by sha256(dense model, dim, chunk text), so a rebuild only
+    has to embed chunks it has never seen, whichever sparse encoder is
+    configured. Next to each dense vector the row holds the hosted
+    SPARSE_MODEL vector, or none when the chunk was embedded while a local
+    sparse encoder was configured (local vectors are recomputed, never stored).
+    Layout of the store directory (all little-endian, read back memory-mapped):
+
+        keys.txt            one hex key per line, line number == row
+        dense.f32           row-major float32 matrix (rows x dim)
+        sparse_ptr.i64      (start, length) into the sparse arrays per row, length -1: no sparse vector
+        sparse_indices.u32  concatenated sparse indices
+        sparse_values.f32   concatenated sparse values
+    """
+
+    def __init__(self, root_dir: str, dense_model: str, dim: int):
+        self.dense_model = dense_model
+        self.dim = dim
+        #directory and key names still carry SPARSE_MODEL, so stores written before
+        #the dense vectors were shared across sparse encoders stay readable
+        self.path = os.path.join(root_dir, f"{dense_model}-{dim}-{SPARSE_MODEL}")
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._views = None
+        self._load_keys()
+        self._repair()
+
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+
+    def _load_keys(self):
+        if not os.path.exists(self._file("keys.txt")):
+            return
+        with open(self._file("keys.txt"), "r") as f:
+            for row, line in enumerate(f):
+                self._rows[line.strip()] = row
+
+
+    def _repair(self):
+        '''Truncate data files to the committed row count (keys are written last on append)'''
+        n = len(self._rows)
+        sparse_len = _sparse_end(self._memmap("sparse_ptr.i64", np.int64, (n, 2))) if n else 0
+        expected = {
+            "dense.f32": n * self.dim * 4,
+            "sparse_ptr.i64": n * 16,
+            "sparse_indices.u32": sparse_len * 4,
+            "sparse_values.f32": sparse_len * 4,
+        }
+        for name, size in expected.items():
+            file_path = self._file(name)
+            if os.path.exists(file_path) and os.path.getsize(file_path) > size:
+                logger.warning(f"Truncating uncommitted tail of {file_path}")
+                with open(file_path, "r+b") as f:
+                    f.truncate(size)
+
+
+    def _memmap(self, name: str, dtype, shape):
+        #numpy cannot map an empty file
+        if int(np.prod(shape)) == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode="r", shape=shape)
+
+
+    def _get_views(self):
+        if self._views is None:
+            n = len(self._rows)
+            ptr = self._memmap("sparse_ptr.i64", np.int64, (n, 2))
+            sparse_len = _sparse_end(ptr)
+            self._views = (
+                self._memmap("dense.f32", np.float32, (n, self.dim)),
+                ptr,
+                self._memmap("sparse_indices.u32", np.uint32, (sparse_len,)),
+                self._memmap("sparse_values.f32", np.float32, (sparse_len,)),
+            )
+        return self._views
+
+
+    def make_key(self, text: str) -> str:
+        payload = f"{self.dense_model}|{self.dim}|{SPARSE_MODEL}|{text}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+    def __len__(self):
+        return len(self._rows)
+
+
+    def get_many(self, texts):
+        '''Return a (dense, hosted sparse or None) pair per text, or None for texts never embedded'''
+        with self._lock:
+            rows = [self._rows.get(self.make_key(t)) for t in texts]
+            if all(r is None for r in rows):
+                return [None] * len(texts)
+            dense, ptr, sparse_idx, sparse_val = self._get_views()
+            results = []
+            for row in rows:
+                if row is None:
+                    results.append(None)
+                    continue
+                start, length = ptr[row]
+                sparse = None
+                if length >= 0:
+                    sparse = {"sparse_indices": sparse_idx[start:start + length].tolist(),
+                              "sparse_values": sparse_val[start:start + length].tolist()}
+                results.append((dense[row].tolist(), sparse))
+            return results
+
+
+    def put_many(self, texts, dense_embeddings, sparse_embeddings):
+        '''Append new embeddings (sparse entries may be None); texts already in the store are skipped'''
+        with self._lock:
+            new_keys, dense_rows, sparse_rows = [], [], []
+            seen = set()
+            for text, de, se in zip(texts, dense_embeddings, sparse_embeddings):
+                key = self.make_key(text)
+                if key in self._rows or key in seen:
+                    continue
+                seen.add(key)
+                new_keys.append(key)
+                dense_rows.append(de)
+                sparse_rows.append(se)
+            if not new_keys:
+                return
+
+            sparse_start = 0
+            if self._rows:
+                _, ptr, _, _ = self._get_views()
+                sparse_start = _sparse_end(ptr)
+            ptrs, indices, values = [], [], []
+            for se in sparse_rows:
+                if se is None:
+                    ptrs.append((sparse_start, -1))
+                    continue
+                ptrs.append((sparse_start, len(se["sparse_indices"])))
+                sparse_start += len(se["sparse_indices"])
+                indices.extend(se["sparse_indices"])
+                values.extend(se["sparse_values"])
+
+            with open(self._file("dense.f32"), "ab") as f:
+                f.write(np.asarray(dense_rows, dtype=np.float32).tobytes())
+            with open(self._file("sparse_ptr.i64"), "ab") as f:
+                f.write(np.asarray(ptrs, dtype=np.int64).tobytes())
+            with open(self._file("sparse_indices.u32"), "ab") as f:
+                f.write(np.asarray(indices, dtype=np.uint32).tobytes())
+            with open(self._file("sparse_values.f32"), "ab") as f:
+                f.write(np.asarray(values, dtype=np.float32).tobytes())
+            #commit point: rows only become visible once their keys are written
+            with open(self._file("keys.txt"), "a") as f:
+                f.write("".join(f"{k}\n" for k in new_keys))
+                f.flush()
+                os.fsync(f.fileno())
+
+            for key in new_keys:
+                self._rows[key] = len(self._rows)
+            self._views = None
@@ -1,6 +1,8 @@
 from app.utils.loggers import get_logger
 from app.utils.state_loader import load_state, save_state
 from app.config.config import RAGConfig
+from app.utils.fingerprint import compute_fingerprint
+from app.services.vector_db.backends.factory import create_vector_backend
 
 logger= get_logger(__name__)
 
@@ -10,11 +12,9 @@ def get_vector_count(config: RAGConfig) -> int:
 
     ''' check if vectors exist in vector store'''
     try:
-        index = config.pinecone_vector_client.Index(config.index_name)
-        stats = index.describe_index_stats()
-        return stats["namespaces"].get(config.name_space, {}).get("vector_count", 0)
+        return create_vector_backend(config).vector_count()
     except Exception as e:
-        logger.warning(f"Pinecone error: {e}")
+        logger.warning(f"Vector store error: {e}")
         return 0
 
 
@@ -39,8 +39,11 @@ def ensure_embeddings(create_embeddings_fn, fingerprint: str, config: RAGConfig)
         logger.info("No state found. Creating embeddings...")
 
         create_embeddings_fn()
+        #reload: the build may have recorded pipeline state (e.g. the PDF checksum)
+        state = load_state()
         pinecone_count = get_vector_count(config)
-        state["fingerprint"] = fingerprint
+        #recompute: the build may have produced the chunk artifact the doc hash is read from
+        state["fingerprint"] = compute_fingerprint(config)
         state["vector_count"] = pinecone_count
         save_state(state)
         return
@@ -51,8 +54,11 @@ def ensure_embeddings(create_embeddings_fn, fingerprint: str, config: RAGConfig)
         logger.info("Fingerprint changed. Rebuilding embeddings...")
 
         create_embeddings_fn()
+        #reload: the build may have recorded pipeline state (e.g. the PDF checksum)
+        state = load_state()
         pinecone_count = get_vector_count(config)
-        state["fingerprint"] = fingerprint
+        #recompute: the build may have produced the chunk artifact the doc hash is read from
+        state["fingerprint"] = compute_fingerprint(config)
         state["vector_count"] = pinecone_count
         save_state(state)
         return
@@ -62,6 +68,8 @@ def ensure_embeddings(create_embeddings_fn, fingerprint: str, config: RAGConfig)
 
         logger.info("No records in vector store. Rebuilding embeddings...")
         create_embeddings_fn()
+        #reload: the build may have recorded pipeline state (e.g. the PDF checksum)
+        state = load_state()
         pinecone_count = get_vector_count(config)
         state["vector_count"] = pinecone_count
         save_state(state)
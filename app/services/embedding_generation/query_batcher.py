@@ -0,0 +1,185 @@
+import asyncio
+import threading
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Batch:
+    def __init__(self):
+        self.positions = {}     # text -> position in texts (duplicates share one input)
+        self.texts = []
+        self.callers = 0
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.dense = None
+        self.sparse = None
+        self.error = None
+
+    def add(self, text: str) -> int:
+        if text not in self.positions:
+            self.positions[text] = len(self.texts)
+            self.texts.append(text)
+        return self.positions[text]
+
+
+class _AsyncBatch(_Batch):
+    def __init__(self):
+        super().__init__()
+        self.full = asyncio.Event()
+        self.task = None
+
+
+class QueryEmbeddingBatcher:
+    """Micro-batches concurrent query embedding requests.
+
+    Queries that share an embedding configuration (the batch key) and arrive
+    within `max_wait_ms` of the first one are embedded together - one dense and
+    one sparse provider call - and each caller gets its own vectors back. A
+    batch is sent as soon as it holds `max_batch_size` distinct queries.
+
+    Sync callers: the first caller of a batch waits for it to fill, then makes
+    the calls in its own thread while the others wait. Async callers: the batch
+    is flushed by a task that every caller awaits shielded, so one cancelled
+    request does not fail the others. If a batch call fails, each of its callers
+    retries with its own query alone, so one bad input (e.g. over the model's
+    token limit) only fails its own request.
+    """
+
+    def __init__(self, max_wait_ms: float = 5, max_batch_size: int = 32, enabled: bool = True):
+        self._lock = threading.Lock()
+        self._open = {}
+        self._aopen = {}
+        self.configure(max_wait_ms, max_batch_size, enabled)
+
+
+    def configure(self, max_wait_ms: float, max_batch_size: int, enabled: bool):
+        with self._lock:
+            self.max_wait_ms = max_wait_ms
+            self.max_batch_size = max_batch_size
+            self.enabled = enabled
+            self.batches = 0
+            self.queries = 0
+            self.inputs = 0
+            self.full_batches = 0
+            self.isolated_retries = 0
+
+
+    def _record(self, batch: _Batch, n_callers: int):
+        with self._lock:
+            self.batches += 1
+            self.queries += n_callers
+            self.inputs += len(batch.texts)
+            if len(batch.texts) >= self.max_batch_size:
+                self.full_batches += 1
+
+
+    def _join(self, lanes: dict, key, text: str, new_batch):
+        '''Add text to the open batch of key; returns (batch, position, is_first)'''
+        with self._lock:
+            batch = lanes.get(key)
+            first = batch is None
+            if first:
+                batch = lanes[key] = new_batch()
+            position = batch.add(text)
+            batch.callers += 1
+            if len(batch.texts) >= self.max_batch_size:
+                #sealed: later arrivals start a new batch
+                del lanes[key]
+                batch.full.set()
+        return batch, position, first
+
+
+    def _record_retry(self):
+        with self._lock:
+            self.isolated_retries += 1
+
+
+    def _seal(self, lanes: dict, key, batch: _Batch):
+        with self._lock:
+            if lanes.get(key) is batch:
+                del lanes[key]
+
+
+    def embed(self, key, text: str, embed_fn):
+        '''Embed text as part of a batch; `embed_fn(texts)` returns aligned (dense, sparse) lists'''
+        batch, position, first = self._join(self._open, key, text, _Batch)
+        if first:
+            batch.full.wait(self.max_wait_ms / 1000)
+            self._seal(self._open, key, batch)
+            try:
+                batch.dense, batch.sparse = embed_fn(batch.texts)
+            except BaseException as e:
+                batch.error = e
+                if len(batch.texts) > 1:
+                    logger.warning(f"Embedding batch of {len(batch.texts)} queries failed, "
+                                   f"retrying them one by one: {e!r}")
+            finally:
+                self._record(batch, batch.callers)
+                batch.done.set()
+        else:
+            batch.done.wait()
+        if batch.error is None:
+            return [batch.dense[position]], [batch.sparse[position]]
+        if len(batch.texts) == 1 or not isinstance(batch.error, Exception):
+            raise batch.error
+        #each caller retries alone, in its own thread
+        self._record_retry()
+        dense, sparse = embed_fn([text])
+        return [dense[0]], [sparse[0]]
+
+
+    async def _aflush(self, key, batch: _AsyncBatch, aembed_fn):
+        try:
+            await asyncio.wait_for(batch.full.wait(), timeout=self.max_wait_ms / 1000)
+        except asyncio.TimeoutError:
+            pass
+        self._seal(self._aopen, key, batch)
+        try:
+            return await aembed_fn(batch.texts)
+        except Exception as e:
+            if len(batch.texts) > 1:
+                logger.warning(f"Embedding batch of {len(batch.texts)} queries failed, "
+                               f"retrying them one by one: {e!r}")
+            raise
+        finally:
+            self._record(batch, batch.callers)
+
+
+    async def aembed(self, key, text: str, aembed_fn):
+        '''Async variant of embed; `aembed_fn(texts)` is a coroutine function'''
+        batch, position, first = self._join(self._aopen, key, text, _AsyncBatch)
+        if first:
+            batch.task = asyncio.ensure_future(self._aflush(key, batch, aembed_fn))
+            #mark the exception as retrieved even if every caller was cancelled
+            batch.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            dense, sparse = await asyncio.shield(batch.task)
+        except Exception:
+            if len(batch.texts) == 1:
+                raise
+            self._record_retry()
+            dense, sparse = await aembed_fn([text])
+            position = 0
+        return [dense[position]], [sparse[position]]
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_wait_ms": self.max_wait_ms,
+                "max_batch_size": self.max_batch_size,
+                "batches": self.batches,
+                "queries": self.queries,
+                "full_batches": self.full_batches,
+                #distinct inputs per provider call, absolute and relative to max_batch_size
+                "mean_batch_size": self.inputs / self.batches if self.batches else 0.0,
+                "mean_fill_ratio": self.inputs / (self.batches * self.max_batch_size) if self.batches else 0.0,
+                "queries_per_call": self.queries / self.batches if self.batches else 0.0,
+                #queries re-embedded alone after their batch failed
+                "isolated_retries": self.isolated_retries,
+            }
+
+
+query_embedding_batcher = QueryEmbeddingBatcher()
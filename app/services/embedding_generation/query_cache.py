@@ -0,0 +1,202 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from sqlalchemy import insert
+from app.database import SessionLocal
+from app.models.query_embedding_model import QueryEmbeddingModel
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    '''Lowercase and collapse whitespace so trivially different spellings share an entry'''
+    return _WHITESPACE.sub(" ", query).strip().lower()
+
+
+def make_cache_key(query: str, dense_model: str, dim: int, sparse_model: str = None) -> str:
+    #the default (Pinecone) sparse model keeps the original key format
+    payload = f"{dense_model}|{dim}|{normalize_query(query)}"
+    if sparse_model:
+        payload = f"{sparse_model}|{payload}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def to_sparse_dicts(sparse_embeddings):
+    '''Convert Pinecone sparse embedding results into plain, cacheable dicts'''
+    return [{"sparse_indices": list(se["sparse_indices"]),
+             "sparse_values": list(se["sparse_values"])} for se in sparse_embeddings]
+
+
+class QueryEmbeddingCache:
+    """Two-tier cache of (dense, sparse) query embeddings.
+
+    Tier 1 is a bounded in-process LRU with a TTL. Tier 2 (optional) is the
+    `query_embedding_cache` table, which survives restarts and is shared by
+    every worker using the same database. Both tiers apply the same TTL: rows
+    older than `ttl_seconds` are misses (and deleted), and `prune_persistent`
+    removes every expired row.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 86400, persistent: bool = False):
+        self._entries = OrderedDict()   # key -> (stored_at, dense, sparse)
+        self._lock = threading.Lock()
+        self.configure(max_size, ttl_seconds, persistent)
+        self.hits = 0
+        self.persistent_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def configure(self, max_size: int, ttl_seconds: float, persistent: bool):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.persistent = persistent
+
+
+    def get_local(self, key: str):
+        '''Return (dense, sparse) from the in-memory tier or None'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, dense, sparse = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dense, sparse
+
+
+    def put_local(self, key: str, dense, sparse):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), dense, sparse)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+    def get_persistent(self, key: str):
+        '''Return (dense, sparse) from the database tier (promoting it to memory) or None'''
+        return self.get_persistent_many([key]).get(key)
+
+
+    def get_persistent_many(self, keys):
+        '''Return {key: (dense, sparse)} for the keys found in the database tier, in one query'''
+        if not self.persistent or not keys:
+            return {}
+        db = SessionLocal()
+        try:
+            rows = db.query(QueryEmbeddingModel).filter(QueryEmbeddingModel.cache_key.in_(set(keys))).all()
+            expired = {row.cache_key for row in rows if self._is_expired(row.created_at)}
+            if expired:
+                (db.query(QueryEmbeddingModel)
+                 .filter(QueryEmbeddingModel.cache_key.in_(expired))
+                 .delete(synchronize_session=False))
+                db.commit()
+            found = {row.cache_key: ([np.frombuffer(row.dense, dtype=np.float32)], [json.loads(row.sparse)])
+                     for row in rows if row.cache_key not in expired}
+        except Exception as e:
+            db.rollback()
+            #the persistent tier is best effort, a failure is just a miss
+            logger.warning(f"Query embedding cache lookup failed: {e}")
+            return {}
+        finally:
+            db.close()
+        with self._lock:
+            self.persistent_hits += len(found)
+        for key, (dense, sparse) in found.items():
+            self.put_local(key, dense, sparse)
+        return found
+
+
+    def _is_expired(self, created_at) -> bool:
+        if created_at is None:
+            return True
+        #SQLite returns naive datetimes (stored as UTC)
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=timezone.utc)
+        return datetime.now(timezone.utc) - created_at > timedelta(seconds=self.ttl_seconds)
+
+
+    def prune_persistent(self) -> int:
+        '''Delete the expired rows of the database tier; returns how many were deleted'''
+        if not self.persistent:
+            return 0
+        db = SessionLocal()
+        try:
+            cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+            deleted = (db.query(QueryEmbeddingModel)
+                       .filter(QueryEmbeddingModel.created_at < cutoff)
+                       .delete(synchronize_session=False))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Query embedding cache pruning failed: {e}")
+            return 0
+        finally:
+            db.close()
+        logger.info(f"Pruned {deleted} expired query embeddings")
+        return deleted
+
+
+    def put_persistent(self, key: str, dense_model: str, dim: int, dense, sparse):
+        self.put_persistent_many(dense_model, dim, {key: (dense, sparse)})
+
+
+    def put_persistent_many(self, dense_model: str, dim: int, entries):
+        '''Write {key: (dense, sparse)} to the database tier with one bulk insert'''
+        if not self.persistent or not entries:
+            return
+        #a rewritten row starts a new TTL
+        created_at = datetime.now(timezone.utc)
+        rows = [{"cache_key": key,
+                 "dense_model": dense_model,
+                 "dim": dim,
+                 "dense": np.asarray(dense[0], dtype=np.float32).tobytes(),
+                 "sparse": json.dumps(sparse[0]),
+                 "created_at": created_at} for key, (dense, sparse) in entries.items()]
+        db = SessionLocal()
+        try:
+            #replace rows of the same keys (e.g. expired ones) in the same transaction
+            (db.query(QueryEmbeddingModel)
+             .filter(QueryEmbeddingModel.cache_key.in_(list(entries)))
+             .delete(synchronize_session=False))
+            db.execute(insert(QueryEmbeddingModel), rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Query embedding cache write failed: {e}")
+        finally:
+            db.close()
+
+
+    def record_miss(self):
+        with self._lock:
+            self.misses += 1
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.persistent_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.persistent_hits) / lookups if lookups else 0.0,
+            }
+
+
+query_embedding_cache = QueryEmbeddingCache()
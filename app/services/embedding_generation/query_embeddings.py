@@ -1,28 +1,297 @@
+import asyncio
+import base64
+import time
+from functools import partial
+import numpy as np
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from app.utils.exceptions import QueryDenseEmbedError, QuerySparseEmbedError
+from app.utils.concurrency import run_blocking, get_fanout_pool, get_blocking_pool
+from app.services.embedding_generation.query_cache import query_embedding_cache, make_cache_key, to_sparse_dicts
+from app.services.embedding_generation.query_batcher import query_embedding_batcher
 from app.utils.loggers import get_logger
 logger = get_logger(__name__)
 
+#provider limits on inputs per embedding request
+MAX_DENSE_BATCH = 2048
+MAX_SPARSE_BATCH = 96
 
-def generate_query_embeddings(query, dense_model,dim, openai_client, pinecone_vector_client):
-    """Generate dense and sparse embeddings for a query."""
+
+def decode_embedding(embedding):
+    '''float32 array from a base64-encoded embedding (or a plain list of floats)'''
+    if isinstance(embedding, str):
+        return np.frombuffer(base64.b64decode(embedding), dtype=np.float32)
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def _dense_query_embedding(query, dense_model, dim, openai_client, timeout=None):
+    # Convert the query into a dense vector, kept as a float32 buffer (no per-float Python objects)
+    dense_query_embed = openai_client.embeddings.create(input=query, model=dense_model, dimensions=dim,
+                                                        encoding_format="base64", timeout=timeout)
+    return [decode_embedding(record.embedding) for record in dense_query_embed.data]
+
+
+def _sparse_query_embedding(query, pinecone_vector_client):
+    # Convert the query into a sparse vector
+    return pinecone_vector_client.inference.embed(
+        model="pinecone-sparse-english-v0",
+        inputs=query,
+        parameters={"input_type": "query", "truncate": "END"}
+    )
+
+
+def _cache_embeddings(cache_key, dense_model, dim, dense_query_embedding, sparse_query_embedding):
+    _cache_many_embeddings({cache_key: (dense_query_embedding, sparse_query_embedding)}, dense_model, dim)
+
+
+def _cache_many_embeddings(entries, dense_model, dim):
+    '''Cache {cache_key: (dense, sparse)}; the database tier gets one bulk write'''
+    for cache_key, (dense_query_embedding, sparse_query_embedding) in entries.items():
+        query_embedding_cache.put_local(cache_key, dense_query_embedding, sparse_query_embedding)
+    if query_embedding_cache.persistent:
+        #write-behind so the database round trip is not on the request path
+        get_blocking_pool().submit(query_embedding_cache.put_persistent_many, dense_model, dim, entries)
+
+
+def _local_sparse_query_embedding(queries, sparse_encoder):
+    try:
+        return sparse_encoder.encode_queries(queries)
+    except Exception as qse:
+        logger.error(f"Error generating sparse query embeddings: {qse}")
+        raise QuerySparseEmbedError(f"Error generating sparse query embeddings: {qse}")
+
+
+def _batch_key(dense_model, dim, openai_client, pinecone_vector_client, dense_timeout, sparse_timeout,
+               sparse_encoder):
+    '''Queries are only batched with others embedded the same way'''
+    return (id(openai_client), id(pinecone_vector_client), dense_model, dim, dense_timeout, sparse_timeout,
+            sparse_encoder.model_id if sparse_encoder else None)
+
+
+def generate_query_embeddings(query, dense_model,dim, openai_client, pinecone_vector_client,
+                              dense_timeout=None, sparse_timeout=None, sparse_encoder=None):
+    """Generate dense and sparse embeddings for a query.
+
+    The two calls are independent, so the sparse one runs in the fan-out pool
+    while the dense one runs in the caller thread; latency is the slower of the two.
+    With a local `sparse_encoder` the sparse vector is computed in-process instead.
+    Results are served from / stored in the query embedding cache. With the
+    micro-batcher enabled, cache misses of concurrent requests share provider calls.
+    """
+    cache_key = make_cache_key(query, dense_model, dim, sparse_encoder.model_id if sparse_encoder else None)
+    cached = query_embedding_cache.get_local(cache_key) or query_embedding_cache.get_persistent(cache_key)
+    if cached is not None:
+        logger.info("Query embeddings served from cache.")
+        return cached
+    query_embedding_cache.record_miss()
+
+    if query_embedding_batcher.enabled:
+        embed_fn = partial(_embed_texts, dense_model=dense_model, dim=dim, openai_client=openai_client,
+                           pinecone_vector_client=pinecone_vector_client, dense_timeout=dense_timeout,
+                           sparse_timeout=sparse_timeout, sparse_encoder=sparse_encoder)
+        dense_query_embedding, sparse_query_embedding = query_embedding_batcher.embed(
+            _batch_key(dense_model, dim, openai_client, pinecone_vector_client, dense_timeout, sparse_timeout,
+                       sparse_encoder),
+            query, embed_fn)
+        _cache_embeddings(cache_key, dense_model, dim, dense_query_embedding, sparse_query_embedding)
+        logger.info("Generated query embeddings successfully.")
+        return dense_query_embedding, sparse_query_embedding
+
+    if sparse_encoder is not None:
+        try:
+            dense_query_embedding = _dense_query_embedding(query, dense_model, dim, openai_client, dense_timeout)
+        except Exception as qde:
+            logger.error(f"Error generating dense query embeddings: {qde}")
+            raise QueryDenseEmbedError(f"Error generating dense query embeddings: {qde}")
+        sparse_query_embedding = _local_sparse_query_embedding([query], sparse_encoder)
+        _cache_embeddings(cache_key, dense_model, dim, dense_query_embedding, sparse_query_embedding)
+        logger.info("Generated query embeddings successfully.")
+        return dense_query_embedding, sparse_query_embedding
+
+    started = time.monotonic()
+    sparse_future = get_fanout_pool().submit(_sparse_query_embedding, query, pinecone_vector_client)
     try:
-        # Convert the query into a dense vector
-        dense_query_embed = openai_client.embeddings.create(input=query, model=dense_model, dimensions=dim)
-        dense_query_embedding = [record.embedding for record in dense_query_embed.data]
+        dense_query_embedding = _dense_query_embedding(query, dense_model, dim, openai_client, dense_timeout)
     except Exception as qde:
+        sparse_future.cancel()
         logger.error(f"Error generating dense query embeddings: {qde}")
         raise QueryDenseEmbedError(f"Error generating dense query embeddings: {qde}")
 
     try:
-        # Convert the query into a sparse vector
-        sparse_query_embedding = pinecone_vector_client.inference.embed(
-            model="pinecone-sparse-english-v0",
-            inputs=query,
-            parameters={"input_type": "query", "truncate": "END"}
-        )
+        #the sparse timeout counts from submission, not from when the dense call returned
+        remaining = None if sparse_timeout is None else max(0.0, sparse_timeout - (time.monotonic() - started))
+        sparse_query_embedding = sparse_future.result(timeout=remaining)
+    except FutureTimeoutError:
+        logger.error(f"Sparse query embedding timed out after {sparse_timeout}s")
+        raise QuerySparseEmbedError(f"Sparse query embedding timed out after {sparse_timeout}s")
     except Exception as qse:
         logger.error(f"Error generating sparse query embeddings: {qse}")
         raise QuerySparseEmbedError(f"Error generating sparse query embeddings: {qse}")
-    
+
+    sparse_query_embedding = to_sparse_dicts(sparse_query_embedding)
+    _cache_embeddings(cache_key, dense_model, dim, dense_query_embedding, sparse_query_embedding)
+    logger.info("Generated query embeddings successfully.")
+    return dense_query_embedding, sparse_query_embedding
+
+
+
+async def _adense_query_embedding(query, dense_model, dim, async_openai_client, timeout=None):
+    # Convert the query into a dense vector (native async OpenAI client)
+    dense_query_embed = await async_openai_client.embeddings.create(input=query, model=dense_model, dimensions=dim,
+                                                                    encoding_format="base64", timeout=timeout)
+    return [decode_embedding(record.embedding) for record in dense_query_embed.data]
+
+
+async def _aembed_texts(texts, dense_model, dim, async_openai_client, pinecone_vector_client,
+                        dense_timeout=None, sparse_timeout=None, sparse_encoder=None):
+    '''Async variant of _embed_texts: dense and sparse requests run concurrently on the event loop'''
+    dense_calls = [asyncio.wait_for(_adense_query_embedding(texts[s:s + MAX_DENSE_BATCH], dense_model, dim,
+                                                            async_openai_client, dense_timeout),
+                                    timeout=dense_timeout)
+                   for s in range(0, len(texts), MAX_DENSE_BATCH)]
+    if sparse_encoder is not None:
+        #local encoding is in-process, there is no second network call to overlap
+        sparse_calls = []
+    else:
+        # sync Pinecone client, run in the bounded pool
+        sparse_calls = [asyncio.wait_for(run_blocking(_sparse_query_embedding, texts[s:s + MAX_SPARSE_BATCH],
+                                                      pinecone_vector_client),
+                                         timeout=sparse_timeout)
+                        for s in range(0, len(texts), MAX_SPARSE_BATCH)]
+    results = await asyncio.gather(*dense_calls, *sparse_calls, return_exceptions=True)
+    dense_results, sparse_results = results[:len(dense_calls)], results[len(dense_calls):]
+
+    for dense_result in dense_results:
+        if isinstance(dense_result, BaseException):
+            logger.error(f"Error generating dense query embeddings: {dense_result!r}")
+            raise QueryDenseEmbedError(f"Error generating dense query embeddings: {dense_result!r}")
+    for sparse_result in sparse_results:
+        if isinstance(sparse_result, BaseException):
+            logger.error(f"Error generating sparse query embeddings: {sparse_result!r}")
+            raise QuerySparseEmbedError(f"Error generating sparse query embeddings: {sparse_result!r}")
+
+    dense_new = [e for dense_result in dense_results for e in dense_result]
+    if sparse_encoder is not None:
+        sparse_new = _local_sparse_query_embedding(texts, sparse_encoder)
+    else:
+        sparse_new = [e for sparse_result in sparse_results for e in to_sparse_dicts(sparse_result)]
+    return dense_new, sparse_new
+
+
+async def agenerate_query_embeddings(query, dense_model, dim, async_openai_client, pinecone_vector_client,
+                                     dense_timeout=None, sparse_timeout=None, sparse_encoder=None):
+    """Generate dense and sparse embeddings for a query concurrently without blocking the event loop."""
+    cache_key = make_cache_key(query, dense_model, dim, sparse_encoder.model_id if sparse_encoder else None)
+    cached = query_embedding_cache.get_local(cache_key)
+    if cached is None and query_embedding_cache.persistent:
+        cached = await run_blocking(query_embedding_cache.get_persistent, cache_key)
+    if cached is not None:
+        logger.info("Query embeddings served from cache.")
+        return cached
+    query_embedding_cache.record_miss()
+
+    aembed_fn = partial(_aembed_texts, dense_model=dense_model, dim=dim, async_openai_client=async_openai_client,
+                        pinecone_vector_client=pinecone_vector_client, dense_timeout=dense_timeout,
+                        sparse_timeout=sparse_timeout, sparse_encoder=sparse_encoder)
+    if query_embedding_batcher.enabled:
+        dense_result, sparse_result = await query_embedding_batcher.aembed(
+            _batch_key(dense_model, dim, async_openai_client, pinecone_vector_client, dense_timeout, sparse_timeout,
+                       sparse_encoder),
+            query, aembed_fn)
+    else:
+        dense_result, sparse_result = await aembed_fn([query])
+    _cache_embeddings(cache_key, dense_model, dim, dense_result, sparse_result)
     logger.info("Generated query embeddings successfully.")
-    return dense_query_embedding, sparse_query_embedding
\ No newline at end of file
+    return dense_result, sparse_result
+
+
+
+def _embed_texts(texts, dense_model, dim, openai_client, pinecone_vector_client,
+                 dense_timeout=None, sparse_timeout=None, sparse_encoder=None):
+    '''Embed a list of texts with as few provider calls as the request limits allow.
+
+    The first dense request runs in the caller thread, concurrently with the sparse
+    requests (and any further dense ones) in the fan-out pool. Returns dense and
+    sparse lists aligned with `texts` (no caching).
+    '''
+    started = time.monotonic()
+    pool = get_fanout_pool()
+    sparse_futures = [] if sparse_encoder is not None else \
+        [pool.submit(_sparse_query_embedding, texts[s:s + MAX_SPARSE_BATCH], pinecone_vector_client)
+         for s in range(0, len(texts), MAX_SPARSE_BATCH)]
+    dense_futures = [pool.submit(_dense_query_embedding, texts[s:s + MAX_DENSE_BATCH], dense_model, dim,
+                                 openai_client, dense_timeout)
+                     for s in range(MAX_DENSE_BATCH, len(texts), MAX_DENSE_BATCH)]
+    try:
+        try:
+            dense_new = _dense_query_embedding(texts[:MAX_DENSE_BATCH], dense_model, dim, openai_client,
+                                               dense_timeout)
+            dense_new += [e for future in dense_futures for e in future.result()]
+        except Exception as qde:
+            logger.error(f"Error generating dense query embeddings: {qde}")
+            raise QueryDenseEmbedError(f"Error generating dense query embeddings: {qde}")
+        if sparse_encoder is not None:
+            sparse_new = _local_sparse_query_embedding(texts, sparse_encoder)
+        else:
+            try:
+                sparse_new = []
+                for future in sparse_futures:
+                    remaining = None if sparse_timeout is None else \
+                        max(0.0, sparse_timeout - (time.monotonic() - started))
+                    sparse_new.extend(to_sparse_dicts(future.result(timeout=remaining)))
+            except FutureTimeoutError:
+                logger.error(f"Sparse query embeddings timed out after {sparse_timeout}s")
+                raise QuerySparseEmbedError(f"Sparse query embeddings timed out after {sparse_timeout}s")
+            except Exception as qse:
+                logger.error(f"Error generating sparse query embeddings: {qse}")
+                raise QuerySparseEmbedError(f"Error generating sparse query embeddings: {qse}")
+    except BaseException:
+        for future in dense_futures + sparse_futures:
+            future.cancel()
+        raise
+    return dense_new, sparse_new
+
+
+
+def generate_batch_query_embeddings(queries, dense_model, dim, openai_client, pinecone_vector_client,
+                                    dense_timeout=None, sparse_timeout=None, sparse_encoder=None):
+    """Generate dense and sparse embeddings for many queries.
+
+    Cached queries are served from the query embedding cache. The remaining
+    (distinct) queries are embedded with as few provider calls as the request
+    limits allow - one dense and one sparse call for up to 96 queries - with
+    the dense and sparse requests running concurrently in the fan-out pool.
+    Returns dense and sparse lists aligned with `queries`.
+    """
+    model_id = sparse_encoder.model_id if sparse_encoder else None
+    cache_keys = [make_cache_key(query, dense_model, dim, model_id) for query in queries]
+    dense_embeddings, sparse_embeddings = [None] * len(queries), [None] * len(queries)
+    local_misses = []
+    for i, cache_key in enumerate(cache_keys):
+        cached = query_embedding_cache.get_local(cache_key)
+        if cached is not None:
+            dense_embeddings[i], sparse_embeddings[i] = cached[0][0], cached[1][0]
+        else:
+            local_misses.append(i)
+    #one database query for all queries missing from memory
+    persistent = query_embedding_cache.get_persistent_many([cache_keys[i] for i in local_misses])
+    to_embed = {}
+    for i in local_misses:
+        cached = persistent.get(cache_keys[i])
+        if cached is not None:
+            dense_embeddings[i], sparse_embeddings[i] = cached[0][0], cached[1][0]
+        elif cache_keys[i] not in to_embed:
+            query_embedding_cache.record_miss()
+            to_embed[cache_keys[i]] = queries[i]
+
+    if to_embed:
+        dense_new, sparse_new = _embed_texts(list(to_embed.values()), dense_model, dim, openai_client,
+                                             pinecone_vector_client, dense_timeout, sparse_timeout, sparse_encoder)
+        embedded = {cache_key: (dense, sparse) for cache_key, dense, sparse in zip(to_embed, dense_new, sparse_new)}
+        _cache_many_embeddings({cache_key: ([dense], [sparse]) for cache_key, (dense, sparse) in embedded.items()},
+                               dense_model, dim)
+        for i, cache_key in enumerate(cache_keys):
+            if dense_embeddings[i] is None:
+                dense_embeddings[i], sparse_embeddings[i] = embedded[cache_key]
+
+    logger.info(f"Generated query embeddings for {len(queries)} queries ({len(to_embed)} embedded).")
+    return dense_embeddings, sparse_embeddings
@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+from functools import cached_property
+from itertools import islice
+import numpy as np
+from app.config.config import RAGConfig
+from app.utils.exceptions import QuerySparseEmbedError
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset((
+    "a an and are as at be but by for from has have he her his i if in into is it its "
+    "may of on or she such that the their them then there these they this to was were "
+    "which will with can not no also other than been being do does all any more most"
+).split())
+FIT_BATCH_SIZE = 1024
+
+
+def tokenize(text: str):
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def _term_counts(texts):
+    '''Tokenize a batch of texts at once.
+
+    Returns per-text token counts, the batch vocabulary, and one entry per
+    distinct (text, term) pair: text position, vocabulary position and term frequency.
+    '''
+    tokens_per_text = [tokenize(t) for t in texts]
+    lengths = np.asarray([len(tokens) for tokens in tokens_per_text], dtype=np.int64)
+    flat = [tok for tokens in tokens_per_text for tok in tokens]
+    if not flat:
+        empty = np.empty(0, dtype=np.int64)
+        return lengths, np.empty(0, dtype=str), empty, empty, empty
+    vocab, inverse = np.unique(np.asarray(flat), return_inverse=True)
+    text_ids = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+    pairs, tf = np.unique(text_ids * len(vocab) + inverse, return_counts=True)
+    return lengths, vocab, pairs // len(vocab), pairs % len(vocab), tf
+
+
+def _to_sparse_vectors(n_texts, text_ids, term_hashes, weights):
+    '''Group weighted (text, term) pairs into sparse vectors, summing hash collisions'''
+    keys = (text_ids.astype(np.uint64) << np.uint64(32)) | term_hashes.astype(np.uint64)
+    keys, inverse = np.unique(keys, return_inverse=True)
+    weights = np.bincount(inverse, weights=weights, minlength=len(keys)).astype(np.float32)
+    text_ids = (keys >> np.uint64(32)).astype(np.int64)
+    indices = (keys & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+    bounds = np.searchsorted(text_ids, np.arange(n_texts + 1))
+    return [{"sparse_indices": indices[lo:hi].tolist(), "sparse_values": weights[lo:hi].tolist()}
+            for lo, hi in zip(bounds[:-1], bounds[1:])]
+
+
+class BM25SparseEncoder:
+    """In-process BM25 sparse encoder fitted on the chunk corpus.
+
+    Documents are encoded with the BM25 term-frequency saturation
+    tf * (k1 + 1) / (tf + k1 * (1 - b + b * len / avgdl)) and queries with the
+    (normalized) IDF of their terms, so the dotproduct of the two is the BM25
+    score. Term indices are crc32 hashes of the tokens, which keeps document
+    vectors stable when the vocabulary grows; only corpus statistics
+    (document frequencies, average length) are fitted and saved.
+    """
+
+    name = "bm25"
+
+    def __init__(self, df: dict, n_docs: int, avgdl: float, k1: float = 1.2, b: float = 0.75):
+        self.df = df
+        self.n_docs = n_docs
+        self.avgdl = avgdl
+        self.k1 = k1
+        self.b = b
+
+
+    @classmethod
+    def fit(cls, texts, k1: float = 1.2, b: float = 0.75) -> "BM25SparseEncoder":
+        '''Collect document frequencies and the average length from an iterable of texts'''
+        df = Counter()
+        n_docs, total_len = 0, 0
+        texts = iter(texts)
+        while True:
+            batch = list(islice(texts, FIT_BATCH_SIZE))
+            if not batch:
+                break
+            lengths, vocab, _, pair_terms, _ = _term_counts(batch)
+            #each (text, term) pair is one document containing the term
+            terms, counts = np.unique(pair_terms, return_counts=True)
+            df.update(dict(zip(vocab[terms].tolist(), counts.tolist())))
+            n_docs += len(batch)
+            total_len += int(lengths.sum())
+        avgdl = total_len / n_docs if n_docs else 1.0
+        logger.info(f"Fitted BM25 sparse encoder on {n_docs} chunks ({len(df)} terms, avgdl {avgdl:.1f})")
+        return cls(dict(df), n_docs, avgdl, k1, b)
+
+
+    @property
+    def doc_params_id(self) -> str:
+        '''Identifies everything document vectors depend on (not the IDF statistics)'''
+        return f"{self.name}-k1={self.k1}-b={self.b}-avgdl={self.avgdl:.4f}"
+
+
+    @cached_property
+    def model_id(self) -> str:
+        '''Identifies the full fitted model, query vectors included'''
+        digest = hashlib.sha256(json.dumps([self.doc_params_id, self.n_docs, sorted(self.df.items())])
+                                .encode("utf-8")).hexdigest()
+        return f"{self.name}-{digest[:12]}"
+
+
+    def _hashes(self, vocab):
+        return np.fromiter((zlib.crc32(t.encode("utf-8")) for t in vocab.tolist()), dtype=np.uint32,
+                           count=len(vocab))
+
+
+    def encode_documents(self, texts):
+        '''Sparse vectors ({"sparse_indices", "sparse_values"}) for a batch of passages'''
+        lengths, vocab, text_ids, terms, tf = _term_counts(texts)
+        norm = self.k1 * (1 - self.b + self.b * lengths[text_ids] / self.avgdl)
+        weights = tf * (self.k1 + 1) / (tf + norm)
+        return _to_sparse_vectors(len(texts), text_ids, self._hashes(vocab)[terms], weights)
+
+
+    def encode_queries(self, texts):
+        '''Sparse vectors for a batch of queries: normalized IDF of the known query terms'''
+        _, vocab, text_ids, terms, _ = _term_counts(texts)
+        df = np.asarray([self.df.get(t, 0) for t in vocab.tolist()], dtype=np.float64)
+        known = df[terms] > 0
+        text_ids, terms = text_ids[known], terms[known]
+        idf = np.log((self.n_docs - df[terms] + 0.5) / (df[terms] + 0.5) + 1)
+        totals = np.bincount(text_ids, weights=idf, minlength=len(texts))
+        weights = idf / np.where(totals[text_ids] > 0, totals[text_ids], 1)
+        return _to_sparse_vectors(len(texts), text_ids, self._hashes(vocab)[terms], weights)
+
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"name": self.name, "k1": self.k1, "b": self.b, "n_docs": self.n_docs,
+                       "avgdl": self.avgdl, "df": self.df}, f)
+        #atomic replace so a crash never leaves a half-written model
+        os.replace(tmp_path, path)
+
+
+    @classmethod
+    def load(cls, path: str):
+        '''Load a saved encoder, or return None if there is none at path'''
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            data = json.load(f)
+        return cls(data["df"], data["n_docs"], data["avgdl"], data["k1"], data["b"])
+
+
+_loaded = {}
+_lock = threading.Lock()
+
+
+def get_sparse_encoder(config: RAGConfig):
+    '''Sparse encoder selected by `retriever.sparse_encoder`: None for Pinecone's hosted
+    model, the fitted local BM25 encoder otherwise (reloaded when ingestion refits it)'''
+    if config.sparse_encoder == "pinecone":
+        return None
+    if config.sparse_encoder != "local":
+        raise ValueError(f"Unknown sparse encoder {config.sparse_encoder!r}, expected 'pinecone' or 'local'")
+    path = config.sparse_encoder_path
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        logger.error(f"Local sparse encoder not fitted yet: {path} is missing")
+        raise QuerySparseEmbedError(f"Local sparse encoder not fitted yet: {path} is missing")
+    with _lock:
+        cached = _loaded.get(path)
+        if cached is None or cached[0] != mtime:
+            cached = (mtime, BM25SparseEncoder.load(path))
+            _loaded[path] = cached
+        return cached[1]
@@ -0,0 +1,155 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+import tiktoken
+from app.utils.concurrency import get_blocking_pool
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_ENCODING = "o200k_base"
+#per-message framing tokens of the chat format (role, separators)
+TOKENS_PER_MESSAGE = 3
+#rough fallback when the tokenizer files cannot be loaded (e.g. offline)
+CHARS_PER_TOKEN = 4
+#seconds before a failed tokenizer load is attempted again
+LOAD_RETRY_INTERVAL = 300
+
+_encodings = {}
+_loading = {}       # model_name -> monotonic time of the last load attempt (while not loaded)
+_encodings_lock = threading.Lock()
+
+
+def load_encoding(model_name: str):
+    '''Load the tiktoken encoding of the model (downloads it unless in TIKTOKEN_CACHE_DIR).
+
+    Blocking: called at startup, or in the background after a failed load.
+    Returns None if it cannot be loaded.'''
+    try:
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+    except Exception as e:
+        logger.warning(f"Tokenizer for {model_name} unavailable, estimating token counts: {e}")
+        with _encodings_lock:
+            _loading[model_name] = time.monotonic()
+        return None
+    with _encodings_lock:
+        _encodings[model_name] = encoding
+        _loading.pop(model_name, None)
+    logger.info(f"Loaded tokenizer {encoding.name} for {model_name}")
+    return encoding
+
+
+def get_encoding(model_name: str):
+    '''tiktoken encoding of the model; None (token counts estimated) until it is loaded.
+
+    Never loads on the caller's thread: a missing encoding is loaded in the
+    background, at most once per LOAD_RETRY_INTERVAL.'''
+    encoding = _encodings.get(model_name)
+    if encoding is not None:
+        return encoding
+    now = time.monotonic()
+    with _encodings_lock:
+        if model_name in _encodings:
+            return _encodings[model_name]
+        last_attempt = _loading.get(model_name)
+        if last_attempt is not None and now - last_attempt < LOAD_RETRY_INTERVAL:
+            return None
+        _loading[model_name] = now
+    get_blocking_pool().submit(load_encoding, model_name)
+    return None
+
+
+@lru_cache(maxsize=8192)
+def _count_tokens(encoding, text: str) -> int:
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode_ordinary(text))
+
+
+@dataclass
+class AssembledContext:
+    system_prompt: str
+    messages: list
+    usage: dict = field(default_factory=dict)
+
+
+class ContextAssembler:
+    """Fits the LLM prompt into a token budget.
+
+    The prompt is laid out as: static system prompt, retrieved chunks, then
+    the conversation. The static system prompt always comes first and is
+    never altered, so it stays a stable prefix for provider-side prompt
+    caching. The latest user message and the system prompt are always kept;
+    older turns are dropped oldest first beyond `max_history_tokens`, and
+    retrieved chunks are added best score first until `max_prompt_tokens` is
+    reached; a chunk that does not fit is skipped, so smaller lower-scoring
+    chunks can still use the rest of the budget.
+    """
+
+    def __init__(self, model_name: str, max_prompt_tokens: int, max_history_tokens: int):
+        self.model_name = model_name
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_history_tokens = max_history_tokens
+
+
+    def count_tokens(self, text: str) -> int:
+        return _count_tokens(get_encoding(self.model_name), text)
+
+
+    def _message_tokens(self, message) -> int:
+        return self.count_tokens(message.text) + TOKENS_PER_MESSAGE
+
+
+    def _trim_history(self, messages):
+        '''Keep the latest message and as many of the most recent whole turns as fit'''
+        latest = messages[-1]
+        kept, older_tokens = [], 0
+        turn, turn_tokens = [], 0
+        for message in reversed(messages[:-1]):
+            turn.insert(0, message)
+            turn_tokens += self._message_tokens(message)
+            #a turn starts at a user message: keep or drop it as a whole
+            if message.type != "human":
+                continue
+            if older_tokens + turn_tokens > self.max_history_tokens:
+                break
+            kept[:0] = turn
+            older_tokens += turn_tokens
+            turn, turn_tokens = [], 0
+        return kept + [latest], older_tokens + self._message_tokens(latest)
+
+
+    def assemble(self, sys_prompt: str, chunks, messages) -> AssembledContext:
+        messages, history_tokens = self._trim_history(list(messages))
+        system_tokens = self.count_tokens(sys_prompt) + TOKENS_PER_MESSAGE
+        remaining = self.max_prompt_tokens - system_tokens - history_tokens
+
+        #best chunks first; kept chunks stay in retrieval order
+        selected = set()
+        chunk_tokens = 0
+        for i in sorted(range(len(chunks)), key=lambda i: -chunks[i].score):
+            #+2 for the blank line separating chunks
+            tokens = self.count_tokens(chunks[i].text) + 2
+            if chunk_tokens + tokens > remaining:
+                #a smaller chunk further down may still fit
+                continue
+            selected.add(i)
+            chunk_tokens += tokens
+        docs_content = "\n\n".join(chunk.text for i, chunk in enumerate(chunks) if i in selected)
+
+        usage = {
+            "prompt_tokens": system_tokens + chunk_tokens + history_tokens,
+            "system_tokens": system_tokens,
+            "context_tokens": chunk_tokens,
+            "history_tokens": history_tokens,
+            "chunks_kept": len(selected),
+            "chunks_dropped": len(chunks) - len(selected),
+            "messages_kept": len(messages),
+        }
+        if remaining < 0:
+            logger.warning(f"System prompt and question alone exceed the prompt budget ({usage['prompt_tokens']} tokens)")
+        return AssembledContext(system_prompt=f"{sys_prompt}\n\n{docs_content}", messages=messages, usage=usage)
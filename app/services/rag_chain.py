@@ -1,51 +1,194 @@
-from app.services.retriever.build_retriever import retrieve_docs
+from app.services.retriever.build_retriever import retrieve_chunks, aretrieve_chunks
+from app.services.embedding_generation.query_cache import normalize_query
+from app.services.answer_cache import answer_cache
+from app.services.vector_db.backends.factory import create_vector_backend
+from app.services.retriever.hybrid_retriever import HybridRetriever
+from app.services.retriever.chunk_merger import ChunkMerger
+from app.services.retriever.mmr import MMRDiversifier
+from app.services.embedding_generation.sparse_encoder import get_sparse_encoder
 from app.config.config import RAGConfig
-from langchain.agents.middleware import dynamic_prompt, ModelRequest
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse
 from app.services.prompting.prompt_loader import load_system_prompt
+from app.services.prompting.context_assembler import ContextAssembler
 import openai
 from openai import OpenAI
 from langchain.agents import create_agent
 from pinecone.grpc import PineconeGRPC as Pinecone
 from pathlib import Path
-from langgraph.checkpoint.memory import InMemorySaver 
+from app.services.session_memory import BoundedMemorySaver
+from langchain_core.messages import AIMessage, SystemMessage
 from sqlalchemy.orm import Session
 from app.models.chathistory_model import ChatHistoryModel
 from app.utils.exceptions import BuildContextPromptError, RagChainError,DatabaseError, AppBaseException
 
 from app.utils.loggers import get_logger
+from app.utils.concurrency import run_blocking
+from app.utils.singleflight import SingleFlight, AsyncSingleFlight
 
 logger= get_logger(__name__)
 
-# Initialize in-memory
-checkpointer=InMemorySaver()
+SYSTEM_PROMPT_PATH = "app/resources/prompts/system_prompt.txt"
+NO_ANSWER_MESSAGE = "I'm sorry, I couldn't find an answer to your question."
 
-# Build dynamic prompt with retrieved context
-def build_prompt_with_context(sys_config: RAGConfig):
-    '''Builds a dynamic prompt function that incorporates retrieved documents into the system prompt.'''
-    try:
-        sys_prompt = load_system_prompt("app/resources/prompts/system_prompt.txt")
+# Initialize in-memory (bounded: LRU/TTL eviction, evicted sessions are rehydrated from chat_history)
+checkpointer=BoundedMemorySaver()
+
+#identical first questions with the same context share one LLM call
+answer_flight = SingleFlight("answers")
+aanswer_flight = AsyncSingleFlight("answers")
+
+class ContextPromptMiddleware(AgentMiddleware):
+    """Appends the documents retrieved for the last user message to the system prompt.
+
+    Implements both the sync and the async model-call hooks so that
+    `agent.astream` retrieves without blocking the event loop. For the first
+    question of a conversation, the semantic answer cache is consulted after
+    retrieval: on a hit the cached answer is returned without calling the LLM
+    (and is still recorded in the conversation memory like a model reply).
+    On a miss, concurrent identical questions with the same retrieved chunks
+    share one LLM call, and each conversation records the shared answer.
+    The prompt is fitted to the token budget by the ContextAssembler; its token
+    usage is recorded in the answer's `response_metadata["context_usage"]`.
+    """
+
+    def __init__(self, sys_config: RAGConfig, sys_prompt: str):
+        super().__init__()
+        self.sys_config = sys_config
+        self.sys_prompt = sys_prompt
+        #built once per agent: reuses the backend's long-lived index handles on every query
+        self.hybrid_retriever = HybridRetriever(sys_config.pinecone_vector_client,
+                                                sys_config.index_name,
+                                                sys_config.name_space,
+                                                backend=create_vector_backend(sys_config))
+        #top_ret_doc chunks picked for coverage from an over-fetched candidate set
+        self.diversifier = MMRDiversifier(sys_config.mmr_lambda,
+                                          sys_config.mmr_fetch_factor) if sys_config.mmr_enabled else None
+        #overlapping chunks of a page are sent once, near-duplicates not at all
+        self.chunk_merger = ChunkMerger(sys_config.chunk_overlap,
+                                        sys_config.duplicate_threshold) if sys_config.merge_chunks else None
+        self.context_assembler = ContextAssembler(sys_config.model_name,
+                                                  sys_config.max_prompt_tokens,
+                                                  sys_config.max_history_tokens)
+
+    def _with_context(self, request: ModelRequest, retrieved_chunks):
+        '''Model request with the budgeted system prompt + context and conversation, and its token usage'''
+        context = self.context_assembler.assemble(self.sys_prompt, retrieved_chunks, request.messages)
+        logger.info(f"Prompt assembled: {context.usage}")
+        model_request = request.override(system_message=SystemMessage(content=context.system_prompt),
+                                         messages=context.messages)
+        return model_request, context.usage
+
+    @staticmethod
+    def _record_usage(response, usage: dict):
+        message = response.result[-1] if isinstance(response, ModelResponse) else response
+        message.response_metadata["context_usage"] = usage
+        return response
 
-        @dynamic_prompt
-        def prompt_with_context(request: ModelRequest) -> str:
-            last_query = request.state["messages"][-1].text
+    def _is_first_turn(self, request: ModelRequest) -> bool:
+        #follow-up questions depend on the conversation, only standalone ones are cacheable
+        return len(request.state["messages"]) == 1
 
-            retrieved_docs = retrieve_docs(
-                pinecone_vector_client=sys_config.pinecone_vector_client,
-                index_name=sys_config.index_name,
-                name_space=sys_config.name_space,
-                openai_client=sys_config.openai_client,
-                dense_model=sys_config.dense_model,
-                dim=sys_config.dim,
-                query=last_query,
-                top_ret_doc=sys_config.top_ret_doc,
-                alpha=sys_config.alpha,
-            )
+    def _cache_answer(self, query_embedding, chunk_ids, response):
+        if query_embedding is None:
+            return
+        message = response.result[-1] if isinstance(response, ModelResponse) else response
+        answer_cache.put(query_embedding, chunk_ids, message.text.strip())
 
-            docs_content = "\n\n".join(retrieved_docs)
+    def _answer(self, handler, model_request, query_embedding, chunk_ids):
+        response = handler(model_request)
+        self._cache_answer(query_embedding, chunk_ids, response)
+        return response
 
-            system_message = f"{sys_prompt}\n\n{docs_content}"
+    async def _aanswer(self, handler, model_request, query_embedding, chunk_ids):
+        response = await handler(model_request)
+        self._cache_answer(query_embedding, chunk_ids, response)
+        return response
 
-            return system_message
+    def wrap_model_call(self, request: ModelRequest, handler):
+        last_query = request.state["messages"][-1].text
+        sparse_encoder = get_sparse_encoder(self.sys_config)
+        retrieved_chunks, query_vector = retrieve_chunks(
+            pinecone_vector_client=self.sys_config.pinecone_vector_client,
+            index_name=self.sys_config.index_name,
+            name_space=self.sys_config.name_space,
+            openai_client=self.sys_config.openai_client,
+            dense_model=self.sys_config.dense_model,
+            dim=self.sys_config.dim,
+            query=last_query,
+            top_ret_doc=self.sys_config.top_ret_doc,
+            alpha=self.sys_config.alpha,
+            dense_timeout=self.sys_config.dense_timeout,
+            sparse_timeout=self.sys_config.sparse_timeout,
+            hybrid_retriever=self.hybrid_retriever,
+            sparse_encoder=sparse_encoder,
+            chunk_merger=self.chunk_merger,
+            diversifier=self.diversifier,
+            with_query_embedding=True,
+        )
+        model_request, usage = self._with_context(request, retrieved_chunks)
+        if not self._is_first_turn(request):
+            return self._record_usage(handler(model_request), usage)
+
+        chunk_ids = [chunk.id for chunk in retrieved_chunks]
+        query_embedding = None
+        if answer_cache.enabled:
+            #the query vector retrieval just computed
+            query_embedding = query_vector
+            cached_answer = answer_cache.lookup(query_embedding, chunk_ids)
+            if cached_answer is not None:
+                logger.info("Answer served from the semantic answer cache.")
+                return AIMessage(content=cached_answer,
+                                 response_metadata={"context_usage": {**usage, "answer_cache_hit": True}})
+        response = answer_flight.do((id(self), normalize_query(last_query), tuple(chunk_ids)), self._answer,
+                                    handler, model_request, query_embedding, chunk_ids)
+        return self._record_usage(response, usage)
+
+    async def awrap_model_call(self, request: ModelRequest, handler):
+        last_query = request.state["messages"][-1].text
+        sparse_encoder = get_sparse_encoder(self.sys_config)
+        retrieved_chunks, query_vector = await aretrieve_chunks(
+            pinecone_vector_client=self.sys_config.pinecone_vector_client,
+            index_name=self.sys_config.index_name,
+            name_space=self.sys_config.name_space,
+            async_openai_client=self.sys_config.async_openai_client,
+            dense_model=self.sys_config.dense_model,
+            dim=self.sys_config.dim,
+            query=last_query,
+            top_ret_doc=self.sys_config.top_ret_doc,
+            alpha=self.sys_config.alpha,
+            dense_timeout=self.sys_config.dense_timeout,
+            sparse_timeout=self.sys_config.sparse_timeout,
+            hybrid_retriever=self.hybrid_retriever,
+            sparse_encoder=sparse_encoder,
+            chunk_merger=self.chunk_merger,
+            diversifier=self.diversifier,
+            with_query_embedding=True,
+        )
+        model_request, usage = self._with_context(request, retrieved_chunks)
+        if not self._is_first_turn(request):
+            return self._record_usage(await handler(model_request), usage)
+
+        chunk_ids = [chunk.id for chunk in retrieved_chunks]
+        query_embedding = None
+        if answer_cache.enabled:
+            query_embedding = query_vector
+            cached_answer = answer_cache.lookup(query_embedding, chunk_ids)
+            if cached_answer is not None:
+                logger.info("Answer served from the semantic answer cache.")
+                return AIMessage(content=cached_answer,
+                                 response_metadata={"context_usage": {**usage, "answer_cache_hit": True}})
+        response = await aanswer_flight.do((id(self), normalize_query(last_query), tuple(chunk_ids)),
+                                           self._aanswer, handler, model_request, query_embedding, chunk_ids)
+        return self._record_usage(response, usage)
+
+
+
+# Build dynamic prompt with retrieved context
+def build_prompt_with_context(sys_config: RAGConfig, prompt_path: str = SYSTEM_PROMPT_PATH):
+    '''Builds the prompt middleware that incorporates retrieved documents into the system prompt.'''
+    try:
+        sys_prompt = load_system_prompt(prompt_path)
+        prompt_with_context = ContextPromptMiddleware(sys_config, sys_prompt)
     except Exception as bcpe:
         logger.error(f"Error building context prompt: {bcpe}")
         raise BuildContextPromptError(f"Error building context prompt: {bcpe}")
@@ -53,16 +196,27 @@ def build_prompt_with_context(sys_config: RAGConfig):
 
 
 
-def rag_assistant(query, build_prompt_with_contex, model,session_id):
-    '''Runs the RAG assistant by creating an agent with the provided model and prompt middleware.'''
+def build_agent(sys_config: RAGConfig, prompt_path: str = SYSTEM_PROMPT_PATH):
+    '''Compiles the RAG agent graph with its LLM client and context prompt middleware.'''
+    return create_agent(model=sys_config.get_llm(),
+                        tools=[],
+                        middleware=[build_prompt_with_context(sys_config, prompt_path)],
+                        checkpointer=checkpointer)
+
+
+
+def _chat_input(query, history=None):
+    #history: earlier messages of a session being rehydrated (see load_session_history)
+    return {"messages": [*(history or []), {"role": "user", "content": query}]}
+
+
+
+def rag_assistant(query, agent, session_id, history=None):
+    '''Runs the RAG assistant on a compiled agent (see AgentRegistry).'''
     try:
         final_answer = []
-        agent = create_agent(model=model, 
-                             tools=[], 
-                             middleware=build_prompt_with_contex,
-                             checkpointer=checkpointer)
         for step in agent.stream(
-            {"messages": [{"role": "user", "content": query}]},
+            _chat_input(query, history),
             {"configurable": {"thread_id": session_id}}, 
             stream_mode="values",
         ):
@@ -91,16 +245,86 @@ def rag_assistant(query, build_prompt_with_contex, model,session_id):
         raise Exception("Unexpected error while running RAG assistant") from e
 
     logger.info("RAG assistant generated an answer successfully.")
-    return answer or "I'm sorry, I couldn't find an answer to your question."
+    return answer or NO_ANSWER_MESSAGE
+
+
+
+async def arag_assistant(query, agent, session_id, history=None):
+    '''Async variant of rag_assistant: drives agent.astream so the event loop is never blocked.'''
+    try:
+        answer = ""
+        async for step in agent.astream(
+            _chat_input(query, history),
+            {"configurable": {"thread_id": session_id}},
+            stream_mode="values",
+        ):
+            msg = step["messages"][-1]
+            if hasattr(msg, "content"):
+                text = msg.content
+            elif isinstance(msg, dict):
+                text = msg.get("content")
+            else:
+                text = str(msg)
+
+            if text:
+                answer = text
+        answer = answer.strip()
+    except AppBaseException as dce:
+        logger.error(f"Domain error while running RAG assistant: {dce}")
+        raise RagChainError
+
+    except Exception as e:
+        logger.error("Unexpected error while running RAG assistant")
+        raise Exception("Unexpected error while running RAG assistant") from e
+
+    logger.info("RAG assistant generated an answer successfully.")
+    return answer or NO_ANSWER_MESSAGE
+
+
+
+def rag_assistant_stream(query, agent, session_id, history=None):
+    '''Runs the RAG assistant and yields answer tokens as soon as the LLM produces them.'''
+    try:
+        for chunk, _metadata in agent.stream(
+            _chat_input(query, history),
+            {"configurable": {"thread_id": session_id}},
+            stream_mode="messages",
+        ):
+            #only forward AI output (model tokens, or a whole cached answer), not replayed user/tool messages
+            if isinstance(chunk, AIMessage) and chunk.text:
+                yield chunk.text
+    except AppBaseException as dce:
+        logger.error(f"Domain error while streaming RAG assistant: {dce}")
+        raise RagChainError
+
+    except Exception as e:
+        logger.error("Unexpected error while streaming RAG assistant")
+        raise Exception("Unexpected error while streaming RAG assistant") from e
+
+    logger.info("RAG assistant streamed an answer successfully.")
 
 
 #store chat in db
+def last_context_usage(agent, session_id):
+    '''Prompt token usage recorded for the last answer of a session (None if unknown)'''
+    try:
+        messages = agent.get_state({"configurable": {"thread_id": session_id}}).values.get("messages", [])
+    except Exception as e:
+        logger.warning(f"Could not read context usage of session {session_id}: {e}")
+        return None
+    if messages and isinstance(messages[-1], AIMessage):
+        return messages[-1].response_metadata.get("context_usage")
+    return None
+
+
+
 def save_chat(sessionid: id, msg: str, role: str, db: Session):
     try: 
         db_chat= ChatHistoryModel(session_id= sessionid, role= role, content= msg)
         db.add(db_chat)
         db.commit()
         db.refresh(db_chat)
+        return db_chat.id
 
     except AppBaseException as dbe:
         logger.error(f"Error while saving chat history in database: {dbe}")
@@ -108,4 +332,10 @@ def save_chat(sessionid: id, msg: str, role: str, db: Session):
 
     except Exception as e:
         logger.error("Unexpected error while saving chat history in database.")
-        raise Exception("Unexpected error while saving chat history in database.") from e
\ No newline at end of file
+        raise Exception("Unexpected error while saving chat history in database.") from e
+
+
+
+async def asave_chat(sessionid: str, msg: str, role: str, db: Session):
+    '''Run the synchronous SQLAlchemy commit of save_chat in the bounded thread pool'''
+    return await run_blocking(save_chat, sessionid=sessionid, msg=msg, role=role, db=db)
@@ -1,12 +1,98 @@
+from dataclasses import dataclass, field
 from app.services.retriever.hybrid_retriever import HybridRetriever
-from app.services.embedding_generation.query_embeddings import generate_query_embeddings
+from app.services.retriever.chunk_merger import ChunkMerger
+from app.services.retriever.mmr import MMRDiversifier
+from app.services.embedding_generation.query_embeddings import (generate_query_embeddings, agenerate_query_embeddings,
+                                                                generate_batch_query_embeddings)
+from app.services.embedding_generation.query_cache import normalize_query
+from app.utils.singleflight import SingleFlight, AsyncSingleFlight
 from app.utils.loggers import get_logger
 from app.utils.exceptions import HybridRetreiverError
 
 logger = get_logger(__name__)
 
+#identical retrievals already in flight are shared instead of repeated
+retrieval_flight = SingleFlight("retrieval")
+aretrieval_flight = AsyncSingleFlight("retrieval")
 
-def retrieve_docs(
+
+@dataclass
+class RetrievedChunk:
+    """One retrieved chunk with its vector ID and hybrid score."""
+    id: str
+    text: str
+    score: float
+    page: int = None
+    source: str = None
+    values: list = field(default=None, repr=False)
+
+
+def matches_to_chunks(query_response, top_ret_doc: int):
+    '''Convert the top matches of a query response into RetrievedChunk objects'''
+    chunks = []
+    for match in query_response.matches[:top_ret_doc]:
+        metadata = match.metadata or {}
+        chunks.append(RetrievedChunk(id=match.id,
+                                     text=metadata['text'],
+                                     score=match.score,
+                                     page=metadata.get('page'),
+                                     source=metadata.get('source'),
+                                     values=list(match.values) if getattr(match, 'values', None) else None))
+    return chunks
+
+
+def matches_to_texts(query_response, top_ret_doc: int):
+    '''Extract the chunk text of the top matches of a query response'''
+    return [chunk.text for chunk in matches_to_chunks(query_response, top_ret_doc)]
+
+
+def _retrieval_key(index_name, name_space, dense_model, dim, query, top_ret_doc, alpha, hybrid_retriever,
+                   sparse_encoder, chunk_merger, diversifier):
+    backend = hybrid_retriever.backend.name if hybrid_retriever is not None else "pinecone"
+    sparse_model = sparse_encoder.model_id if sparse_encoder is not None else None
+    merger_settings = chunk_merger.settings if chunk_merger is not None else None
+    mmr_settings = diversifier.settings if diversifier is not None else None
+    return (backend, index_name, name_space, dense_model, dim, sparse_model, top_ret_doc, alpha,
+            merger_settings, mmr_settings, normalize_query(query))
+
+
+def retrieve_chunks(
+    pinecone_vector_client,
+    index_name: str,
+    name_space: str,
+    openai_client,
+    dense_model: str,
+    dim: int,
+    query: str,
+    top_ret_doc: int,
+    alpha: float,
+    dense_timeout: float = None,
+    sparse_timeout: float = None,
+    hybrid_retriever: HybridRetriever = None,
+    sparse_encoder=None,
+    chunk_merger: ChunkMerger = None,
+    diversifier: MMRDiversifier = None,
+    with_query_embedding: bool = False
+):
+    """Retrieve chunks (ID, text, score, page, source) from the vector index using hybrid retrieval.
+
+    Concurrent calls for the same (normalized) query and retrieval settings share one
+    embedding + search. With a diversifier, top_ret_doc chunks are selected by MMR from
+    an over-fetched candidate set; with a chunk_merger, overlapping chunks of the same
+    page are merged and near-duplicates dropped. With `with_query_embedding`, returns
+    (chunks, dense query vector) so callers need not embed the query again.
+    """
+    key = _retrieval_key(index_name, name_space, dense_model, dim, query, top_ret_doc, alpha,
+                         hybrid_retriever, sparse_encoder, chunk_merger, diversifier)
+    chunks, dense_query_vector = retrieval_flight.do(key, _retrieve_chunks, pinecone_vector_client, index_name,
+                                                     name_space, openai_client, dense_model, dim, query,
+                                                     top_ret_doc, alpha, dense_timeout, sparse_timeout,
+                                                     hybrid_retriever, sparse_encoder, chunk_merger, diversifier)
+    #callers may reorder or filter their copy
+    return (list(chunks), dense_query_vector) if with_query_embedding else list(chunks)
+
+
+def _retrieve_chunks(
     pinecone_vector_client,
     index_name: str,
     name_space: str,
@@ -15,36 +101,191 @@ def retrieve_docs(
     dim: int,
     query: str,
     top_ret_doc: int,
-    alpha: float
+    alpha: float,
+    dense_timeout: float = None,
+    sparse_timeout: float = None,
+    hybrid_retriever: HybridRetriever = None,
+    sparse_encoder=None,
+    chunk_merger: ChunkMerger = None,
+    diversifier: MMRDiversifier = None
 ):
-    """Retrieve documents from Pinecone index using hybrid retrieval."""
     try:
 
         #generate query embeddings
-        dense_query_embedding, sparse_query_embedding = generate_query_embeddings(query, 
-                                                                                dense_model, 
-                                                                                dim, 
-                                                                                openai_client, 
-                                                                                pinecone_vector_client)
+        dense_query_embedding, sparse_query_embedding = generate_query_embeddings(query,
+                                                                                dense_model,
+                                                                                dim,
+                                                                                openai_client,
+                                                                                pinecone_vector_client,
+                                                                                dense_timeout=dense_timeout,
+                                                                                sparse_timeout=sparse_timeout,
+                                                                                sparse_encoder=sparse_encoder)
         """Perform hybrid search on Pinecone index using dense and sparse query embeddings."""
-        # Initialize HybridRetriever
-        hybrid_retriever = HybridRetriever(pinecone_vector_client, 
-                                        index_name, 
-                                        name_space)
+        # Initialize HybridRetriever (callers on the hot path pass a long-lived one)
+        if hybrid_retriever is None:
+            hybrid_retriever = HybridRetriever(pinecone_vector_client,
+                                            index_name,
+                                            name_space)
         #retrieve similar documents from Pinecone based on hybrid retrieval
-        
+        #(over-fetched with their dense vectors when diversifying)
+        fetch_k = diversifier.fetch_k(top_ret_doc) if diversifier is not None else top_ret_doc
         query_response= hybrid_retriever.contextual_hybrid_search(
-                                dense_query_embedding, 
+                                dense_query_embedding,
+                                sparse_query_embedding,
+                                fetch_k,
+                                alpha,
+                                include_values=diversifier is not None)
+        #get the most similar retrieved chunks
+        retrieved_chunks = matches_to_chunks(query_response, fetch_k)
+        if diversifier is not None:
+            retrieved_chunks = diversifier(dense_query_embedding[0], retrieved_chunks, top_ret_doc)
+        if chunk_merger is not None:
+            #overlapping neighbours merged, near-duplicates dropped
+            retrieved_chunks = chunk_merger(retrieved_chunks)
+
+    except Exception as hre:
+        logger.error(f"Error during document retrieval: {hre}")
+        raise HybridRetreiverError(f"Error during document retrieval: {hre}")
+    logger.info(f"Retrieved {len(retrieved_chunks)} documents for the query.")
+    logger.debug(f"Retrieved documents: {retrieved_chunks}")
+    return retrieved_chunks, dense_query_embedding[0]
+
+
+def retrieve_docs(*args, **kwargs):
+    """Retrieve the texts of the most similar chunks (see retrieve_chunks for the arguments)."""
+    return [chunk.text for chunk in retrieve_chunks(*args, **kwargs)]
+
+
+
+async def aretrieve_chunks(
+    pinecone_vector_client,
+    index_name: str,
+    name_space: str,
+    async_openai_client,
+    dense_model: str,
+    dim: int,
+    query: str,
+    top_ret_doc: int,
+    alpha: float,
+    dense_timeout: float = None,
+    sparse_timeout: float = None,
+    hybrid_retriever: HybridRetriever = None,
+    sparse_encoder=None,
+    chunk_merger: ChunkMerger = None,
+    diversifier: MMRDiversifier = None,
+    with_query_embedding: bool = False
+):
+    """Async variant of retrieve_chunks: awaits the embedding and search calls instead of blocking."""
+    key = _retrieval_key(index_name, name_space, dense_model, dim, query, top_ret_doc, alpha,
+                         hybrid_retriever, sparse_encoder, chunk_merger, diversifier)
+    chunks, dense_query_vector = await aretrieval_flight.do(key, _aretrieve_chunks, pinecone_vector_client,
+                                                            index_name, name_space, async_openai_client,
+                                                            dense_model, dim, query, top_ret_doc, alpha,
+                                                            dense_timeout, sparse_timeout, hybrid_retriever,
+                                                            sparse_encoder, chunk_merger, diversifier)
+    return (list(chunks), dense_query_vector) if with_query_embedding else list(chunks)
+
+
+async def _aretrieve_chunks(
+    pinecone_vector_client,
+    index_name: str,
+    name_space: str,
+    async_openai_client,
+    dense_model: str,
+    dim: int,
+    query: str,
+    top_ret_doc: int,
+    alpha: float,
+    dense_timeout: float = None,
+    sparse_timeout: float = None,
+    hybrid_retriever: HybridRetriever = None,
+    sparse_encoder=None,
+    chunk_merger: ChunkMerger = None,
+    diversifier: MMRDiversifier = None
+):
+    try:
+        #generate query embeddings
+        dense_query_embedding, sparse_query_embedding = await agenerate_query_embeddings(query,
+                                                                                       dense_model,
+                                                                                       dim,
+                                                                                       async_openai_client,
+                                                                                       pinecone_vector_client,
+                                                                                       dense_timeout=dense_timeout,
+                                                                                       sparse_timeout=sparse_timeout,
+                                                                                       sparse_encoder=sparse_encoder)
+        if hybrid_retriever is None:
+            hybrid_retriever = HybridRetriever(pinecone_vector_client,
+                                            index_name,
+                                            name_space)
+        fetch_k = diversifier.fetch_k(top_ret_doc) if diversifier is not None else top_ret_doc
+        query_response = await hybrid_retriever.acontextual_hybrid_search(
+                                dense_query_embedding,
                                 sparse_query_embedding,
-                                top_ret_doc, 
-                                alpha)
-        #get the content of the most similar retrieved documents
-        num_docs = min(top_ret_doc, len(query_response.matches))
-        retrieved_docs = [query_response.matches[i].metadata['text'] for i in range(num_docs)]
+                                fetch_k,
+                                alpha,
+                                include_values=diversifier is not None)
+        retrieved_chunks = matches_to_chunks(query_response, fetch_k)
+        if diversifier is not None:
+            retrieved_chunks = diversifier(dense_query_embedding[0], retrieved_chunks, top_ret_doc)
+        if chunk_merger is not None:
+            #overlapping neighbours merged, near-duplicates dropped
+            retrieved_chunks = chunk_merger(retrieved_chunks)
 
     except Exception as hre:
         logger.error(f"Error during document retrieval: {hre}")
         raise HybridRetreiverError(f"Error during document retrieval: {hre}")
-    logger.info(f"Retrieved {len(retrieved_docs)} documents for the query.")
-    logger.debug(f"Retrieved documents: {retrieved_docs}")
-    return retrieved_docs
\ No newline at end of file
+    logger.info(f"Retrieved {len(retrieved_chunks)} documents for the query.")
+    logger.debug(f"Retrieved documents: {retrieved_chunks}")
+    return retrieved_chunks, dense_query_embedding[0]
+
+
+async def aretrieve_docs(*args, **kwargs):
+    """Async variant of retrieve_docs."""
+    return [chunk.text for chunk in await aretrieve_chunks(*args, **kwargs)]
+
+
+
+def retrieve_chunks_batch(
+    pinecone_vector_client,
+    index_name: str,
+    name_space: str,
+    openai_client,
+    dense_model: str,
+    dim: int,
+    queries: list,
+    top_ret_doc: int,
+    alpha: float,
+    dense_timeout: float = None,
+    sparse_timeout: float = None,
+    hybrid_retriever: HybridRetriever = None,
+    sparse_encoder=None
+):
+    """Retrieve chunks for many queries at once.
+
+    All queries are embedded together (batched dense and sparse calls) and the
+    index queries run concurrently. Returns one list of chunks per query, in order.
+    """
+    try:
+        dense_query_embeddings, sparse_query_embeddings = generate_batch_query_embeddings(queries,
+                                                                                        dense_model,
+                                                                                        dim,
+                                                                                        openai_client,
+                                                                                        pinecone_vector_client,
+                                                                                        dense_timeout=dense_timeout,
+                                                                                        sparse_timeout=sparse_timeout,
+                                                                                        sparse_encoder=sparse_encoder)
+        if hybrid_retriever is None:
+            hybrid_retriever = HybridRetriever(pinecone_vector_client,
+                                            index_name,
+                                            name_space)
+        query_responses = hybrid_retriever.batch_hybrid_search(dense_query_embeddings,
+                                                               sparse_query_embeddings,
+                                                               top_ret_doc,
+                                                               alpha)
+        retrieved_chunks = [matches_to_chunks(response, top_ret_doc) for response in query_responses]
+
+    except Exception as hre:
+        logger.error(f"Error during batch document retrieval: {hre}")
+        raise HybridRetreiverError(f"Error during batch document retrieval: {hre}")
+    logger.info(f"Retrieved documents for {len(queries)} queries.")
+    return retrieved_chunks
@@ -0,0 +1,177 @@
+import numpy as np
+
+#case-insensitive, line breaks/tabs compare equal to spaces (one bytes-level pass, much cheaper than a regex)
+_NORMALIZE_TABLE = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ\t\n\r\x0b\x0c",
+                                   b"abcdefghijklmnopqrstuvwxyz     ")
+#shingles are 8-byte windows (one uint64 each); 1 in 2**SHINGLE_SAMPLE_BITS is kept
+SHINGLE_CHARS = 8
+SHINGLE_SAMPLE_BITS = 4
+#odd 64-bit multiplier (Fibonacci hashing): a bijection whose top bits are well mixed
+_HASH_MIX = np.uint64(0x9E3779B97F4A7C15)
+#a shingle is sampled if the top SHINGLE_SAMPLE_BITS bits of its hash are zero
+_SAMPLE_LIMIT = np.uint64(1 << (64 - SHINGLE_SAMPLE_BITS))
+
+
+def _sampled_shingles(texts):
+    '''Hashed character shingles of all texts in one vectorized pass.
+
+    Returns (text index, shingle hash) of a deterministic 1/2**SHINGLE_SAMPLE_BITS
+    sample of the shingles: the same shingle is kept or skipped in every text,
+    so set overlaps are preserved.
+    '''
+    encoded = [t.encode("utf-8") for t in texts]
+    joined = b"".join(encoded).translate(_NORMALIZE_TABLE)
+    n_windows = len(joined) - SHINGLE_CHARS + 1
+    if n_windows <= 0:
+        return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.uint64)
+    #every 8-byte window read as one integer (overlapping strided view), then mixed
+    hashes = np.ndarray((n_windows,), dtype="<u8", buffer=joined, strides=(1,)) * _HASH_MIX
+    positions = np.flatnonzero(hashes < _SAMPLE_LIMIT)
+    ends = np.cumsum([len(e) for e in encoded])
+    text_ids = ends.searchsorted(positions, side="right")
+    #windows crossing into the next text are not shingles of either
+    keep = positions + SHINGLE_CHARS <= ends[text_ids]
+    return text_ids[keep], hashes[positions[keep]]
+
+
+def near_duplicate_matrix(texts):
+    '''containment[i, j]: share of text j's sampled shingles that also occur in text i'''
+    text_ids, hashes = _sampled_shingles(texts)
+    n = len(texts)
+    #pack (hash, text) into one sortable integer: the low bits of the hash make
+    #room for the text index (the high bits are plenty to tell shingles apart)
+    id_bits = np.uint64(max(1, (n - 1).bit_length()))
+    keys = np.unique(hashes >> id_bits << id_bits | text_ids.astype(np.uint64))
+    #np.unique also drops repeats of a shingle within one text
+    hashes = keys >> id_bits
+    text_ids = (keys - (hashes << id_bits)).astype(np.intp)
+    sizes = np.bincount(text_ids, minlength=n)
+
+    #texts sharing a shingle sit next to each other in the sorted keys; only
+    #those keys (usually a small fraction) can add to the shared counts
+    same = hashes[1:] == hashes[:-1]
+    if same.any():
+        in_several = np.zeros(len(hashes), dtype=bool)
+        in_several[1:] = same
+        in_several[:-1] |= same
+        hashes, ids = hashes[in_several], text_ids[in_several]
+        column = np.cumsum(np.concatenate(([False], hashes[1:] != hashes[:-1])))
+        #texts x shared shingles incidence: its Gram matrix counts the shingles each pair shares
+        incidence = np.zeros((n, column[-1] + 1), dtype=np.float32)
+        incidence[ids, column] = 1.0
+        shared = incidence @ incidence.T
+    else:
+        shared = np.zeros((n, n), dtype=np.float32)
+    shared[np.diag_indices(n)] = sizes
+    return shared / np.maximum(sizes, 1)[None, :]
+
+
+def _overlap(first: str, second: str, min_overlap: int, max_overlap: int) -> int:
+    '''Length of the longest suffix of first that is a prefix of second (0 if shorter than min_overlap)'''
+    probe = second[:min_overlap]
+    if len(probe) < min_overlap:
+        return 0
+    pos = first.find(probe, max(0, len(first) - max_overlap))
+    while pos != -1:
+        if second.startswith(first[pos:]):
+            return len(first) - pos
+        pos = first.find(probe, pos + 1)
+    return 0
+
+
+class ChunkMerger:
+    """Post-retrieval cleanup of the chunks sent to the LLM.
+
+    1. Overlaps: chunks from the same source and page where one ends with the
+       start of the other (the splitter's `chunk_overlap`) are merged into one
+       chunk, so the shared text is sent once.
+    2. Near-duplicates: a chunk whose sampled character shingles are at least
+       `duplicate_threshold` contained in a higher-scoring chunk is dropped.
+       Merging first leaves less text to shingle, and a copy of any member of
+       a merged run is contained in the merged chunk.
+
+    Merged chunks keep the best score and the position of their best member;
+    their ID joins the member IDs with "+".
+    """
+
+    def __init__(self, chunk_overlap: int, duplicate_threshold: float = 0.8, min_overlap: int = 20):
+        self.max_overlap = 2 * chunk_overlap
+        self.duplicate_threshold = duplicate_threshold
+        self.min_overlap = min_overlap
+
+
+    @property
+    def settings(self):
+        return (self.max_overlap, self.duplicate_threshold, self.min_overlap)
+
+
+    def drop_near_duplicates(self, chunks):
+        if len(chunks) < 2:
+            return chunks
+        duplicates = near_duplicate_matrix([chunk.text for chunk in chunks]) >= self.duplicate_threshold
+        np.fill_diagonal(duplicates, False)
+        #only chunks containing another one can cause a drop
+        containing = np.flatnonzero(duplicates.any(axis=1))
+        if not len(containing):
+            return chunks
+        #best chunks first: a chunk is dropped if a kept, higher-ranked chunk contains it
+        rank = np.empty(len(chunks), dtype=np.intp)
+        rank[np.argsort([-chunk.score for chunk in chunks], kind="stable")] = np.arange(len(chunks))
+        dropped = np.zeros(len(chunks), dtype=bool)
+        for i in sorted(containing.tolist(), key=rank.__getitem__):
+            if not dropped[i]:
+                dropped |= duplicates[i] & (rank > rank[i])
+        return [chunk for chunk, drop in zip(chunks, dropped.tolist()) if not drop]
+
+
+    def merge_overlaps(self, chunks):
+        #only chunks of the same source and page can overlap
+        groups = {}
+        for i, chunk in enumerate(chunks):
+            if chunk.page is not None:
+                groups.setdefault((chunk.source, chunk.page), []).append(i)
+        if len(groups) == len(chunks):
+            return list(chunks)
+
+        texts = [chunk.text for chunk in chunks]
+        min_overlap, max_overlap = self.min_overlap, self.max_overlap
+        #successor[i] = (j, overlap): chunk j continues chunk i
+        successor, has_predecessor = {}, set()
+        for members in groups.values():
+            if len(members) < 2:
+                continue
+            probes = [(j, texts[j][:min_overlap]) for j in members]
+            for i in members:
+                tail = texts[i][-max_overlap:]
+                for j, probe in probes:
+                    #cheap substring prefilter before the exact suffix/prefix check
+                    if j == i or j in has_predecessor or probe not in tail:
+                        continue
+                    k = _overlap(tail, texts[j], min_overlap, max_overlap)
+                    if k:
+                        successor[i] = (j, k)
+                        has_predecessor.add(j)
+                        break
+        if not successor:
+            return list(chunks)
+
+        merged = list(chunks)   # None once absorbed into another chunk
+        #a chunk has at most one predecessor, so chains from the heads never loop
+        for head in successor.keys() - has_predecessor:
+            chain, parts = [head], [texts[head]]
+            while chain[-1] in successor:
+                j, k = successor[chain[-1]]
+                chain.append(j)
+                parts.append(texts[j][k:])
+            best = max(chain, key=lambda i: chunks[i].score)
+            for i in chain:
+                merged[i] = None
+            #built directly: dataclasses.replace costs as much as the overlap search
+            top = chunks[best]
+            merged[best] = type(top)(id="+".join(chunks[i].id for i in chain), text="".join(parts), score=top.score,
+                                     page=top.page, source=top.source)
+        return [chunk for chunk in merged if chunk is not None]
+
+
+    def __call__(self, chunks):
+        return self.drop_near_duplicates(self.merge_overlaps(chunks))
@@ -1,19 +1,27 @@
+from itertools import chain
+import numpy as np
 from pinecone.grpc import PineconeGRPC as Pinecone
 from pinecone import ServerlessSpec
 from app.utils.loggers import get_logger
 import openai
 from openai import OpenAI
 from app.utils.exceptions import HybridSearchError
+from app.utils.concurrency import run_blocking, get_batch_search_pool
+from app.services.vector_db.backends.base import VectorBackend
+from app.services.vector_db.backends.pinecone_backend import PineconeBackend
 
 logger = get_logger(__name__)
 
 class HybridRetriever:
     """Hybrid Retriever combining dense and sparse retrieval methods."""
 
-    def __init__(self, pinecone_vector_client: Pinecone, index_name: str, name_space: str):
+    def __init__(self, pinecone_vector_client: Pinecone, index_name: str, name_space: str,
+                 backend: VectorBackend = None):
         self.pc = pinecone_vector_client
         self.index_name = index_name
         self.name_space = name_space
+        #where the search runs: the Pinecone index by default, or a local in-process index
+        self.backend = backend or PineconeBackend(pinecone_vector_client, index_name, name_space)
 
     def hybrid_score_norm(self, dense, sparse, alpha: float):
         """Hybrid score using a convex combination
@@ -25,31 +33,84 @@ class HybridRetriever:
             sparse: a dict of `indices` and `values`
             alpha: scale between 0 and 1
         """
+        hdense, hsparse = self.hybrid_score_norm_batch([dense], [sparse], alpha)
+        return hdense[0], hsparse[0]
+
+
+    def hybrid_score_norm_batch(self, dense_batch, sparse_batch, alpha: float):
+        """hybrid_score_norm for a whole batch of queries with NumPy float32 buffers.
+
+        Dense vectors are scaled as one (n, dim) matrix and the sparse values of
+        all queries as one concatenated buffer, instead of per-element Python loops.
+
+        Returns:
+            a float32 (n, dim) matrix and one sparse dict per query
+            (`indices`, float32 `values`)
+        """
         if alpha < 0 or alpha > 1:
             raise ValueError("Alpha must be between 0 and 1")
-        hs = {
-            'indices': sparse['sparse_indices'],
-            'values':  [v * (1 - alpha) for v in sparse['sparse_values']]
-        }
-        return [v * alpha for v in dense], hs
+        hdense = np.asarray(dense_batch, dtype=np.float32) * np.float32(alpha)
+        lengths = [len(sparse['sparse_values']) for sparse in sparse_batch]
+        values = np.fromiter(chain.from_iterable(sparse['sparse_values'] for sparse in sparse_batch),
+                             dtype=np.float32, count=sum(lengths))
+        values *= np.float32(1 - alpha)
+        hsparse = [{'indices': sparse['sparse_indices'], 'values': sparse_values}
+                   for sparse, sparse_values in zip(sparse_batch, np.split(values, np.cumsum(lengths)[:-1]))]
+        return hdense, hsparse
 
 
-    def contextual_hybrid_search(self, dense_query_embedding, sparse_query_embedding, top_ret_doc: int, alpha: float):
+    def contextual_hybrid_search(self, dense_query_embedding, sparse_query_embedding, top_ret_doc: int, alpha: float,
+                                 include_values: bool = False):
         
-        """Perform hybrid search on Pinecone index using dense and sparse query embeddings."""
+        """Perform hybrid search on the vector backend using dense and sparse query embeddings."""
         try:
-            for sparse, dense in zip(sparse_query_embedding, dense_query_embedding):
-                hdense, hsparse = self.hybrid_score_norm(dense, sparse, alpha=alpha)
-                index = self.pc.Index(self.index_name)
-                query_response = index.query(
-                namespace= self.name_space,
-                top_k=top_ret_doc,
-                vector=hdense,
-                sparse_vector=hsparse,
-                include_values=False,
-                include_metadata=True
-            )
+            hdense_batch, hsparse_batch = self.hybrid_score_norm_batch(dense_query_embedding, sparse_query_embedding,
+                                                                       alpha)
+            for hdense, hsparse in zip(hdense_batch, hsparse_batch):
+                query_response = self._search_one(hdense, hsparse, top_ret_doc, include_values)
         except Exception as hse:
             logger.error(f"Error during hybrid search: {hse}")
             raise HybridSearchError(f"Error during hybrid search: {hse}")
-        return query_response
\ No newline at end of file
+        return query_response
+
+
+    def _search_one(self, hdense, hsparse, top_ret_doc: int, include_values: bool = False):
+        return self.backend.query(vector=hdense,
+                                  sparse_vector=hsparse,
+                                  top_k=top_ret_doc,
+                                  include_values=include_values,
+                                  include_metadata=True)
+
+
+    def batch_hybrid_search(self, dense_query_embeddings, sparse_query_embeddings, top_ret_doc: int, alpha: float,
+                            include_values: bool = False):
+        """Hybrid search for many queries, index queries running concurrently in the batch search pool.
+
+        Returns one query response per (dense, sparse) pair, in input order."""
+        try:
+            #normalize the whole batch at once, then fan out the index queries
+            hdense_batch, hsparse_batch = self.hybrid_score_norm_batch(dense_query_embeddings,
+                                                                       sparse_query_embeddings, alpha)
+            futures = [get_batch_search_pool().submit(self._search_one, hdense, hsparse, top_ret_doc, include_values)
+                       for hdense, hsparse in zip(hdense_batch, hsparse_batch)]
+            try:
+                query_responses = [future.result() for future in futures]
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+        except Exception as hse:
+            logger.error(f"Error during batch hybrid search: {hse}")
+            raise HybridSearchError(f"Error during batch hybrid search: {hse}")
+        return query_responses
+
+
+    async def acontextual_hybrid_search(self, dense_query_embedding, sparse_query_embedding, top_ret_doc: int, alpha: float,
+                                        include_values: bool = False):
+        """Run the blocking hybrid search (gRPC or local scoring) in the bounded thread pool."""
+        return await run_blocking(self.contextual_hybrid_search,
+                                  dense_query_embedding,
+                                  sparse_query_embedding,
+                                  top_ret_doc,
+                                  alpha,
+                                  include_values)
@@ -0,0 +1,66 @@
+import numpy as np
+
+
+def mmr_select(query_vector, candidate_vectors, k: int, lambda_mult: float):
+    '''Indices of k candidates chosen by maximal marginal relevance, in selection order.
+
+    Each step picks the candidate maximizing
+        lambda_mult * sim(query, c) - (1 - lambda_mult) * max(sim(c, selected))
+    with cosine similarities computed once as matrix products.
+    '''
+    vectors = np.asarray(candidate_vectors, dtype=np.float32)
+    query = np.asarray(query_vector, dtype=np.float32).ravel()
+    vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    relevance = vectors @ query
+    similarity = vectors @ vectors.T
+
+    k = min(k, len(vectors))
+    if k <= 0:
+        return []
+    #the first pick is the most relevant candidate
+    selected = [int(np.argmax(relevance))]
+    redundancy = similarity[selected[0]].copy()
+    while len(selected) < k:
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
+
+
+class MMRDiversifier:
+    """Diversifies the retrieved chunks with maximal marginal relevance.
+
+    The index is queried for `fetch_factor` times the top k, with the dense
+    vectors of the matches; of those, k chunks are selected that are relevant
+    to the query (dense cosine similarity) but not redundant with the chunks
+    already selected. `lambda_mult` trades the two: 1 is plain relevance order,
+    0 is maximal diversity.
+    """
+
+    def __init__(self, lambda_mult: float = 0.7, fetch_factor: int = 4):
+        if not 0 <= lambda_mult <= 1:
+            raise ValueError("lambda_mult must be between 0 and 1")
+        self.lambda_mult = lambda_mult
+        self.fetch_factor = max(1, fetch_factor)
+
+
+    @property
+    def settings(self):
+        return (self.lambda_mult, self.fetch_factor)
+
+
+    def fetch_k(self, top_k: int) -> int:
+        return top_k * self.fetch_factor
+
+
+    def __call__(self, query_vector, chunks, top_k: int):
+        if len(chunks) <= top_k:
+            return chunks
+        if any(not chunk.values for chunk in chunks):
+            #vectors missing (backend did not return them): keep the index order
+            return chunks[:top_k]
+        selected = mmr_select(query_vector, [chunk.values for chunk in chunks], top_k, self.lambda_mult)
+        return [chunks[i] for i in selected]
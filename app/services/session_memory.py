@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from langgraph.checkpoint.memory import InMemorySaver
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.models.chathistory_model import ChatHistoryModel
+from app.utils.exceptions import DatabaseError
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+#chat_history roles -> chat message roles
+HISTORY_ROLES = {"User": "user", "AI Assistant": "assistant"}
+#checkpoints kept per thread: the latest one and its parent (pending writes may still target it)
+KEPT_CHECKPOINTS = 2
+
+
+class BoundedMemorySaver(InMemorySaver):
+    """InMemorySaver with bounded memory.
+
+    At most `max_sessions` threads are kept: the least recently used thread is
+    evicted when a new one would exceed the limit, and threads idle for more
+    than `ttl_seconds` are evicted as well. Within a thread only the latest
+    checkpoints are kept, so a long conversation holds one copy of its
+    messages instead of one per step. Evicted sessions are rehydrated from the
+    chat_history table (see `load_session_history`).
+    """
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: float = 3600):
+        super().__init__()
+        self._lock = threading.RLock()
+        self._last_used = OrderedDict()     # thread_id -> monotonic time of last access
+        self._recent = defaultdict(deque)   # (thread_id, ns) -> ids of the kept checkpoints
+        self._versions = {}                 # (thread_id, ns, checkpoint_id) -> channel versions
+        self._synced_rows = {}              # thread_id -> last chat_history row reflected in memory
+        self.evictions = 0
+        self.configure(max_sessions, ttl_seconds)
+
+
+    def configure(self, max_sessions: int, ttl_seconds: float):
+        with self._lock:
+            self.max_sessions = max_sessions
+            self.ttl_seconds = ttl_seconds
+            self._evict()
+
+
+    def _touch(self, thread_id: str):
+        with self._lock:
+            self._last_used[thread_id] = time.monotonic()
+            self._last_used.move_to_end(thread_id)
+            self._evict(keep=thread_id)
+
+
+    def _evict(self, keep: str = None):
+        now = time.monotonic()
+        while self._last_used:
+            thread_id, last_used = next(iter(self._last_used.items()))
+            if thread_id == keep:
+                break
+            if len(self._last_used) <= self.max_sessions and now - last_used <= self.ttl_seconds:
+                break
+            self.delete_thread(thread_id)
+            self.evictions += 1
+
+
+    def _prune(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str, channel_versions: dict):
+        with self._lock:
+            self._versions[(thread_id, checkpoint_ns, checkpoint_id)] = dict(channel_versions)
+            recent = self._recent[(thread_id, checkpoint_ns)]
+            recent.append(checkpoint_id)
+            while len(recent) > KEPT_CHECKPOINTS:
+                old_id = recent.popleft()
+                self.storage[thread_id][checkpoint_ns].pop(old_id, None)
+                self.writes.pop((thread_id, checkpoint_ns, old_id), None)
+                old_versions = self._versions.pop((thread_id, checkpoint_ns, old_id), {})
+                kept = [self._versions.get((thread_id, checkpoint_ns, kept_id), {}) for kept_id in recent]
+                for channel, version in old_versions.items():
+                    if all(versions.get(channel) != version for versions in kept):
+                        self.blobs.pop((thread_id, checkpoint_ns, channel, version), None)
+
+
+    def get_tuple(self, config):
+        thread_id = config["configurable"].get("thread_id")
+        if thread_id is not None and thread_id in self.storage:
+            self._touch(thread_id)
+        return super().get_tuple(config)
+
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        thread_id = config["configurable"]["thread_id"]
+        self._touch(thread_id)
+        next_config = super().put(config, checkpoint, metadata, new_versions)
+        self._prune(thread_id, config["configurable"]["checkpoint_ns"], checkpoint["id"],
+                    checkpoint["channel_versions"])
+        return next_config
+
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._last_used.pop(thread_id, None)
+            self._synced_rows.pop(thread_id, None)
+            for key in [key for key in self._recent if key[0] == thread_id]:
+                del self._recent[key]
+            for key in [key for key in self._versions if key[0] == thread_id]:
+                del self._versions[key]
+
+
+    def is_synced(self, thread_id: str, last_row_id) -> bool:
+        '''True if the in-memory thread already reflects chat_history up to last_row_id'''
+        with self._lock:
+            return thread_id in self.storage and self._synced_rows.get(thread_id) == last_row_id
+
+
+    def mark_synced(self, thread_id: str, row_id: int):
+        with self._lock:
+            if thread_id in self.storage:
+                self._synced_rows[thread_id] = row_id
+
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"sessions": len(self._last_used), "max_sessions": self.max_sessions,
+                    "ttl_seconds": self.ttl_seconds, "evictions": self.evictions}
+
+
+def load_session_history(session_id: str, checkpointer: BoundedMemorySaver, db: Session, max_messages: int):
+    '''Messages to replay before the next question of a session.
+
+    Empty if the in-memory thread is up to date with chat_history. Otherwise
+    (evicted, restarted, or turns served by another worker) the stale thread
+    is dropped and the last `max_messages` messages of the session are returned.
+    '''
+    try:
+        last_row_id = db.query(func.max(ChatHistoryModel.id)).filter(ChatHistoryModel.session_id == session_id).scalar()
+        if last_row_id is None or checkpointer.is_synced(session_id, last_row_id):
+            return []
+        checkpointer.delete_thread(session_id)
+        rows = (db.query(ChatHistoryModel)
+                .filter(ChatHistoryModel.session_id == session_id)
+                .order_by(ChatHistoryModel.id.desc())
+                .limit(max_messages)
+                .all())
+    except Exception as e:
+        logger.error(f"Error while loading chat history of session {session_id}: {e}")
+        raise DatabaseError(f"Error while loading chat history of session {session_id}: {e}")
+    history = [{"role": HISTORY_ROLES.get(row.role, "user"), "content": row.content} for row in reversed(rows)]
+    #a trimmed history starts at a question, not in the middle of a turn
+    while history and history[0]["role"] != "user":
+        history.pop(0)
+    logger.info(f"Rehydrating session {session_id} from {len(history)} chat history messages")
+    return history
@@ -0,0 +1,63 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+
+
+@dataclass
+class QueryMatch:
+    """One scored vector, shaped like a Pinecone match (id, score, values, metadata)."""
+    id: str
+    score: float
+    metadata: dict = field(default_factory=dict)
+    values: list = field(default_factory=list)
+
+
+@dataclass
+class QueryResult:
+    matches: list
+
+
+class VectorBackend(ABC):
+    """Storage and hybrid search for chunk vectors.
+
+    Records use the Pinecone upsert format:
+    {"id", "values", "sparse_values": {"indices", "values"}, "metadata"}.
+    Queries take an already alpha-weighted dense vector and sparse vector
+    (see HybridRetriever.hybrid_score_norm) and rank by dotproduct.
+    """
+
+    name = "base"
+
+    @abstractmethod
+    def ensure_index(self, dim: int):
+        '''Create the index if it does not exist'''
+
+    @abstractmethod
+    def upsert(self, records):
+        '''Insert or replace records'''
+
+    @abstractmethod
+    def delete(self, ids):
+        '''Delete records by ID'''
+
+    @abstractmethod
+    def delete_all(self):
+        '''Delete every record'''
+
+    @abstractmethod
+    def query(self, vector, sparse_vector, top_k: int, include_values: bool = False,
+              include_metadata: bool = True):
+        '''Return the top_k records by hybrid dotproduct score (object with a `.matches` list)'''
+
+    @abstractmethod
+    def list_ids(self):
+        '''Iterate over the IDs of every record'''
+
+    @abstractmethod
+    def vector_count(self) -> int:
+        '''Number of records stored'''
+
+    def flush(self):
+        '''Make buffered writes durable and visible to queries (no-op for remote backends)'''
+
+    def warm_up(self):
+        '''Open connections / load data ahead of the first query (no-op by default)'''
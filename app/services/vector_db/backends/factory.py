@@ -0,0 +1,27 @@
+import os
+import threading
+from app.config.config import RAGConfig
+from app.services.vector_db.backends.base import VectorBackend
+from app.services.vector_db.backends.pinecone_backend import PineconeBackend
+from app.services.vector_db.backends.local_backend import LocalHybridBackend
+
+VECTOR_BACKENDS = ("pinecone", "local")
+
+_local_backends = {}
+_lock = threading.Lock()
+
+
+def create_vector_backend(config: RAGConfig) -> VectorBackend:
+    '''Vector backend selected by `vector_store.backend` in config.yaml.
+
+    Local indexes are shared per directory, so ingestion and retrieval in one
+    process see the same in-memory snapshot.'''
+    if config.vector_backend == "pinecone":
+        return PineconeBackend(config.pinecone_vector_client, config.index_name, config.name_space)
+    if config.vector_backend == "local":
+        path = os.path.join(config.local_index_dir, config.index_name, config.name_space)
+        with _lock:
+            if path not in _local_backends:
+                _local_backends[path] = LocalHybridBackend(path)
+            return _local_backends[path]
+    raise ValueError(f"Unknown vector backend {config.vector_backend!r}, expected one of {VECTOR_BACKENDS}")
@@ -0,0 +1,256 @@
+import json
+import os
+import shutil
+import threading
+import numpy as np
+from app.services.vector_db.backends.base import VectorBackend, QueryMatch, QueryResult
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+
+class _Snapshot:
+    """Immutable, query-ready view of the committed index files."""
+
+    def __init__(self, ids, metadata, dense, indptr, indices, values):
+        self.ids = ids
+        self.metadata = metadata
+        self.dense = dense
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        #inverted index: postings of every term as one contiguous slice, sorted by term
+        rows = np.repeat(np.arange(len(ids), dtype=np.int64), np.diff(indptr))
+        order = np.argsort(indices, kind="stable")
+        self.post_terms = indices[order]
+        self.post_rows = rows[order]
+        self.post_values = values[order]
+
+
+class LocalHybridBackend(VectorBackend):
+    """In-process hybrid index persisted under one directory.
+
+    Each flush writes a new version directory `v<number>/`:
+        ids.json, metadata.json     record IDs and metadata, in row order
+        dense.npy                   float32 matrix (rows x dim), loaded memory-mapped
+        sparse_indptr.npy           CSR row pointers of the sparse vectors
+        sparse_indices.npy          CSR term indices (uint32)
+        sparse_values.npy           CSR term weights (float32)
+    and then atomically replaces the `CURRENT` pointer file naming the live
+    version; older versions are deleted afterwards. A crash at any point
+    leaves either the old or the new version live.
+
+    Writes are buffered (as compact float32 arrays) and merged into a new
+    version on `flush()`, which ingestion calls once at the end of a sync;
+    queries always see the last flushed snapshot. Scoring is the Pinecone
+    dotproduct: dense . q_dense + sparse . q_sparse, with the alpha weighting
+    already applied to the query vectors.
+    """
+
+    name = "local"
+    POINTER_FILE = "CURRENT"
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dim = None
+        self._pending_upserts = {}
+        self._pending_deletes = set()
+        self._delete_all = False
+        self._lock = threading.Lock()
+        self._snapshot = self._load()
+
+
+    def _file(self, name: str, root: str = None) -> str:
+        return os.path.join(root or self.path, name)
+
+
+    def _current_version(self):
+        '''Name of the live version directory; "" for indexes written before versioning (files in path)'''
+        pointer = self._file(self.POINTER_FILE)
+        if os.path.exists(pointer):
+            with open(pointer, "r") as f:
+                return f.read().strip()
+        return "" if os.path.exists(self._file("ids.json")) else None
+
+
+    def _load(self):
+        version = self._current_version()
+        if version is None:
+            return None
+        root = self._file(version)
+        with open(self._file("ids.json", root), "r") as f:
+            ids = json.load(f)
+        with open(self._file("metadata.json", root), "r") as f:
+            metadata = json.load(f)
+        #numpy cannot map an empty file
+        dense = np.load(self._file("dense.npy", root), mmap_mode="r" if ids else None)
+        self.dim = dense.shape[1]
+        snapshot = _Snapshot(ids, metadata, dense,
+                             np.load(self._file("sparse_indptr.npy", root)),
+                             np.load(self._file("sparse_indices.npy", root)),
+                             np.load(self._file("sparse_values.npy", root)))
+        logger.info(f"Loaded local vector index {root} ({len(ids)} vectors)")
+        return snapshot
+
+
+    def _write_version(self, ids, metadata, dense, indptr, indices, values):
+        '''Write a new version directory and point CURRENT to it'''
+        versions = [name for name in os.listdir(self.path) if name.startswith("v") and name[1:].isdigit()]
+        version = f"v{max((int(name[1:]) for name in versions), default=0) + 1:06d}"
+        root = self._file(version)
+        os.makedirs(root)
+        np.save(self._file("dense.npy", root), dense)
+        np.save(self._file("sparse_indptr.npy", root), indptr)
+        np.save(self._file("sparse_indices.npy", root), indices)
+        np.save(self._file("sparse_values.npy", root), values)
+        with open(self._file("metadata.json", root), "w") as f:
+            json.dump(metadata, f)
+        with open(self._file("ids.json", root), "w") as f:
+            json.dump(ids, f)
+
+        pointer_tmp = self._file(f"{self.POINTER_FILE}.tmp")
+        with open(pointer_tmp, "w") as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        #the switch to the new version is this single atomic rename
+        os.replace(pointer_tmp, self._file(self.POINTER_FILE))
+
+        #superseded versions (and the files of an unversioned index); open
+        #memory maps of the previous snapshot stay valid on POSIX
+        for name in versions:
+            shutil.rmtree(self._file(name), ignore_errors=True)
+        for name in ("ids.json", "metadata.json", "dense.npy", "sparse_indptr.npy",
+                     "sparse_indices.npy", "sparse_values.npy"):
+            if os.path.exists(self._file(name)):
+                os.remove(self._file(name))
+
+
+    def ensure_index(self, dim: int):
+        if self.dim is not None and self.dim != dim:
+            raise ValueError(f"Local index {self.path} has dimension {self.dim}, expected {dim}")
+        self.dim = dim
+
+
+    def upsert(self, records):
+        #buffered as float32 arrays: a fraction of the memory of the records' Python lists
+        compact = []
+        for record in records:
+            sparse = record.get("sparse_values") or {"indices": [], "values": []}
+            compact.append((record["id"],
+                            np.asarray(record["values"], dtype=np.float32),
+                            np.asarray(sparse["indices"], dtype=np.uint32),
+                            np.asarray(sparse["values"], dtype=np.float32),
+                            record.get("metadata", {})))
+        with self._lock:
+            for entry in compact:
+                self._pending_deletes.discard(entry[0])
+                self._pending_upserts[entry[0]] = entry
+
+
+    def delete(self, ids):
+        with self._lock:
+            for vid in ids:
+                self._pending_upserts.pop(vid, None)
+                self._pending_deletes.add(vid)
+
+
+    def delete_all(self):
+        with self._lock:
+            self._pending_upserts.clear()
+            self._pending_deletes.clear()
+            self._delete_all = True
+
+
+    def flush(self):
+        '''Merge buffered upserts/deletes with the committed rows into new index files'''
+        with self._lock:
+            if not (self._pending_upserts or self._pending_deletes or self._delete_all):
+                return
+            upserts, deletes = self._pending_upserts, self._pending_deletes
+            old = None if self._delete_all else self._snapshot
+            self._pending_upserts, self._pending_deletes, self._delete_all = {}, set(), False
+
+            #surviving committed rows, by position
+            keep = []
+            if old is not None:
+                keep = [row for row, vid in enumerate(old.ids) if vid not in deletes and vid not in upserts]
+            keep = np.asarray(keep, dtype=np.int64)
+            new_records = list(upserts.values())
+            dim = self.dim or (len(new_records[0][1]) if new_records else 0)
+
+            ids = [old.ids[r] for r in keep] + [r[0] for r in new_records]
+            metadata = [old.metadata[r] for r in keep] + [r[4] for r in new_records]
+            dense = np.empty((len(ids), dim), dtype=np.float32)
+            if len(keep):
+                dense[:len(keep)] = old.dense[keep]
+            if new_records:
+                dense[len(keep):] = np.stack([r[1] for r in new_records])
+
+            row_lengths, idx_parts, val_parts = [], [], []
+            if len(keep):
+                starts, ends = old.indptr[keep], old.indptr[keep + 1]
+                row_lengths.append(ends - starts)
+                #gather the kept CSR rows without a python loop over terms
+                gather = np.repeat(starts - np.cumsum(np.r_[0, (ends - starts)[:-1]]), ends - starts) \
+                    + np.arange(int((ends - starts).sum()))
+                idx_parts.append(old.indices[gather])
+                val_parts.append(old.values[gather])
+            for _, _, sparse_indices, sparse_values, _ in new_records:
+                row_lengths.append(np.asarray([len(sparse_indices)], dtype=np.int64))
+                idx_parts.append(sparse_indices)
+                val_parts.append(sparse_values)
+            lengths = np.concatenate(row_lengths) if row_lengths else np.empty(0, dtype=np.int64)
+            indptr = np.r_[0, np.cumsum(lengths)].astype(np.int64)
+            indices = np.concatenate(idx_parts).astype(np.uint32) if idx_parts else np.empty(0, dtype=np.uint32)
+            values = np.concatenate(val_parts).astype(np.float32) if val_parts else np.empty(0, dtype=np.float32)
+
+            os.makedirs(self.path, exist_ok=True)
+            self._write_version(ids, metadata, dense, indptr, indices, values)
+            self._snapshot = self._load()
+        logger.info(f"Flushed local vector index: {len(new_records)} upserted, "
+                    f"{len(deletes)} deleted, {len(ids)} total")
+
+
+    def query(self, vector, sparse_vector, top_k: int, include_values: bool = False,
+              include_metadata: bool = True):
+        snapshot = self._snapshot
+        if snapshot is None or not snapshot.ids or top_k <= 0:
+            return QueryResult(matches=[])
+
+        scores = snapshot.dense @ np.asarray(vector, dtype=np.float32)
+        if sparse_vector and len(sparse_vector["indices"]):
+            q_terms = np.asarray(sparse_vector["indices"], dtype=np.uint32)
+            q_values = np.asarray(sparse_vector["values"], dtype=np.float32)
+            lo = np.searchsorted(snapshot.post_terms, q_terms, side="left")
+            hi = np.searchsorted(snapshot.post_terms, q_terms, side="right")
+            counts = hi - lo
+            if counts.sum():
+                #every posting of every query term, scaled by that term's query weight
+                positions = np.repeat(lo - np.cumsum(np.r_[0, counts[:-1]]), counts) + np.arange(int(counts.sum()))
+                np.add.at(scores, snapshot.post_rows[positions],
+                          snapshot.post_values[positions] * np.repeat(q_values, counts))
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return QueryResult(matches=[
+            QueryMatch(id=snapshot.ids[row],
+                       score=float(scores[row]),
+                       metadata=snapshot.metadata[row] if include_metadata else {},
+                       values=snapshot.dense[row].tolist() if include_values else [])
+            for row in top
+        ])
+
+
+    def list_ids(self):
+        with self._lock:
+            snapshot = self._snapshot
+            committed = [] if snapshot is None or self._delete_all else snapshot.ids
+            ids = [vid for vid in committed if vid not in self._pending_deletes and vid not in self._pending_upserts]
+            return ids + list(self._pending_upserts)
+
+
+    def vector_count(self) -> int:
+        snapshot = self._snapshot
+        return len(snapshot.ids) if snapshot is not None else 0
@@ -0,0 +1,68 @@
+import numpy as np
+from pinecone.grpc import PineconeGRPC as Pinecone
+from pinecone import ServerlessSpec
+from app.services.vector_db.backends.base import VectorBackend
+from app.services.vector_db.index_pool import index_pool_registry
+
+
+class PineconeBackend(VectorBackend):
+    """Pinecone serverless index (gRPC) in a single namespace."""
+
+    name = "pinecone"
+
+    def __init__(self, pinecone_vector_client: Pinecone, index_name: str, name_space: str):
+        self.pc = pinecone_vector_client
+        self.index_name = index_name
+        self.name_space = name_space
+
+    def _index(self):
+        #long-lived handle from the shared pool instead of a new channel and stub per call
+        return index_pool_registry.get(self.pc, self.index_name).get()
+
+    def ensure_index(self, dim: int):
+        #dense vector type and dotproduct metric for hybrid search
+        if not self.pc.has_index(self.index_name):
+            self.pc.create_index(
+                name=self.index_name,
+                vector_type="dense",
+                dimension=dim,
+                metric="dotproduct",
+                spec=ServerlessSpec(
+                    cloud="aws",
+                    region="us-east-1"
+                )
+            )
+
+    def upsert(self, records):
+        self._index().upsert(vectors=records, namespace=self.name_space)
+
+    def delete(self, ids):
+        self._index().delete(ids=list(ids), namespace=self.name_space)
+
+    def delete_all(self):
+        self._index().delete(delete_all=True, namespace=self.name_space)
+
+    def query(self, vector, sparse_vector, top_k: int, include_values: bool = False,
+              include_metadata: bool = True):
+        #the gRPC request needs plain Python floats, not NumPy buffers
+        return self._index().query(
+            namespace=self.name_space,
+            top_k=top_k,
+            vector=np.asarray(vector, dtype=np.float32).tolist(),
+            sparse_vector={"indices": list(sparse_vector["indices"]),
+                           "values": np.asarray(sparse_vector["values"], dtype=np.float32).tolist()},
+            include_values=include_values,
+            include_metadata=include_metadata
+        )
+
+    def list_ids(self):
+        #paginated server-side (serverless indexes)
+        for page in self._index().list(namespace=self.name_space):
+            yield from page
+
+    def warm_up(self):
+        index_pool_registry.get(self.pc, self.index_name).warm_up()
+
+    def vector_count(self) -> int:
+        stats = self._index().describe_index_stats()
+        return stats["namespaces"].get(self.name_space, {}).get("vector_count", 0)
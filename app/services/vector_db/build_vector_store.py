@@ -1,27 +1,77 @@
 from app.services.vector_db.vector_store import VectorStoreService
-from app.services.data_ingestion.data_loader import load_pdf
-from app.services.data_ingestion.data_processor import medical_filter_docs
-from app.services.data_ingestion.data_chunker import chunk_documents
+from app.services.vector_db.backends.factory import create_vector_backend
+from app.services.embedding_generation.embedding_store import DocEmbeddingStore, SPARSE_MODEL
+from app.services.embedding_generation.sparse_encoder import BM25SparseEncoder
+from app.services.data_ingestion.data_loader import iter_pdf_pages, ensure_pdf
+from app.services.data_ingestion.chunk_artifact import chunk_artifact_dir, load_chunk_artifact, write_through_artifact
+from app.services.data_ingestion.data_processor import iter_medical_filter_docs
+from app.services.data_ingestion.parallel_loader import iter_parallel_processed_pages
+from app.services.data_ingestion.data_chunker import iter_chunk_documents
 from app.utils.loggers import get_logger
 from app.utils.exceptions import BuildKnowledgeBaseError
 from app.config.config import RAGConfig
+from app.utils.state_loader import load_manifest, save_manifest, load_state, save_state
+from app.services.embedding_generation.ensure_embed import get_vector_count
+from app.utils.fingerprint import is_chunk_id
 
 logger= get_logger(__name__)
 
 
 
+def iter_processed_chunks(config: RAGConfig):
+    '''Chunks of the knowledge base: read memory-mapped from the persisted chunk artifact,
+    or produced from the PDF (and written to a new artifact on the way)'''
+    artifact_path = chunk_artifact_dir(config, ensure_pdf(config.url, config.pdfname, config.pdf_sha256))
+    artifact = load_chunk_artifact(artifact_path)
+    if artifact is not None:
+        return iter(artifact)
+
+    if config.parse_workers > 1:
+        #parse and preprocess page ranges across a process pool (front matter never parsed)
+        processed_docs = iter_parallel_processed_pages(config.url, config.pdfname,
+                                                       workers=config.parse_workers,
+                                                       pages_per_task=config.pages_per_task,
+                                                       skip_pages=config.skip_pages)
+    else:
+        #load PDF pages (front matter never parsed), then filter and preprocess them
+        processed_docs = iter_medical_filter_docs(iter_pdf_pages(config.url, config.pdfname,
+                                                                 skip_pages=config.skip_pages),
+                                                  skip_pages=0)
+
+    #pages flow lazily through preprocess -> chunk in bounded batches,
+    #so embedding/upserting can start while the PDF is still being parsed
+    chunks = iter_chunk_documents(processed_docs, config.chunk_size, config.chunk_overlap,
+                                  page_batch_size=config.page_batch_size)
+    return write_through_artifact(chunks, artifact_path)
+
+
+
+def fit_local_sparse_encoder(config: RAGConfig, chunks) -> BM25SparseEncoder:
+    '''Fit the local BM25 encoder on the chunk texts and save it for the query path'''
+    sparse_encoder = BM25SparseEncoder.fit(chunk.page_content for chunk in chunks)
+    sparse_encoder.save(config.sparse_encoder_path)
+    return sparse_encoder
+
+
+
 def build_medical_vector_store(config: RAGConfig):
     '''Build medical vector store from PDF document'''
     try:
-        #load PDF into documents
-        pdf_docs = load_pdf(config.url, config.pdfname)
-        #filter and preprocess documents
-        processed_docs= medical_filter_docs(pdf_docs)
-
-        #chunk document
-        chunks = chunk_documents(processed_docs, config.chunk_size, config.chunk_overlap)
-           
-        logger.info(chunks[0:3])
+        chunks = iter_processed_chunks(config)
+        if not config.streaming_ingestion:
+            chunks = list(chunks)
+            logger.info(chunks[0:3])
+
+        sparse_encoder = None
+        sparse_model = SPARSE_MODEL
+        if config.sparse_encoder == "local":
+            #corpus statistics are needed before any chunk can be encoded: a first pass fits them
+            #(and persists the chunk artifact), the second pass reads the artifact memory-mapped
+            sparse_encoder = fit_local_sparse_encoder(config, chunks)
+            sparse_model = sparse_encoder.doc_params_id
+            if config.streaming_ingestion:
+                chunks = iter_processed_chunks(config)
+
         #initialize VectorStoreService
         vector_store_service = VectorStoreService(
             config.pinecone_vector_client,
@@ -31,13 +81,43 @@ def build_medical_vector_store(config: RAGConfig):
             config.name_space,
             config.dense_model,
             config.batch_size,
-            config.sleep_time
+            config.ingest_workers,
+            config.requests_per_second,
+            config.max_retries,
+            #dense vectors are shared by all sparse encoders: switching encoders embeds nothing again
+            embedding_store=DocEmbeddingStore(config.embedding_store_dir, config.dense_model, config.dim),
+            backend=create_vector_backend(config),
+            sparse_encoder=sparse_encoder
         )
-        #create Pinecone vector index if not exists
+        #create the vector index if not exists
         vector_store_service.create_vector_index()
 
-        # #generate dense and sparse embeddings and upsert them into Pinecone
-        vector_store_service.upsert_vectors(all_chunks=chunks)
+        #IDs already upserted to this index/namespace
+        known_ids = load_manifest(config.index_name, config.name_space, config.vector_backend)
+        vector_count = get_vector_count(config)
+        if known_ids is None and vector_count > 0:
+            #no local manifest (e.g. a new container): rebuild it from the IDs in the index,
+            #only vectors from before stable IDs (positional IDs) cannot be diffed and are deleted
+            logger.info("No chunk manifest for a non-empty namespace. Rebuilding it from the index...")
+            indexed_ids = vector_store_service.list_vector_ids()
+            legacy_ids = {vid for vid in indexed_ids if not is_chunk_id(vid)}
+            if legacy_ids:
+                logger.info(f"Deleting {len(legacy_ids)} legacy vectors...")
+                vector_store_service.delete_vectors(legacy_ids)
+            known_ids = indexed_ids - legacy_ids
+        if known_ids is None or vector_count == 0:
+            known_ids = set()
+        if known_ids and load_state().get("sparse_model", SPARSE_MODEL) != sparse_model:
+            #indexed sparse vectors came from another encoder (or other BM25 statistics): re-upsert everything
+            logger.info(f"Sparse model changed to {sparse_model}. Re-upserting all chunks...")
+            known_ids = set()
+
+        # #generate dense and sparse embeddings and upsert only added/changed chunks into the index
+        chunk_ids = vector_store_service.sync_vectors(all_chunks=chunks, known_ids=known_ids)
+        save_manifest(config.index_name, config.name_space, chunk_ids, config.vector_backend)
+        state = load_state()
+        state["sparse_model"] = sparse_model
+        save_state(state)
     except Exception as bkbe:
         logger.error(f"Error building medical vector store: {bkbe}") 
         raise BuildKnowledgeBaseError(f"Failed to build medical vector store: {bkbe}")
@@ -1,3 +1,6 @@
+import os
+import threading
+from contextlib import contextmanager
 from app.services.embedding_generation.ensure_embed import ensure_embeddings
 from app.services.vector_db.build_vector_store import build_medical_vector_store
 from app.utils.fingerprint import compute_fingerprint
@@ -5,17 +8,47 @@ from app.config.config import RAGConfig
 from app.utils.loggers import get_logger
 from app.utils.exceptions import BuildKnowledgeBaseError
 
+try:
+    import fcntl
+except ImportError:
+    #no flock (Windows): ingestion is only serialized within the process
+    fcntl = None
+
 logger = get_logger(__name__)
 
+INGEST_LOCK_FILE = "data/ingest.lock"
+
+_ingest_lock = threading.Lock()
+
+
+@contextmanager
+def ingest_lock(path: str = None):
+    '''Serialize ingestion across threads and, through an flock, across worker processes'''
+    path = path or INGEST_LOCK_FILE
+    with _ingest_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 ''' compute fingerprint and generate embeddings if needed'''
 def create_vectors(config: RAGConfig):
     try:
+        #background refreshes, /vectorstore and other workers never ingest at the same time;
+        #whoever waited re-reads the state the previous ingest saved and finds nothing to do
+        with ingest_lock():
+            # Compute fingerprint
+            fingerprint = compute_fingerprint(config)
 
-        # Compute fingerprint
-        fingerprint = compute_fingerprint(config)
-
-        # Build / reuse embeddings
-        ensure_embeddings(lambda: build_medical_vector_store(config), fingerprint, config)
+            # Build / reuse embeddings
+            ensure_embeddings(lambda: build_medical_vector_store(config), fingerprint, config)
 
     except Exception as bkbe:
         logger.error(f"Error building medical vector store: {bkbe}") 
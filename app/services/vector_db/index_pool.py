@@ -0,0 +1,126 @@
+import itertools
+import threading
+from pinecone.grpc import PineconeGRPC as Pinecone, GRPCClientConfig, GRPCIndex
+from pinecone.grpc.channel_factory import GrpcChannelFactory
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+
+class ChannelOptionsFactory(GrpcChannelFactory):
+    """Pinecone's channel factory, plus the `grpc_channel_options` of the client config
+    (the stock factory ignores them)."""
+
+    def _build_options(self, target):
+        extra = self.grpc_client_config.grpc_channel_options or {}
+        return super()._build_options(target) + tuple(extra.items())
+
+
+class IndexHandlePool:
+    """Long-lived gRPC handles to one Pinecone index, handed out round-robin.
+
+    Each handle owns its own channel (a local subchannel pool, so channels do
+    not collapse onto one TCP connection) with keepalive enabled, and is
+    created once instead of per query/batch. Creation is lazy so the pool can
+    be configured before the index exists.
+    """
+
+    def __init__(self, pinecone_vector_client: Pinecone, index_name: str, size: int,
+                 grpc_config: GRPCClientConfig, pool_threads: int):
+        self.pc = pinecone_vector_client
+        self.index_name = index_name
+        self.size = size
+        self.grpc_config = grpc_config
+        self.pool_threads = pool_threads
+        self._handles = []
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+
+
+    def _create_handles(self):
+        #resolves the index host once (control plane call) and gives us its connection config
+        template = self.pc.Index(self.index_name, grpc_config=self.grpc_config, pool_threads=self.pool_threads)
+        template.close()
+        host = template.config.host.replace("https://", "")
+        endpoint = host if ":" in host else f"{host}:443"
+        factory = ChannelOptionsFactory(config=template.config, grpc_client_config=self.grpc_config)
+        handles = [GRPCIndex(index_name=self.index_name,
+                             config=template.config,
+                             channel=factory.create_channel(endpoint),
+                             grpc_config=self.grpc_config,
+                             pool_threads=self.pool_threads)
+                   for _ in range(self.size)]
+        logger.info(f"Opened {len(handles)} gRPC handles to index {self.index_name}")
+        return handles
+
+
+    def get(self) -> GRPCIndex:
+        if not self._handles:
+            with self._lock:
+                if not self._handles:
+                    self._handles = self._create_handles()
+        return self._handles[next(self._next) % len(self._handles)]
+
+
+    def warm_up(self):
+        '''Connect every channel (TLS handshake included) before the first request needs it'''
+        for _ in range(self.size):
+            self.get().describe_index_stats()
+        logger.info(f"Warmed up {self.size} gRPC handles to index {self.index_name}")
+
+
+    def close(self):
+        with self._lock:
+            handles, self._handles = self._handles, []
+        for handle in handles:
+            handle.close()
+
+
+class IndexPoolRegistry:
+    """Process-wide handle pools, one per (client, index name)."""
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = threading.Lock()
+        self.configure(size=4, pool_threads=8, timeout=20, keepalive_time_ms=30000, keepalive_timeout_ms=10000)
+
+
+    def configure(self, size: int, pool_threads: int, timeout: float, keepalive_time_ms: int,
+                  keepalive_timeout_ms: int):
+        '''Set pool settings; pools opened earlier are closed and reopened on next use'''
+        self.size = size
+        self.pool_threads = pool_threads
+        self.grpc_config = GRPCClientConfig(
+            timeout=timeout,
+            reuse_channel=True,
+            grpc_channel_options={
+                "grpc.keepalive_time_ms": keepalive_time_ms,
+                "grpc.keepalive_timeout_ms": keepalive_timeout_ms,
+                #keep idle channels warm between requests
+                "grpc.keepalive_permit_without_calls": 1,
+                "grpc.http2.max_pings_without_data": 0,
+                "grpc.use_local_subchannel_pool": 1,
+            },
+        )
+        self.close_all()
+
+
+    def get(self, pinecone_vector_client: Pinecone, index_name: str) -> IndexHandlePool:
+        key = (id(pinecone_vector_client), index_name)
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = IndexHandlePool(pinecone_vector_client, index_name, self.size, self.grpc_config,
+                                       self.pool_threads)
+                self._pools[key] = pool
+            return pool
+
+
+    def close_all(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
+
+
+index_pool_registry = IndexPoolRegistry()
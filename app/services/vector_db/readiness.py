@@ -0,0 +1,68 @@
+import threading
+import time
+from app.services.vector_db.ensure_vector import create_vectors
+from app.services.answer_cache import answer_cache
+from app.config.config import RAGConfig
+from app.utils.state_loader import load_state
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+
+class VectorStoreReadiness:
+    """Resolve vector store state once and keep it in memory.
+
+    The full check (fingerprint, rag_state.yaml and remote vector count) runs at
+    startup and then in the background every `revalidate_interval` seconds,
+    so the chat hot path only reads an in-memory flag.
+    """
+
+    def __init__(self, config: RAGConfig, revalidate_interval: float):
+        self.config = config
+        self.revalidate_interval = revalidate_interval
+        self._ready = False
+        self._checked_at = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+
+    def refresh(self) -> bool:
+        '''Run the full readiness check (building embeddings if needed) and cache the result'''
+        try:
+            create_vectors(self.config)
+            self.mark_ready()
+        except Exception as e:
+            logger.error(f"Vector store readiness check failed: {e}")
+            with self._lock:
+                self._ready = False
+                self._checked_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._refreshing = False
+        return self._ready
+
+
+    def refresh_in_background(self):
+        '''Start a refresh in a daemon thread unless one is already running'''
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self.refresh, name="vector-readiness", daemon=True).start()
+
+
+    def mark_ready(self):
+        state = load_state()
+        #answers cached against an older index (re-ingested or re-encoded) are dropped
+        answer_cache.set_fingerprint("vector_store", (state.get("fingerprint"), state.get("vector_count"),
+                                                      state.get("sparse_model")))
+        with self._lock:
+            self._ready = True
+            self._checked_at = time.monotonic()
+
+
+    def is_ready(self) -> bool:
+        '''Return the cached readiness flag, revalidating in the background when stale'''
+        if time.monotonic() - self._checked_at > self.revalidate_interval:
+            self.refresh_in_background()
+        return self._ready
@@ -1,10 +1,18 @@
 
 from tqdm import tqdm
-import time
+import math
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from app.services.embedding_generation.doc_embeddings import generate_dense_embeddings, generate_sparse_embeddings
+from app.services.embedding_generation.embedding_store import DocEmbeddingStore
+from app.services.embedding_generation.sparse_encoder import BM25SparseEncoder
+from app.utils.fingerprint import compute_chunk_id
+from app.utils.rate_limiter import AdaptiveTokenBucket, call_with_retry
+
+from app.services.vector_db.backends.base import VectorBackend
+from app.services.vector_db.backends.pinecone_backend import PineconeBackend
 
 from pinecone.grpc import PineconeGRPC as Pinecone
-from pinecone import ServerlessSpec
 from app.utils.loggers import get_logger
 import openai
 from openai import OpenAI
@@ -18,7 +26,11 @@ class VectorStoreService:
                 openai_client: OpenAI,
                 index_name: str, dim: int,
                 name_space: str, dense_model: str,
-                batch_size: int, sleep_time: int):
+                batch_size: int, workers: int,
+                requests_per_second: float, max_retries: int,
+                embedding_store: DocEmbeddingStore = None,
+                backend: VectorBackend = None,
+                sparse_encoder: BM25SparseEncoder = None):
         
         #define class variables
         self.pc = pinecone_vector_client
@@ -28,81 +40,204 @@ class VectorStoreService:
         self.name_space = name_space
         self.dense_model = dense_model
         self.batch_size = batch_size
-        self.sleep_time = sleep_time
+        self.workers = workers
+        self.max_retries = max_retries
+        self.embedding_store = embedding_store
+        #where vectors are stored: the Pinecone index by default, or a local in-process index
+        self.backend = backend or PineconeBackend(pinecone_vector_client, index_name, name_space)
+        #local sparse encoder replacing the hosted sparse model (None = Pinecone inference)
+        self.sparse_encoder = sparse_encoder
+        #shared by all workers, adapts to 429s from the embedding providers
+        self.limiter = AdaptiveTokenBucket(rate=requests_per_second)
 
 
     def create_vector_index(self):   
-        '''Create Pinecone vector index if not exists,
+        '''Create the vector index if not exists,
         with dense vector type and dotproduct metric for hybrid search'''
         try:
-            if not self.pc.has_index(self.index_name):
-                self.pc.create_index(
-                    name=self.index_name,
-                    vector_type="dense",
-                    dimension=self.dim,
-                    metric="dotproduct",
-                    spec=ServerlessSpec(
-                        cloud="aws",
-                        region="us-east-1"
-                    )
-                )
+            self.backend.ensure_index(self.dim)
         except Exception as dce:
             logger.error(f"Error creating vector index: {dce}")
             raise RecordUploadError(f"Error creating vector index: {dce}")
 
 
-    def upsert_vectors(self, all_chunks):
-        '''Upsert vectors into Pinecone index in batches'''
-        
+    def embed_batch(self, lines_batch):
+        '''Return dense and sparse embeddings for a batch of texts and the number of
+        texts that had to be sent to the dense embedding API (the rest come from the local store)'''
+        #an empty store is falsy (it has a length): compare with None
+        cached = [None] * len(lines_batch)
+        if self.embedding_store is not None:
+            cached = self.embedding_store.get_many(lines_batch)
+        missing = [t for t, c in zip(lines_batch, cached) if c is None]
+        dense_new = {}
+        if missing:
+            dense_new = dict(zip(missing, call_with_retry(generate_dense_embeddings, text_input=missing,
+                                                          dense_model=self.dense_model, dim=self.dim,
+                                                          openai_client=self.openai_client,
+                                                          max_retries=self.max_retries, limiter=self.limiter)))
+
+        sparse_new = {}
+        if self.sparse_encoder:
+            #local sparse vectors are cheap and depend on the fitted corpus statistics: always recompute them
+            sparse_embeddings = self.sparse_encoder.encode_documents(lines_batch)
+        else:
+            #hosted sparse vectors of new texts and of texts stored while a local encoder was configured
+            no_sparse = [t for t, c in zip(lines_batch, cached) if c is None or c[1] is None]
+            if no_sparse:
+                response = call_with_retry(generate_sparse_embeddings, pinecone_vector_client=self.pc,
+                                           text_input=no_sparse,
+                                           max_retries=self.max_retries, limiter=self.limiter)
+                sparse_new = {t: {"sparse_indices": se["sparse_indices"], "sparse_values": se["sparse_values"]}
+                              for t, se in zip(no_sparse, response)}
+            sparse_embeddings = [c[1] if c is not None and c[1] is not None else sparse_new[t]
+                                 for t, c in zip(lines_batch, cached)]
+
+        if missing and self.embedding_store is not None:
+            self.embedding_store.put_many(missing, [dense_new[t] for t in missing], [sparse_new.get(t) for t in missing])
+        dense_embeddings = [c[0] if c is not None else dense_new[t] for t, c in zip(lines_batch, cached)]
+        return dense_embeddings, sparse_embeddings, len(missing)
+
+
+    def _upsert_records(self, records_embed):
+        self.backend.upsert(records_embed)
+
+
+    def embed_and_upsert_batch(self, lines_batch_chunk):
+        '''Embed one batch of chunks and upsert it (both steps retried with backoff)'''
+        lines_batch = [d.page_content for d in lines_batch_chunk]
+        ids_batch = [compute_chunk_id(d) for d in lines_batch_chunk]
+
+        # create dense and sparse embeddings (only for chunks not in the local store)
+        dense_embeddings, sparse_embeddings, _ = self.embed_batch(lines_batch)
+
+        # prep metadata and upsert batch
+        meta = [line.metadata for line in lines_batch_chunk]
+
+        # Each record contains an ID, a dense vector, a sparse vector, and the original text as metadata
+        records_embed = []
+        for d, de, se, m, t in zip(ids_batch, dense_embeddings, sparse_embeddings, meta,lines_batch):
+            records_embed.append({
+                "id": str(d),
+                "values": de,
+                "sparse_values": {
+                    "indices": se["sparse_indices"],
+                    "values": se["sparse_values"]
+                },
+                "metadata": {
+                    **m,
+                    "text": t
+                }
+            })
+
         try:
+            call_with_retry(self._upsert_records, records_embed, max_retries=self.max_retries)
+        except  Exception as bue:
+            logger.error(f"Error upserting batch of {len(records_embed)} vectors: {bue}")
+            raise BatchUploadError(f"Error upserting batch of {len(records_embed)} vectors: {bue}")
+        return len(records_embed)
+
+
+    def upsert_vectors(self, all_chunks):
+        '''Upsert vectors into the vector index in batches.
 
-            for i in tqdm(range(0, len(all_chunks), self.batch_size)):
-                # set end position of batch
-                i_end = min(i + self.batch_size, len(all_chunks))
-                # get batch of lines and IDs
-                lines_batch_chunk = all_chunks[i: i_end]
-                lines_batch = [d.page_content for d in lines_batch_chunk]
-                ids_batch = [str(n) for n in range(i, i_end)]
-                
-                # create dense embeddings
-                dense_embeddings = generate_dense_embeddings(text_input=lines_batch, dense_model=self.dense_model,dim=self.dim,
-                                                            openai_client=self.openai_client)
-                # Convert the chunk_text into sparse vectors
-                sparse_embeddings = generate_sparse_embeddings(pinecone_vector_client=self.pc,
-                                                            text_input=lines_batch)
-                
-                # prep metadata and upsert batch
-                meta = [line.metadata for line in lines_batch_chunk]
-                
-                # upsert to Pinecone
-                # Each record contains an ID, a dense vector, a sparse vector, and the original text as metadata
-                records_embed = []
-                for d, de, se, m, t in zip(ids_batch, dense_embeddings, sparse_embeddings, meta,lines_batch):
-                    records_embed.append({
-                        "id": str(d),
-                        "values": de,
-                        "sparse_values": {
-                            "indices": se["sparse_indices"],
-                            "values": se["sparse_values"]
-                        },
-                        "metadata": {
-                            **m,
-                            "text": t
-                        }
-                    })
-                    
-
-                # Upsert the records
-                # The `chunk_text` fields are converted to dense and sparse vectors
+        Batches are embedded and upserted by a bounded pool of workers, so the
+        embedding of one batch overlaps the upsert of another. Request rate is
+        governed by the adaptive token bucket instead of a fixed sleep.'''
+        total_batches = math.ceil(len(all_chunks) / self.batch_size) if hasattr(all_chunks, "__len__") else None
+        chunk_iter = iter(all_chunks)
+        uploaded = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ingest") as pool, \
+                    tqdm(total=total_batches) as progress:
+                in_flight = set()
                 try:
-                    index = self.pc.Index(self.index_name)
-                    index.upsert(vectors= records_embed, namespace= self.name_space)
-                except  Exception as bue:
-                    logger.error(f"Error upserting vectors of batch {i_end}: {bue}")
-                    raise BatchUploadError(f"Error upserting vectors of batch {i_end}: {bue}")
-                logger.info(f"Uploaded vectors of batch {i_end}")
-                time.sleep(self.sleep_time)  # Respect rate limits
+                    while True:
+                        lines_batch_chunk = list(islice(chunk_iter, self.batch_size))
+                        if lines_batch_chunk:
+                            in_flight.add(pool.submit(self.embed_and_upsert_batch, lines_batch_chunk))
+                        #keep a bounded number of batches in memory
+                        if in_flight and (len(in_flight) >= 2 * self.workers or not lines_batch_chunk):
+                            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                            for future in done:
+                                uploaded += future.result()
+                                progress.update(1)
+                        if not lines_batch_chunk and not in_flight:
+                            break
+                except BaseException:
+                    #a batch failed after its retries: don't start the queued ones
+                    for future in in_flight:
+                        future.cancel()
+                    raise
+            logger.info(f"Uploaded {uploaded} vectors")
 
         except Exception as dce:
             logger.error(f"Error upserting vectors: {dce}")
-            raise RecordUploadError(f"Error upserting vectors: {dce}")
\ No newline at end of file
+            raise RecordUploadError(f"Error upserting vectors: {dce}")
+
+
+    def delete_vectors(self, ids):
+        '''Delete vectors by ID from the namespace in batches'''
+        ids = list(ids)
+        try:
+            for i in range(0, len(ids), self.batch_size):
+                self.backend.delete(ids[i: i + self.batch_size])
+        except Exception as dve:
+            logger.error(f"Error deleting vectors: {dve}")
+            raise RecordUploadError(f"Error deleting vectors: {dve}")
+        logger.info(f"Deleted {len(ids)} vectors")
+
+
+    def list_vector_ids(self) -> set:
+        '''IDs of every vector in the namespace'''
+        try:
+            ids = set(self.backend.list_ids())
+        except Exception as lve:
+            logger.error(f"Error listing vector IDs: {lve}")
+            raise RecordUploadError(f"Error listing vector IDs: {lve}")
+        logger.info(f"Listed {len(ids)} vector IDs in namespace {self.name_space}")
+        return ids
+
+
+    def clear_namespace(self):
+        '''Delete every vector in the namespace'''
+        try:
+            self.backend.delete_all()
+        except Exception as dve:
+            logger.error(f"Error clearing namespace: {dve}")
+            raise RecordUploadError(f"Error clearing namespace: {dve}")
+        logger.info(f"Cleared namespace {self.name_space}")
+
+
+    def sync_vectors(self, all_chunks, known_ids):
+        '''Diff chunks against the IDs already in the index: upsert only added/changed
+        chunks and delete removed ones. Returns the set of IDs now in the index.
+
+        `all_chunks` may be a lazy iterable; only the chunk IDs are kept in memory.'''
+        seen_ids = set()
+        counts = {"added": 0, "unchanged": 0}
+
+        def added_chunks():
+            for chunk in all_chunks:
+                chunk_id = compute_chunk_id(chunk)
+                #identical chunks on the same page collapse into one vector
+                if chunk_id in seen_ids:
+                    continue
+                seen_ids.add(chunk_id)
+                if chunk_id in known_ids:
+                    counts["unchanged"] += 1
+                    continue
+                counts["added"] += 1
+                yield chunk
+
+        self.upsert_vectors(all_chunks=added_chunks())
+        removed = known_ids - seen_ids
+        if removed:
+            self.delete_vectors(removed)
+        try:
+            self.backend.flush()
+        except Exception as fe:
+            logger.error(f"Error flushing vector index: {fe}")
+            raise RecordUploadError(f"Error flushing vector index: {fe}")
+        logger.info(f"Chunk diff: {counts['added']} upserted, {len(removed)} deleted, "
+                    f"{counts['unchanged']} unchanged")
+        return seen_ids
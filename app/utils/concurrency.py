@@ -0,0 +1,106 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_BLOCKING_WORKERS = 32
+DEFAULT_FANOUT_WORKERS = 16
+DEFAULT_BATCH_SEARCH_WORKERS = 8
+
+_executor = None
+_fanout_executor = None
+_batch_search_executor = None
+_executor_lock = threading.Lock()
+
+
+def configure_blocking_pool(max_workers: int):
+    '''(Re)create the bounded thread pool used to run blocking I/O off the event loop'''
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="blocking-io")
+    logger.info(f"Blocking I/O pool configured with {max_workers} workers")
+
+
+def configure_fanout_pool(max_workers: int):
+    '''(Re)create the thread pool used to fan out independent calls from sync code'''
+    global _fanout_executor
+    with _executor_lock:
+        if _fanout_executor is not None:
+            _fanout_executor.shutdown(wait=False)
+        _fanout_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fanout")
+    logger.info(f"Fan-out pool configured with {max_workers} workers")
+
+
+def configure_batch_search_pool(max_workers: int):
+    '''(Re)create the thread pool running the index searches of batch retrieval requests'''
+    global _batch_search_executor
+    with _executor_lock:
+        if _batch_search_executor is not None:
+            _batch_search_executor.shutdown(wait=False)
+        _batch_search_executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch-search")
+    logger.info(f"Batch search pool configured with {max_workers} workers")
+
+
+def get_blocking_pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DEFAULT_BLOCKING_WORKERS,
+                                               thread_name_prefix="blocking-io")
+    return _executor
+
+
+def get_fanout_pool() -> ThreadPoolExecutor:
+    '''Pool for fanning out independent calls from sync code.
+
+    Kept separate from the blocking I/O pool so a task running in that pool can
+    wait on fan-out work without risking starving its own pool.
+    '''
+    global _fanout_executor
+    if _fanout_executor is None:
+        with _executor_lock:
+            if _fanout_executor is None:
+                _fanout_executor = ThreadPoolExecutor(max_workers=DEFAULT_FANOUT_WORKERS,
+                                                      thread_name_prefix="fanout")
+    return _fanout_executor
+
+
+def get_batch_search_pool() -> ThreadPoolExecutor:
+    '''Pool for the index searches of batch retrieval.
+
+    A batch request can queue thousands of searches; in their own bounded pool
+    they never delay the embedding calls of chat requests in the fan-out pool.
+    '''
+    global _batch_search_executor
+    if _batch_search_executor is None:
+        with _executor_lock:
+            if _batch_search_executor is None:
+                _batch_search_executor = ThreadPoolExecutor(max_workers=DEFAULT_BATCH_SEARCH_WORKERS,
+                                                            thread_name_prefix="batch-search")
+    return _batch_search_executor
+
+
+async def run_blocking(fn, *args, **kwargs):
+    '''Run a blocking callable in the bounded pool and await its result'''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_blocking_pool(), partial(fn, *args, **kwargs))
+
+
+def shutdown_blocking_pool():
+    global _executor, _fanout_executor, _batch_search_executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+        if _fanout_executor is not None:
+            _fanout_executor.shutdown(wait=False)
+            _fanout_executor = None
+        if _batch_search_executor is not None:
+            _batch_search_executor.shutdown(wait=False)
+            _batch_search_executor = None
@@ -8,6 +8,11 @@ class NetworkError(AppBaseException):
         super().__init__(message)
 
 
+class DownloadIntegrityError(AppBaseException):
+    def __init__(self, message="Downloaded file failed the integrity check."):
+        super().__init__(message)
+
+
 class PDFLoadError(AppBaseException):
     def __init__(self, message="Failed to load PDF."):
         super().__init__(message)
@@ -89,4 +94,8 @@ class RagChainError(AppBaseException):
 
 class DatabaseError(AppBaseException):
     def __init__(self, message= "Error occurred in saving chats to the database."):
-        super().__init__(message)
\ No newline at end of file
+        super().__init__(message)
+
+class VectorStoreNotReadyError(AppBaseException):
+    def __init__(self, message= "Vector store is not ready yet. Please try again shortly."):
+        super().__init__(message)
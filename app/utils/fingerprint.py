@@ -1,16 +1,46 @@
 import json
 import hashlib
+import os
+import re
 from app.config.config import RAGConfig
+from app.services.data_ingestion.data_loader import DATA_DIR
+from app.services.data_ingestion.chunk_artifact import chunk_artifact_dir, load_chunk_artifact
 
+CHUNK_ID_PATTERN = re.compile(r"[0-9a-f]{32}")
 
 
 
-# def compute_doc_hash(docs):
-#     """Compute hash based on chunk text content."""
-#     sha = hashlib.sha256()
-#     for d in docs:
-#         sha.update(d.page_content.strip().encode("utf-8"))
-#     return sha.hexdigest()
+
+def compute_doc_hash(config: RAGConfig):
+    """Hash of the processed chunk texts, read from the persisted chunk artifact.
+
+    Cheap (no PDF parsing): None until an artifact exists for the current
+    PDF and preprocessing/chunking parameters.
+    """
+    artifact = load_chunk_artifact(chunk_artifact_dir(config, f"{DATA_DIR}/{config.pdfname}"))
+    return artifact.content_hash if artifact is not None else None
+
+
+
+def compute_chunk_id(chunk) -> str:
+    """Stable, content-derived vector ID for a chunk (source + page + text).
+
+    Unlike positional IDs, a chunk keeps its ID when other chunks change, so
+    re-ingestion can diff against the manifest of already upserted IDs.
+    """
+    sha = hashlib.sha256()
+    sha.update(str(chunk.metadata.get("source")).encode("utf-8"))
+    sha.update(b"\x00")
+    sha.update(str(chunk.metadata.get("page")).encode("utf-8"))
+    sha.update(b"\x00")
+    sha.update(chunk.page_content.encode("utf-8"))
+    return sha.hexdigest()[:32]
+
+
+
+def is_chunk_id(vector_id: str) -> bool:
+    '''True if the ID has the compute_chunk_id format (legacy positional IDs do not)'''
+    return bool(CHUNK_ID_PATTERN.fullmatch(vector_id))
 
 
 
@@ -18,16 +48,48 @@ def compute_fingerprint(config: RAGConfig) -> str:
     ''' compute a fingerprint'''
     
     fingerprint_payload = {
-        # you can add doc_hash here  but it will add latency ("doc_hash": doc_hash)
-        # since we need to load and process pdf on every run
+        "doc_hash": compute_doc_hash(config),
         "vector-client": config.pinecone_vector_client.__class__.__name__,
+        "vector_backend": config.vector_backend,
         "embedding_client": config.openai_client.__class__.__name__ ,
         "dimension": config.dim,
         "dense_model": config.dense_model,
+        "sparse_encoder": config.sparse_encoder,
         "chunk_size": config.chunk_size,
         "chunk_overlap": config.chunk_overlap,
         "index": config.index_name,
         "namespace": config.name_space,
     }
     serialized = json.dumps(fingerprint_payload, sort_keys=True).encode("utf-8")
-    return hashlib.sha256(serialized).hexdigest()
\ No newline at end of file
+    return hashlib.sha256(serialized).hexdigest()
+
+
+
+def compute_agent_fingerprint(config: RAGConfig, prompt_path: str) -> str:
+    ''' compute a fingerprint of everything the compiled agent depends on'''
+
+    #stat instead of reading the prompt file so the check stays cheap per request
+    prompt_stat = os.stat(prompt_path)
+    fingerprint_payload = {
+        "model_name": config.model_name,
+        "model_temperature": config.model_temperature,
+        "vector_backend": config.vector_backend,
+        "index": config.index_name,
+        "namespace": config.name_space,
+        "dense_model": config.dense_model,
+        "dimension": config.dim,
+        "top_ret_doc": config.top_ret_doc,
+        "alpha": config.alpha,
+        "merge_chunks": config.merge_chunks,
+        "duplicate_threshold": config.duplicate_threshold,
+        "mmr_enabled": config.mmr_enabled,
+        "mmr_lambda": config.mmr_lambda,
+        "mmr_fetch_factor": config.mmr_fetch_factor,
+        "max_prompt_tokens": config.max_prompt_tokens,
+        "max_history_tokens": config.max_history_tokens,
+        "prompt_path": prompt_path,
+        "prompt_mtime": prompt_stat.st_mtime_ns,
+        "prompt_size": prompt_stat.st_size,
+    }
+    serialized = json.dumps(fingerprint_payload, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(serialized).hexdigest()
@@ -0,0 +1,102 @@
+import random
+import threading
+import time
+from app.utils.loggers import get_logger
+
+logger = get_logger(__name__)
+
+_RATE_LIMIT_MARKERS = ("429", "rate limit", "ratelimit", "too many requests", "resource_exhausted")
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    '''True if the exception (or one it wraps) is a provider rate-limit response'''
+    while exc is not None:
+        if getattr(exc, "status_code", None) == 429 or getattr(exc, "status", None) == 429:
+            return True
+        if type(exc).__name__ == "RateLimitError":
+            return True
+        if any(m in str(exc).lower() for m in _RATE_LIMIT_MARKERS):
+            return True
+        #our domain errors re-raise provider errors inside an except block
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class AdaptiveTokenBucket:
+    """Thread-safe token bucket whose refill rate adapts to rate-limit feedback.
+
+    The rate is halved on every rate-limit response (down to `min_rate`) and
+    grows back additively on successes (up to `max_rate`), so throughput
+    settles just under the provider quota instead of a fixed sleep.
+    """
+
+    def __init__(self, rate: float, capacity: float = None, min_rate: float = 0.1, max_rate: float = None,
+                 increase_step: float = 0.05):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate or rate * 4
+        self.increase_step = increase_step
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+
+    def acquire(self, tokens: float = 1.0):
+        '''Block until `tokens` are available, then consume them'''
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+
+    def on_rate_limited(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            #drain the bucket so every worker backs off, not just the one that got the 429
+            self._tokens = 0.0
+            self._updated_at = time.monotonic()
+        logger.warning(f"Rate limited, reducing request rate to {self.rate:.2f}/s")
+
+
+def call_with_retry(fn, *args, max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 60.0,
+                    limiter: AdaptiveTokenBucket = None, **kwargs):
+    '''Call fn, retrying failures with exponential backoff and jitter.
+
+    When a limiter is given, a token is acquired before every attempt and the
+    limiter is told about rate-limit responses and successes.
+    '''
+    for attempt in range(max_retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            rate_limited = is_rate_limit_error(e)
+            if limiter and rate_limited:
+                limiter.on_rate_limited()
+            if attempt == max_retries:
+                raise
+            delay = min(max_delay, base_delay * (2 ** attempt)) * (0.5 + random.random())
+            logger.warning(f"Attempt {attempt + 1} of {getattr(fn, '__name__', fn)} failed "
+                           f"({'rate limited' if rate_limited else e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            continue
+        if limiter:
+            limiter.on_success()
+        return result
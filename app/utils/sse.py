@@ -0,0 +1,9 @@
+import json
+
+
+def format_sse(data: dict, event: str | None = None) -> str:
+    '''Format a payload as a Server-Sent Events message'''
+    message = f"data: {json.dumps(data)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
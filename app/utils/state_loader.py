@@ -1,7 +1,10 @@
 import yaml
+import json
+import os
 from pathlib import Path
 
 STATE_FILE = Path("rag_state.yaml")
+MANIFEST_DIR = Path("data/manifests")
 
 def load_state():
     if not STATE_FILE.exists():
@@ -12,3 +15,26 @@ def load_state():
 def save_state(state):
     with open(STATE_FILE, "w") as f:
         yaml.safe_dump(state, f)
+
+
+def _manifest_path(index_name: str, name_space: str, backend: str = "pinecone") -> Path:
+    #pinecone manifests keep their original unprefixed names
+    prefix = "" if backend == "pinecone" else f"{backend}__"
+    return MANIFEST_DIR / f"{prefix}{index_name}__{name_space}.json"
+
+def load_manifest(index_name: str, name_space: str, backend: str = "pinecone"):
+    """Return the set of chunk IDs upserted to index/namespace, or None if never recorded"""
+    path = _manifest_path(index_name, name_space, backend)
+    if not path.exists():
+        return None
+    with open(path, "r") as f:
+        return set(json.load(f)["chunk_ids"])
+
+def save_manifest(index_name: str, name_space: str, chunk_ids, backend: str = "pinecone"):
+    MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+    path = _manifest_path(index_name, name_space, backend)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"chunk_ids": sorted(chunk_ids)}, f)
+    #atomic replace so a crash never leaves a half-written manifest
+    os.replace(tmp_path, path)
@@ -0,0 +1,62 @@
+"""Micro-benchmark: post-retrieval chunk merging and near-duplicate removal.
+
+The retrieved chunks are sliced from synthetic pages like the splitter does
+(chunk_size characters, chunk_overlap shared with the next chunk): a third of
+them are consecutive chunks of the same page, a few are reworded copies of
+others (as left by repeated passages in the source), the rest are unrelated.
+
+Run from the repository root:
+    python -m benchmarks.bench_chunk_merge
+"""
+import random
+import timeit
+from app.services.retriever.build_retriever import RetrievedChunk
+from app.services.retriever.chunk_merger import ChunkMerger
+
+CHUNK_SIZE = 850  # knowledge_base.chunk_size as configured
+CHUNK_OVERLAP = 100
+TOP_KS = (5, 20, 50)
+
+
+def make_page(words, n_chars):
+    text = ""
+    while len(text) < n_chars:
+        text += " ".join(random.choices(words, k=20)) + ".\n"
+    return text
+
+
+def make_chunks(k, words):
+    chunks = []
+    while len(chunks) < k:
+        page = len(chunks)
+        text = make_page(words, 4 * CHUNK_SIZE)
+        step = CHUNK_SIZE - CHUNK_OVERLAP
+        #every third hit brings its neighbours on the page along
+        run = 3 if page % 3 == 0 else 1
+        for start in range(0, run * step, step):
+            chunks.append(RetrievedChunk(id=f"{page}-{start}", text=text[start:start + CHUNK_SIZE],
+                                         score=random.random(), page=page, source="bench.pdf"))
+    for i in range(0, k, 10):
+        #near-duplicate: same passage with a few words changed, on another page
+        copy = chunks[i].text.replace(" a", " the", 3)
+        chunks[-1 - i // 10] = RetrievedChunk(id=f"dup-{i}", text=copy, score=random.random(),
+                                              page=10_000 + i, source="bench.pdf")
+    return chunks[:k]
+
+
+def main():
+    random.seed(0)
+    words = ["".join(random.choices("abcdefghijklmnopqrstuvwxyz", k=random.randint(1, 9))) for _ in range(5000)]
+    merger = ChunkMerger(CHUNK_OVERLAP)
+    print(f"chunk_size={CHUNK_SIZE} chunk_overlap={CHUNK_OVERLAP}")
+    print(f"{'top_k':>6} {'chunks out':>11} {'chars in':>9} {'chars out':>10} {'time (ms)':>10}")
+    for k in TOP_KS:
+        chunks = make_chunks(k, words)
+        merged = merger(chunks)
+        seconds = min(timeit.repeat(lambda: merger(chunks), number=200, repeat=5)) / 200
+        print(f"{k:>6} {len(merged):>11} {sum(len(c.text) for c in chunks):>9} "
+              f"{sum(len(c.text) for c in merged):>10} {seconds * 1e3:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
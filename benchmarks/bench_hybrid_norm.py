@@ -0,0 +1,66 @@
+"""Micro-benchmark: per-element hybrid score normalization vs the NumPy float32 batch version.
+
+Query embeddings now arrive as float32 buffers (base64 decoded with np.frombuffer),
+so the batch version is timed on those; "numpy from lists" also includes the
+list -> float32 conversion, for inputs that are still Python lists.
+
+Run from the repository root:
+    python -m benchmarks.bench_hybrid_norm
+"""
+import random
+import timeit
+import numpy as np
+from app.services.retriever.hybrid_retriever import HybridRetriever
+
+DIM = 1024  # text-embedding-3-large as configured
+SPARSE_NNZ = 40
+ALPHA = 0.25
+BATCH_SIZES = (1, 32, 1024)
+
+
+def list_comprehension_norm(dense, sparse, alpha):
+    '''The previous per-query implementation'''
+    hs = {
+        'indices': sparse['sparse_indices'],
+        'values':  [v * (1 - alpha) for v in sparse['sparse_values']]
+    }
+    return [v * alpha for v in dense], hs
+
+
+def make_queries(n):
+    dense = [[random.uniform(-1, 1) for _ in range(DIM)] for _ in range(n)]
+    sparse = [{"sparse_indices": random.sample(range(100000), SPARSE_NNZ),
+               "sparse_values": [random.random() for _ in range(SPARSE_NNZ)]} for _ in range(n)]
+    return dense, sparse
+
+
+def best_time(fn, n, repeat=5):
+    number = max(1, 2000 // n)
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def main():
+    retriever = HybridRetriever(None, "bench-index", "bench-namespace")
+    print(f"dim={DIM} sparse_nnz={SPARSE_NNZ}")
+    print(f"{'queries':>8} {'list comp (ms)':>15} {'numpy from lists (ms)':>22} "
+          f"{'numpy float32 (ms)':>19} {'speedup':>8}")
+    for n in BATCH_SIZES:
+        dense, sparse = make_queries(n)
+        dense_f32 = [np.asarray(d, dtype=np.float32) for d in dense]
+
+        def loop():
+            return [list_comprehension_norm(d, s, ALPHA) for d, s in zip(dense, sparse)]
+
+        def batch_from_lists():
+            return retriever.hybrid_score_norm_batch(dense, sparse, ALPHA)
+
+        def batch():
+            return retriever.hybrid_score_norm_batch(dense_f32, sparse, ALPHA)
+
+        loop_s, lists_s, batch_s = best_time(loop, n), best_time(batch_from_lists, n), best_time(batch, n)
+        print(f"{n:>8} {loop_s * 1e3:>15.3f} {lists_s * 1e3:>22.3f} {batch_s * 1e3:>19.3f} "
+              f"{loop_s / batch_s:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,62 @@
-from app.routes.rag_routes import router as rag_router
+from app.routes.rag_routes import router as rag_router, vector_readiness, sys_config, config_filepath
+from app.utils.concurrency import configure_blocking_pool, configure_fanout_pool, configure_batch_search_pool, shutdown_blocking_pool, run_blocking
+from app.services.embedding_generation.query_cache import query_embedding_cache
+from app.services.embedding_generation.query_batcher import query_embedding_batcher
+from app.services.answer_cache import answer_cache
+from app.services.rag_chain import checkpointer
+from app.services.agent_registry import agent_registry
+from app.services.vector_db.index_pool import index_pool_registry
+from app.services.vector_db.backends.factory import create_vector_backend
+from app.services.prompting.context_assembler import load_encoding
+from app.utils.loggers import get_logger
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
 import gradio as gr
 from app.gradio_ui.gradio_app import demo
 from app.database import engine, Base
 
-app = FastAPI(title="RAG Assistant API")
+logger = get_logger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    #bounded pool for blocking I/O awaited from async routes
+    configure_blocking_pool(sys_config.blocking_workers)
+    configure_fanout_pool(sys_config.fanout_workers)
+    configure_batch_search_pool(sys_config.batch_search_workers)
+    query_embedding_cache.configure(sys_config.query_cache_size,
+                                    sys_config.query_cache_ttl,
+                                    sys_config.query_cache_persistent)
+    await run_blocking(query_embedding_cache.prune_persistent)
+    query_embedding_batcher.configure(sys_config.query_batch_max_wait_ms,
+                                      sys_config.query_batch_max_size,
+                                      sys_config.query_batch_enabled)
+    checkpointer.configure(sys_config.max_sessions, sys_config.session_ttl)
+    #tokenizer files loaded before the first prompt is budgeted (TIKTOKEN_CACHE_DIR avoids the download)
+    await run_blocking(load_encoding, sys_config.model_name)
+    #agent settings edited in config.yaml are picked up on the next request
+    agent_registry.configure(config_filepath)
+    answer_cache.configure(sys_config.answer_cache_size,
+                           sys_config.answer_cache_threshold,
+                           sys_config.answer_cache_enabled)
+    #long-lived gRPC handles shared by retrieval and ingestion, connected before the first request
+    index_pool_registry.configure(sys_config.grpc_pool_size,
+                                  sys_config.grpc_pool_threads,
+                                  sys_config.grpc_timeout,
+                                  sys_config.grpc_keepalive_time_ms,
+                                  sys_config.grpc_keepalive_timeout_ms)
+    try:
+        await run_blocking(create_vector_backend(sys_config).warm_up)
+    except Exception as e:
+        #e.g. the index does not exist yet: handles are opened lazily once it does
+        logger.warning(f"Vector backend warm-up failed: {e}")
+    #resolve vector store state once, off the request path
+    vector_readiness.refresh_in_background()
+    yield
+    index_pool_registry.close_all()
+    shutdown_blocking_pool()
+
+
+app = FastAPI(title="RAG Assistant API", lifespan=lifespan)
 
 app.include_router(rag_router)
 
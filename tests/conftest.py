@@ -0,0 +1,7 @@
+import os
+import tempfile
+
+#the app modules read these at import time; tests never reach the real services
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.gettempdir()}/rag_tests.db")
+os.environ.setdefault("PINECONE_API_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
@@ -0,0 +1,62 @@
+import os
+import shutil
+import pytest
+from app.config.config import RAGConfig
+from app.services import agent_registry as registry_module
+from app.services.agent_registry import AgentRegistry
+
+CONFIG_PATH = "app/config/config.yaml"
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    built = []
+
+    def fake_build_agent(config, prompt_path):
+        built.append(config)
+        return object()
+
+    monkeypatch.setattr(registry_module, "build_agent", fake_build_agent)
+    return built
+
+
+def edit(path, old, new):
+    with open(path) as f:
+        text = f.read()
+    with open(path, "w") as f:
+        f.write(text.replace(old, new))
+    #make the change visible even within the file system's timestamp resolution
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+
+def test_edited_config_rebuilds_the_agent(builds, tmp_path):
+    config_path = str(tmp_path / "config.yaml")
+    shutil.copy(CONFIG_PATH, config_path)
+    config = RAGConfig.from_yaml(config_path)
+    registry = AgentRegistry()
+    registry.configure(config_path)
+
+    agent = registry.get_agent(config)
+    assert registry.get_agent(config) is agent
+    assert len(builds) == 1
+
+    edit(config_path, f"top_ret_doc: {config.top_ret_doc} ", f"top_ret_doc: {config.top_ret_doc + 1} ")
+    assert registry.get_agent(config) is not agent
+    assert builds[-1].top_ret_doc == config.top_ret_doc + 1
+    #unchanged file: no reload, no rebuild
+    registry.get_agent(config)
+    assert len(builds) == 2
+
+
+def test_broken_config_keeps_the_previous_agent(builds, tmp_path):
+    config_path = str(tmp_path / "config.yaml")
+    shutil.copy(CONFIG_PATH, config_path)
+    config = RAGConfig.from_yaml(config_path)
+    registry = AgentRegistry()
+    registry.configure(config_path)
+    agent = registry.get_agent(config)
+
+    edit(config_path, "retriever:", "retriever: [")
+    assert registry.get_agent(config) is agent
+    assert len(builds) == 1
@@ -0,0 +1,77 @@
+import random
+import numpy as np
+from app.services.retriever.build_retriever import RetrievedChunk
+from app.services.retriever.chunk_merger import ChunkMerger, near_duplicate_matrix
+
+OVERLAP = 100
+
+
+def page_text(seed, n_chars=3000):
+    rng = random.Random(seed)
+    words = ["".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 9))) for _ in range(400)]
+    return " ".join(rng.choices(words, k=n_chars // 4))[:n_chars]
+
+
+def slices(text, n, size=600, step=500):
+    '''Consecutive chunks of a page, overlapping like the splitter's chunk_overlap'''
+    return [text[start:start + size] for start in range(0, n * step, step)]
+
+
+def chunk(id, text, score, page=1, source="doc.pdf"):
+    return RetrievedChunk(id=id, text=text, score=score, page=page, source=source)
+
+
+def test_overlapping_chunks_of_a_page_are_merged():
+    text = page_text(0)
+    first, second, third = slices(text, 3)
+    merged = ChunkMerger(OVERLAP).merge_overlaps([chunk("c", third, 0.5), chunk("a", first, 0.7),
+                                                  chunk("b", second, 0.9)])
+    assert len(merged) == 1
+    assert merged[0].text == text[:1600]
+    assert merged[0].id == "a+b+c"
+    assert merged[0].score == 0.9
+
+
+def test_chunks_of_other_pages_or_sources_are_not_merged():
+    first, second = slices(page_text(1), 2)
+    chunks = [chunk("a", first, 0.9), chunk("b", second, 0.8, page=2), chunk("c", second, 0.7, source="other.pdf")]
+    assert ChunkMerger(OVERLAP).merge_overlaps(chunks) == chunks
+
+
+def test_near_duplicate_on_another_page_is_dropped():
+    text = slices(page_text(2), 1)[0]
+    copy = text.replace(" ", "  ", 3).upper()
+    other = slices(page_text(3), 1)[0]
+    chunks = [chunk("copy", copy, 0.6, page=7), chunk("orig", text, 0.8), chunk("other", other, 0.7, page=3)]
+    assert [c.id for c in ChunkMerger(OVERLAP).drop_near_duplicates(chunks)] == ["orig", "other"]
+
+
+def test_distinct_chunks_are_kept():
+    chunks = [chunk(str(i), slices(page_text(10 + i), 1)[0], 0.5, page=i) for i in range(5)]
+    assert ChunkMerger(OVERLAP)(chunks) == chunks
+
+
+def test_empty_and_single_input():
+    merger = ChunkMerger(OVERLAP)
+    assert merger([]) == []
+    only = [chunk("a", page_text(4, 600), 0.5)]
+    assert merger(only) == only
+
+
+def test_near_duplicate_matrix():
+    texts = [slices(page_text(5), 1)[0], slices(page_text(6), 1)[0]]
+    containment = near_duplicate_matrix(texts + texts[:1])
+    assert np.allclose(np.diag(containment), 1)
+    assert containment[0, 2] == containment[2, 0] == 1
+    assert containment[0, 1] < 0.2
+
+
+def test_higher_scoring_chunk_inside_a_longer_one_is_kept():
+    text = page_text(7)
+    inner = text[1000:1600]
+    chunks = [chunk("inner", inner, 0.9), chunk("outer", text, 0.5, page=2)]
+    #the longer chunk is not a near-duplicate of the shorter one: both are kept
+    assert ChunkMerger(OVERLAP).drop_near_duplicates(chunks) == chunks
+    #the other way around, the contained chunk goes
+    chunks = [chunk("inner", inner, 0.5), chunk("outer", text, 0.9, page=2)]
+    assert [c.id for c in ChunkMerger(OVERLAP).drop_near_duplicates(chunks)] == ["outer"]
@@ -0,0 +1,33 @@
+import pytest
+from langchain_core.messages import HumanMessage
+from app.services.prompting import context_assembler
+from app.services.prompting.context_assembler import ContextAssembler
+from app.services.retriever.build_retriever import RetrievedChunk
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    #no tokenizer: 4 characters per token
+    monkeypatch.setattr(context_assembler, "get_encoding", lambda model_name: None)
+
+
+def chunk(id, n_tokens, score):
+    return RetrievedChunk(id=id, text=id[0] * (4 * n_tokens), score=score)
+
+
+def test_large_chunk_does_not_drop_smaller_ones_that_fit():
+    assembler = ContextAssembler("model", max_prompt_tokens=100, max_history_tokens=50)
+    chunks = [chunk("small", 20, 0.5), chunk("large", 200, 0.9), chunk("tiny", 10, 0.3)]
+    context = assembler.assemble("sys", chunks, [HumanMessage("hi")])
+    assert context.usage["chunks_kept"] == 2
+    assert context.usage["chunks_dropped"] == 1
+    #kept chunks stay in retrieval order
+    assert context.system_prompt == "sys\n\n" + "s" * 80 + "\n\n" + "t" * 40
+    assert context.usage["prompt_tokens"] <= 100
+
+
+def test_chunks_are_kept_best_score_first():
+    assembler = ContextAssembler("model", max_prompt_tokens=40, max_history_tokens=50)
+    chunks = [chunk("low", 20, 0.1), chunk("high", 20, 0.9)]
+    context = assembler.assemble("sys", chunks, [HumanMessage("hi")])
+    assert context.system_prompt == "sys\n\n" + "h" * 80
@@ -0,0 +1,176 @@
+import hashlib
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pymupdf
+import pytest
+from app.services.data_ingestion import data_loader
+from app.services.data_ingestion.data_processor import iter_medical_filter_docs
+from app.services.data_ingestion.parallel_loader import parse_page_range
+from app.utils.exceptions import DownloadIntegrityError
+
+CONTENT = bytes(range(256)) * 400
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves `content` with ETag, Range and If-Range support; can drop a connection midway."""
+
+    content = CONTENT
+    etag = '"v1"'
+    #bytes sent before the connection is dropped, per response (None: send everything)
+    truncate = []
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        type(self).requests.append(dict(self.headers))
+        content = type(self).content
+        start = 0
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and (if_range is None or if_range == type(self).etag):
+            start = int(range_header.split("=")[1].split("-")[0])
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(content)}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}")
+        else:
+            self.send_response(200)
+        body = content[start:]
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", type(self).etag)
+        self.end_headers()
+        limit = type(self).truncate.pop(0) if type(self).truncate else None
+        self.wfile.write(body if limit is None else body[:limit])
+        if limit is not None:
+            self.close_connection = True
+
+
+@pytest.fixture
+def server(monkeypatch):
+    RangeHandler.content = CONTENT
+    RangeHandler.etag = '"v1"'
+    RangeHandler.truncate = []
+    RangeHandler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    state = {}
+    monkeypatch.setattr(data_loader, "load_state", lambda: dict(state))
+    monkeypatch.setattr(data_loader, "save_state", lambda new_state: state.update(new_state))
+    monkeypatch.setattr(data_loader.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(data_loader, "DOWNLOAD_CHUNK_BYTES", 4096)
+    data_loader._verified.clear()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/doc.pdf", state
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_download_records_checksum(server, tmp_path):
+    url, state = server
+    data_loader.download_data(url, "doc.pdf", data_dir=str(tmp_path))
+    assert read(tmp_path / "doc.pdf") == CONTENT
+    assert state["pdf"] == {"name": "doc.pdf", "sha256": sha256(CONTENT), "size": len(CONTENT)}
+    assert not os.path.exists(tmp_path / "doc.pdf.part")
+
+
+def test_interrupted_download_resumes_with_if_range(server, tmp_path):
+    url, _ = server
+    RangeHandler.truncate = [30000]
+    data_loader.download_data(url, "doc.pdf", data_dir=str(tmp_path))
+    assert read(tmp_path / "doc.pdf") == CONTENT
+    assert len(RangeHandler.requests) == 2
+    resumed = RangeHandler.requests[-1]
+    assert 0 < int(resumed["Range"].split("=")[1].rstrip("-")) <= 30000
+    assert resumed["If-Range"] == '"v1"'
+
+
+def test_changed_remote_file_is_not_appended_to_stale_part(server, tmp_path):
+    url, _ = server
+    (tmp_path / "doc.pdf.part").write_bytes(b"x" * 1000)
+    (tmp_path / "doc.pdf.part.validator").write_text('"v0"')
+    data_loader.download_data(url, "doc.pdf", data_dir=str(tmp_path))
+    #If-Range did not match: the server sent the whole file, which replaced the part
+    assert read(tmp_path / "doc.pdf") == CONTENT
+
+
+def test_part_without_validator_restarts(server, tmp_path):
+    url, _ = server
+    (tmp_path / "doc.pdf.part").write_bytes(CONTENT[:1000])
+    data_loader.download_data(url, "doc.pdf", data_dir=str(tmp_path))
+    assert "Range" not in RangeHandler.requests[0]
+    assert read(tmp_path / "doc.pdf") == CONTENT
+
+
+def test_416_with_complete_part(server, tmp_path):
+    url, _ = server
+    (tmp_path / "doc.pdf.part").write_bytes(CONTENT)
+    (tmp_path / "doc.pdf.part.validator").write_text('"v1"')
+    data_loader.download_data(url, "doc.pdf", data_dir=str(tmp_path))
+    assert len(RangeHandler.requests) == 1
+    assert read(tmp_path / "doc.pdf") == CONTENT
+
+
+def test_416_with_oversized_part_restarts(server, tmp_path):
+    url, _ = server
+    (tmp_path / "doc.pdf.part").write_bytes(CONTENT + b"stale tail")
+    (tmp_path / "doc.pdf.part.validator").write_text('"v1"')
+    data_loader.download_data(url, "doc.pdf", data_dir=str(tmp_path))
+    assert len(RangeHandler.requests) == 2
+    assert read(tmp_path / "doc.pdf") == CONTENT
+
+
+def test_checksum_mismatch(server, tmp_path):
+    url, _ = server
+    with pytest.raises(DownloadIntegrityError):
+        data_loader.download_data(url, "doc.pdf", data_dir=str(tmp_path), expected_sha256="0" * 64)
+    assert not os.path.exists(tmp_path / "doc.pdf")
+    assert not os.path.exists(tmp_path / "doc.pdf.part")
+
+
+def test_ensure_pdf_redownloads_a_corrupted_file(server, tmp_path):
+    url, _ = server
+    path = data_loader.ensure_pdf(url, "doc.pdf", expected_sha256=sha256(CONTENT), data_dir=str(tmp_path))
+    assert len(RangeHandler.requests) == 1
+    #verified once per file version: no new download
+    data_loader.ensure_pdf(url, "doc.pdf", data_dir=str(tmp_path))
+    assert len(RangeHandler.requests) == 1
+
+    with open(path, "r+b") as f:
+        f.write(b"corrupted")
+    data_loader.ensure_pdf(url, "doc.pdf", data_dir=str(tmp_path))
+    assert len(RangeHandler.requests) == 2
+    assert read(path) == CONTENT
+
+
+def test_serial_loader_never_parses_front_matter(monkeypatch, tmp_path):
+    pdf_path = str(tmp_path / "doc.pdf")
+    with pymupdf.open() as pdf:
+        for i in range(5):
+            pdf.new_page().insert_text((72, 72), f"Page {i} text")
+        pdf.save(pdf_path)
+    monkeypatch.setattr(data_loader, "ensure_pdf", lambda url, pdfname: pdf_path)
+    parsed = []
+    get_text = pymupdf.Page.get_text
+    monkeypatch.setattr(pymupdf.Page, "get_text", lambda page, *a, **kw: parsed.append(page.number) or
+                        get_text(page, *a, **kw))
+
+    docs = list(iter_medical_filter_docs(data_loader.iter_pdf_pages("url", "doc.pdf", skip_pages=2), skip_pages=0))
+    assert parsed == [2, 3, 4]
+    #same pages and text as the parallel loader
+    assert [(d.metadata["page"], d.page_content) for d in docs] == parse_page_range(pdf_path, 2, 5)
@@ -0,0 +1,69 @@
+import pytest
+from app.services.embedding_generation.embedding_store import DocEmbeddingStore
+from app.services.embedding_generation.sparse_encoder import BM25SparseEncoder
+from app.services.vector_db import vector_store
+from app.services.vector_db.vector_store import VectorStoreService
+
+TEXTS = ["aspirin reduces fever", "ibuprofen reduces pain", "rest helps recovery"]
+DIM = 4
+
+
+class FakeProviders:
+    """Records the texts sent to the dense and hosted sparse embedding APIs."""
+
+    def __init__(self):
+        self.dense_calls = []
+        self.sparse_calls = []
+
+    def dense(self, text_input, dense_model, dim, openai_client):
+        self.dense_calls.append(list(text_input))
+        return [[float(len(text))] * dim for text in text_input]
+
+    def sparse(self, pinecone_vector_client, text_input):
+        self.sparse_calls.append(list(text_input))
+        return [{"sparse_indices": [len(text)], "sparse_values": [1.0]} for text in text_input]
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    fake = FakeProviders()
+    monkeypatch.setattr(vector_store, "generate_dense_embeddings", fake.dense)
+    monkeypatch.setattr(vector_store, "generate_sparse_embeddings", fake.sparse)
+    return fake
+
+
+def service(store_dir, sparse_encoder=None):
+    return VectorStoreService(None, None, "index", DIM, "ns", "dense-model", batch_size=8, workers=1,
+                              requests_per_second=1000, max_retries=0,
+                              embedding_store=DocEmbeddingStore(str(store_dir), "dense-model", DIM),
+                              backend=object(), sparse_encoder=sparse_encoder)
+
+
+def test_switching_sparse_encoder_reuses_dense_embeddings(providers, tmp_path):
+    dense, sparse, n_embedded = service(tmp_path).embed_batch(TEXTS)
+    assert n_embedded == 3
+    assert providers.dense_calls == [TEXTS]
+
+    encoder = BM25SparseEncoder.fit(TEXTS)
+    local_dense, local_sparse, n_embedded = service(tmp_path, encoder).embed_batch(TEXTS)
+    #no dense API call: the vectors come from the existing store
+    assert n_embedded == 0
+    assert len(providers.dense_calls) == 1
+    assert local_dense == dense
+    assert local_sparse == encoder.encode_documents(TEXTS)
+
+
+def test_chunks_embedded_with_a_local_encoder_get_hosted_sparse_vectors(providers, tmp_path):
+    encoder = BM25SparseEncoder.fit(TEXTS)
+    service(tmp_path, encoder).embed_batch(TEXTS[:2])
+    assert providers.sparse_calls == []
+
+    dense, sparse, n_embedded = service(tmp_path).embed_batch(TEXTS)
+    #only the new text is sent for a dense vector; hosted sparse vectors are fetched for all three
+    assert providers.dense_calls == [TEXTS[:2], TEXTS[2:]]
+    assert providers.sparse_calls == [TEXTS]
+    assert n_embedded == 1
+    assert sparse == [{"sparse_indices": [len(text)], "sparse_values": [1.0]} for text in TEXTS]
+
+    #the store keeps the hosted vector of the chunk first embedded with it
+    assert DocEmbeddingStore(str(tmp_path), "dense-model", DIM).get_many(TEXTS)[2][1] == sparse[2]
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from app.services.vector_db import ensure_vector
+from app.services.vector_db.ensure_vector import create_vectors, ingest_lock
+
+
+def test_concurrent_ingests_do_not_overlap(monkeypatch, tmp_path):
+    monkeypatch.setattr(ensure_vector, "INGEST_LOCK_FILE", str(tmp_path / "ingest.lock"))
+    monkeypatch.setattr(ensure_vector, "compute_fingerprint", lambda config: "fp")
+    running, overlaps = [], []
+    guard = threading.Lock()
+
+    def fake_ensure(create_fn, fingerprint, config):
+        with guard:
+            running.append(1)
+            if len(running) > 1:
+                overlaps.append(1)
+        time.sleep(0.02)
+        with guard:
+            running.pop()
+
+    monkeypatch.setattr(ensure_vector, "ensure_embeddings", fake_ensure)
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(create_vectors, [None] * 4))
+    assert overlaps == []
+
+
+def test_lock_is_held_across_processes(tmp_path):
+    path = str(tmp_path / "ingest.lock")
+    probe = ("import fcntl, sys\n"
+             f"f = open({path!r}, 'a')\n"
+             "try:\n"
+             "    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)\n"
+             "except BlockingIOError:\n"
+             "    sys.exit(1)\n")
+    with ingest_lock(path):
+        #another worker process cannot take the lock while an ingest runs
+        assert subprocess.run([sys.executable, "-c", probe]).returncode == 1
+    assert subprocess.run([sys.executable, "-c", probe]).returncode == 0
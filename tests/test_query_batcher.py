@@ -0,0 +1,121 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.services.embedding_generation import query_embeddings
+from app.services.embedding_generation.query_batcher import QueryEmbeddingBatcher
+
+BAD = "bad input"
+
+
+class FakeProvider:
+    """Embeds each text as its length; fails the whole call if any input is BAD."""
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, texts):
+        with self.lock:
+            self.calls.append(list(texts))
+        if BAD in texts:
+            raise ValueError("input too long")
+        return [len(text) for text in texts], [{"text": text} for text in texts]
+
+    async def acall(self, texts):
+        await asyncio.sleep(0)
+        return self(texts)
+
+
+def embed_concurrently(batcher, provider, texts):
+    def one(text):
+        try:
+            return batcher.embed("key", text, provider)
+        except ValueError as e:
+            return e
+    with ThreadPoolExecutor(len(texts)) as pool:
+        return list(pool.map(one, texts))
+
+
+def test_concurrent_queries_share_one_call():
+    batcher, provider = QueryEmbeddingBatcher(max_wait_ms=2000, max_batch_size=3), FakeProvider()
+    results = embed_concurrently(batcher, provider, ["a", "bb", "ccc"])
+    assert len(provider.calls) == 1
+    assert sorted(provider.calls[0]) == ["a", "bb", "ccc"]
+    assert results == [([1], [{"text": "a"}]), ([2], [{"text": "bb"}]), ([3], [{"text": "ccc"}])]
+    assert batcher.stats()["full_batches"] == 1
+
+
+def test_duplicate_queries_share_one_input():
+    batcher, provider = QueryEmbeddingBatcher(max_wait_ms=200, max_batch_size=8), FakeProvider()
+    results = embed_concurrently(batcher, provider, ["same"] * 4)
+    assert sum(len(call) for call in provider.calls) == len(provider.calls)
+    assert all(result == ([4], [{"text": "same"}]) for result in results)
+
+
+def test_failed_batch_is_retried_one_by_one():
+    batcher, provider = QueryEmbeddingBatcher(max_wait_ms=2000, max_batch_size=3), FakeProvider()
+    results = embed_concurrently(batcher, provider, ["a", BAD, "ccc"])
+    assert results[0] == ([1], [{"text": "a"}])
+    assert isinstance(results[1], ValueError)
+    assert results[2] == ([3], [{"text": "ccc"}])
+    #one batch call, then one call per query
+    assert len(provider.calls) == 4
+    assert batcher.stats()["isolated_retries"] == 3
+
+
+def test_single_query_failure_is_not_retried():
+    batcher, provider = QueryEmbeddingBatcher(max_wait_ms=1), FakeProvider()
+    with pytest.raises(ValueError):
+        batcher.embed("key", BAD, provider)
+    assert len(provider.calls) == 1
+
+
+def test_async_failed_batch_is_retried_one_by_one():
+    batcher, provider = QueryEmbeddingBatcher(max_wait_ms=2000, max_batch_size=3), FakeProvider()
+
+    async def main():
+        return await asyncio.gather(*(batcher.aembed("key", text, provider.acall) for text in ["a", BAD, "ccc"]),
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert results[0] == ([1], [{"text": "a"}])
+    assert isinstance(results[1], ValueError)
+    assert results[2] == ([3], [{"text": "ccc"}])
+    assert provider.calls[0] == ["a", BAD, "ccc"]
+    assert len(provider.calls) == 4
+
+
+def test_async_cancelled_caller_does_not_fail_the_batch():
+    batcher, provider = QueryEmbeddingBatcher(max_wait_ms=50, max_batch_size=8), FakeProvider()
+
+    async def main():
+        first = asyncio.ensure_future(batcher.aembed("key", "a", provider.acall))
+        second = asyncio.ensure_future(batcher.aembed("key", "bb", provider.acall))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(main()) == ([2], [{"text": "bb"}])
+    assert provider.calls == [["a", "bb"]]
+
+
+def test_dense_call_runs_in_the_calling_thread(monkeypatch):
+    threads = []
+
+    def fake_dense(texts, *args):
+        threads.append(threading.current_thread())
+        return [len(text) for text in texts]
+
+    class FakeSparseEncoder:
+        model_id = "bm25"
+
+        def encode_queries(self, texts):
+            return [{"indices": [], "values": []} for _ in texts]
+
+    monkeypatch.setattr(query_embeddings, "_dense_query_embedding", fake_dense)
+    dense, sparse = query_embeddings._embed_texts(["a", "bb"], "model", 3, None, None,
+                                                  sparse_encoder=FakeSparseEncoder())
+    assert dense == [1, 2]
+    assert len(sparse) == 2
+    assert threads == [threading.current_thread()]
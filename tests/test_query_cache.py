@@ -0,0 +1,72 @@
+import pytest
+from sqlalchemy import event
+from app.database import Base, SessionLocal, engine
+from app.models.query_embedding_model import QueryEmbeddingModel
+from app.services.embedding_generation import query_embeddings
+from app.services.embedding_generation.query_cache import QueryEmbeddingCache
+
+QUERIES = ["what is asthma", "treatment of gout", "symptoms of flu"]
+
+
+class InlinePool:
+    def submit(self, fn, *args):
+        return fn(*args)
+
+
+@pytest.fixture
+def statements():
+    '''SQL statements sent to the database while the test runs'''
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.query(QueryEmbeddingModel).delete()
+        db.commit()
+    sent = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        sent.append(statement.split()[0].upper())
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield sent
+    event.remove(engine, "before_cursor_execute", record)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = QueryEmbeddingCache(persistent=True)
+    monkeypatch.setattr(query_embeddings, "query_embedding_cache", cache)
+    return cache
+
+
+def test_batch_misses_cost_one_lookup_and_one_insert(cache, statements, monkeypatch):
+    embedded = []
+
+    def fake_embed(texts, *args, **kwargs):
+        embedded.append(list(texts))
+        return [[float(len(t))] * 4 for t in texts], [{"sparse_indices": [1], "sparse_values": [1.0]} for t in texts]
+
+    monkeypatch.setattr(query_embeddings, "_embed_texts", fake_embed)
+    #write-behind runs inline so the statements can be counted
+    monkeypatch.setattr(query_embeddings, "get_blocking_pool", lambda: InlinePool())
+    dense, _ = query_embeddings.generate_batch_query_embeddings(QUERIES, "model", 4, None, None)
+    assert embedded == [QUERIES]
+    assert dense == [[float(len(q))] * 4 for q in QUERIES]
+    assert statements.count("SELECT") == 1
+    assert statements.count("INSERT") == 1
+
+    #a new process (empty memory tier): every query is served by one database lookup, nothing embedded
+    statements.clear()
+    monkeypatch.setattr(query_embeddings, "query_embedding_cache", QueryEmbeddingCache(persistent=True))
+    dense_again, _ = query_embeddings.generate_batch_query_embeddings(QUERIES, "model", 4, None, None)
+    assert [list(d) for d in dense_again] == dense
+    assert len(embedded) == 1
+    assert statements.count("SELECT") == 1
+    assert query_embeddings.query_embedding_cache.stats()["persistent_hits"] == 3
+
+
+def test_expired_rows_are_misses_and_rewritten(cache, statements):
+    cache.put_persistent_many("model", 4, {"k": ([[1.0] * 4], [{"sparse_indices": [], "sparse_values": []}])})
+    cache.ttl_seconds = -1
+    assert cache.get_persistent_many(["k"]) == {}
+    cache.ttl_seconds = 3600
+    cache.put_persistent_many("model", 4, {"k": ([[2.0] * 4], [{"sparse_indices": [], "sparse_values": []}])})
+    assert list(cache.get_persistent("k")[0][0]) == [2.0] * 4
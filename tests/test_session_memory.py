@@ -0,0 +1,139 @@
+import uuid
+import pytest
+from langchain.agents import create_agent
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+from app.database import Base, SessionLocal, engine
+from app.models.chathistory_model import ChatHistoryModel
+from app.services import session_memory
+from app.services.session_memory import BoundedMemorySaver, KEPT_CHECKPOINTS, load_session_history
+
+
+class RecordPrompts(AgentMiddleware):
+    """Records the conversation each model call is given."""
+
+    def __init__(self):
+        super().__init__()
+        self.prompts = []
+
+    def wrap_model_call(self, request, handler):
+        self.prompts.append([message.text for message in request.messages])
+        return handler(request)
+
+
+def answers():
+    n = 0
+    while True:
+        n += 1
+        yield AIMessage(content=f"answer {n}")
+
+
+def build_agent(checkpointer):
+    recorder = RecordPrompts()
+    agent = create_agent(model=GenericFakeChatModel(messages=answers()), tools=[], middleware=[recorder],
+                         checkpointer=checkpointer)
+    return agent, recorder
+
+
+def ask(agent, thread_id, question, history=None):
+    config = {"configurable": {"thread_id": thread_id}}
+    state = agent.invoke({"messages": [*(history or []), {"role": "user", "content": question}]}, config)
+    return state["messages"][-1].text
+
+
+def put_checkpoint(checkpointer, thread_id):
+    '''Write one checkpoint, like an agent step, to create or use a thread'''
+    agent, _ = build_agent(checkpointer)
+    ask(agent, thread_id, "hello")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_memory.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def db():
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    yield session
+    session.close()
+
+
+def test_multi_turn_continuity_after_pruning():
+    checkpointer = BoundedMemorySaver()
+    agent, recorder = build_agent(checkpointer)
+    for turn in range(1, 6):
+        assert ask(agent, "t", f"question {turn}") == f"answer {turn}"
+
+    #the last call saw the whole conversation, although older checkpoints were pruned
+    assert recorder.prompts[-1] == [text for turn in range(1, 5) for text in (f"question {turn}", f"answer {turn}")] \
+        + ["question 5"]
+    messages = agent.get_state({"configurable": {"thread_id": "t"}}).values["messages"]
+    assert len(messages) == 10
+    assert len(checkpointer.storage["t"][""]) == KEPT_CHECKPOINTS
+    #blobs of pruned checkpoints are freed: only versions the kept checkpoints reference remain
+    kept = [checkpointer._versions[("t", "", checkpoint_id)] for checkpoint_id in checkpointer.storage["t"][""]]
+    referenced = {(channel, version) for versions in kept for channel, version in versions.items()}
+    assert {(channel, version) for (_, _, channel, version) in checkpointer.blobs} <= referenced
+
+
+def test_least_recently_used_session_is_evicted(clock):
+    checkpointer = BoundedMemorySaver(max_sessions=2)
+    put_checkpoint(checkpointer, "a")
+    clock[0] += 1
+    put_checkpoint(checkpointer, "b")
+    clock[0] += 1
+    #reading "a" makes "b" the least recently used
+    checkpointer.get_tuple({"configurable": {"thread_id": "a"}})
+    clock[0] += 1
+    put_checkpoint(checkpointer, "c")
+    assert set(checkpointer.storage) == {"a", "c"}
+    assert checkpointer.stats()["evictions"] == 1
+
+
+def test_idle_session_expires(clock):
+    checkpointer = BoundedMemorySaver(ttl_seconds=60)
+    put_checkpoint(checkpointer, "idle")
+    clock[0] += 30
+    put_checkpoint(checkpointer, "active")
+    clock[0] += 31
+    put_checkpoint(checkpointer, "active")
+    assert set(checkpointer.storage) == {"active"}
+
+
+def test_rehydration_from_chat_history(db):
+    session_id = str(uuid.uuid4())
+    for role, content in [("User", "q1"), ("AI Assistant", "a1"), ("User", "q2"), ("AI Assistant", "a2")]:
+        db.add(ChatHistoryModel(session_id=session_id, role=role, content=content))
+    db.commit()
+    checkpointer = BoundedMemorySaver()
+
+    #not in memory: the last messages are replayed, starting at a question
+    assert load_session_history(session_id, checkpointer, db, max_messages=3) == [
+        {"role": "user", "content": "q2"}, {"role": "assistant", "content": "a2"}]
+
+    agent, recorder = build_agent(checkpointer)
+    history = load_session_history(session_id, checkpointer, db, max_messages=10)
+    assert ask(agent, session_id, "q3", history) == "answer 1"
+    assert recorder.prompts[-1] == ["q1", "a1", "q2", "a2", "q3"]
+
+    db.add(ChatHistoryModel(session_id=session_id, role="User", content="q3"))
+    db.add(ChatHistoryModel(session_id=session_id, role="AI Assistant", content="answer 1"))
+    db.commit()
+    last_row = db.query(ChatHistoryModel).filter(ChatHistoryModel.session_id == session_id) \
+        .order_by(ChatHistoryModel.id.desc()).first()
+    checkpointer.mark_synced(session_id, last_row.id)
+    #in memory and up to date: nothing to replay
+    assert load_session_history(session_id, checkpointer, db, max_messages=10) == []
+
+    checkpointer.delete_thread(session_id)
+    assert [m["content"] for m in load_session_history(session_id, checkpointer, db, max_messages=10)] == \
+        ["q1", "a1", "q2", "a2", "q3", "answer 1"]
+
+
+def test_unknown_session_has_no_history(db):
+    assert load_session_history(str(uuid.uuid4()), BoundedMemorySaver(), db, max_messages=10) == []
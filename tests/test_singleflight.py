@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from app.utils.singleflight import SingleFlight, AsyncSingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def work(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value * 2
+
+    with ThreadPoolExecutor(4) as pool:
+        leader = pool.submit(flight.do, "key", work, 21)
+        started.wait(5)
+        followers = [pool.submit(flight.do, "key", work, 21) for _ in range(3)]
+        #followers join while the leader is still running
+        while flight.stats()["coalesced"] < 3:
+            time.sleep(0.001)
+        release.set()
+        results = [leader.result()] + [future.result() for future in followers]
+
+    assert results == [42] * 4
+    assert calls == [21]
+    assert flight.stats() == {"executions": 1, "coalesced": 3, "in_flight": 0}
+
+
+def test_error_is_shared_and_not_cached():
+    flight = SingleFlight("test")
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+    #nothing is cached: the next call runs again
+    assert flight.do("key", lambda: "ok") == "ok"
+    assert flight.stats()["executions"] == 2
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight("test")
+    assert [flight.do(key, lambda k=key: k) for key in ("a", "b")] == ["a", "b"]
+    assert flight.stats()["coalesced"] == 0
+
+
+def test_async_calls_share_one_execution():
+    flight = AsyncSingleFlight("test")
+    calls = []
+
+    async def work(value):
+        calls.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def main():
+        return await asyncio.gather(*(flight.do("key", work, 21) for _ in range(4)))
+
+    assert asyncio.run(main()) == [42] * 4
+    assert calls == [21]
+    assert flight.stats() == {"executions": 1, "coalesced": 3, "in_flight": 0}
+
+
+def test_async_cancelled_caller_does_not_cancel_the_others():
+    flight = AsyncSingleFlight("test")
+
+    async def work():
+        await asyncio.sleep(0.01)
+        return "done"
+
+    async def main():
+        first = asyncio.ensure_future(flight.do("key", work))
+        second = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == "done"
+
+
+def test_async_error_is_shared_and_not_cached():
+    flight = AsyncSingleFlight("test")
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    async def ok():
+        return "ok"
+
+    async def main():
+        results = await asyncio.gather(flight.do("key", fail), flight.do("key", fail), return_exceptions=True)
+        return results, await flight.do("key", ok)
+
+    results, after = asyncio.run(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert after == "ok"
+    assert flight.stats()["executions"] == 2